@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Замеры SQL и времени запроса; включается MEDIA_INSTRUMENTATION (см. ниже)
+    'media.middleware.QueryInstrumentationMiddleware',
+    # Чтение с основной БД после записи; включается вместе с репликой (MEDIA_DB_REPLICA)
+    'media.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,13 +78,130 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# PRAGMA, выполняемые при открытии соединения SQLite. Журнал WAL (читатели не
+# блокируют писателя и наоборот) включает миграция media 0013: режим хранится в
+# файле БД, а PRAGMA при каждом подключении переписывала бы файл даже у manage.py check.
+# synchronous=NORMAL в режиме WAL не теряет данные при падении процесса (только при
+# отключении питания — последние транзакции); mmap и кэш страниц (в КиБ,
+# отрицательное значение) сокращают чтения с диска.
+SQLITE_PRAGMAS = [
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=20000',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-65536',
+]
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Соединение переиспользуется между запросами потока; перед повторным
+        # использованием проверяется
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Сколько секунд ждать снятия блокировки записи вместо "database is locked"
+            'timeout': 20,
+            # Блокировка записи берется в начале транзакции: иначе транзакция, начавшая
+            # с чтения, получает "database is locked" сразу, без ожидания timeout
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join(SQLITE_PRAGMAS),
+        },
+        'TEST': {
+            # Файл, а не in-memory БД: тесты конкурентности работают из нескольких потоков
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+# Реплика только для чтения (путь к файлу SQLite). Здесь это копия основной БД,
+# которую обновляет manage.py sync_replica; чтение списка, страниц и поиска идет
+# с нее, запись — в основную БД (media/routers.py)
+MEDIA_DB_REPLICA = os.environ.get('MEDIA_DB_REPLICA')
+if MEDIA_DB_REPLICA:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': MEDIA_DB_REPLICA,
+        'OPTIONS': {
+            'timeout': 20,
+            'init_command': ';'.join(SQLITE_PRAGMAS + ['PRAGMA query_only=ON']),
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['media.routers.PrimaryReplicaRouter']
+# Сколько секунд после записи браузер читает с основной БД
+MEDIA_REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# locmem — кэш в памяти процесса. Для нескольких процессов на одной машине
+# используйте общий файловый кэш:
+#     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#     'LOCATION': BASE_DIR / 'cache',
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'media-library',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
+# Время жизни закэшированного контекста страницы медиа (секунды)
+MEDIA_DETAIL_CACHE_TIMEOUT = 300
+
+# Время жизни HTML карточек в списке (секунды); ключи версионированы, так что
+# таймаут лишь ограничивает память, а не свежесть
+MEDIA_CARD_CACHE_TIMEOUT = 3600
+
+# Подсказки поиска (media/autocomplete.py): индекс в памяти процесса пересобирается
+# раз в MEDIA_AUTOCOMPLETE_REFRESH секунд (изменения из других процессов);
+# на запрос просматривается не больше MEDIA_AUTOCOMPLETE_SCAN ключей
+MEDIA_AUTOCOMPLETE_REFRESH = 600
+MEDIA_AUTOCOMPLETE_SCAN = 500
+
+# Наибольшее число действий в одном запросе к api/actions/batch/
+MEDIA_BATCH_MAX_ACTIONS = 500
+
+# Счетчики фасетов (CatalogQuery.get_facets): время жизни в кэше (ключи
+# версионированы по типу медиа) и сколько значений поля отдавать
+MEDIA_FACET_CACHE_TIMEOUT = 3600
+MEDIA_FACET_LIMIT = 20
+
+# Априорное среднее и его вес в байесовской оценке лидерборда (media/leaderboard.py)
+MEDIA_LEADERBOARD_PRIOR_MEAN = 3.0
+MEDIA_LEADERBOARD_PRIOR_WEIGHT = 10
+
+# Замеры запросов (media/middleware.py): заголовок Server-Timing и лог медленных
+# запросов и повторяющихся SQL-запросов (N+1)
+MEDIA_INSTRUMENTATION = os.environ.get('MEDIA_INSTRUMENTATION') == '1'
+MEDIA_SLOW_REQUEST_MS = 500
+MEDIA_DUPLICATE_QUERY_THRESHOLD = 5
+
+# Асинхронные views для запуска под ASGI-сервером (uvicorn и т.п., см. README)
+MEDIA_ASYNC_VIEWS = os.environ.get('MEDIA_ASYNC_VIEWS') == '1'
+
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'media': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -117,6 +239,9 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Загруженные файлы фильмов и аудиокниг; отдаются через media/files.py с поддержкой Range
+MEDIA_ROOT = BASE_DIR / 'uploads'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -14,10 +14,12 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('', include('media.urls'))
+    # Под ASGI (MEDIA_ASYNC_VIEWS=1) страницы обслуживаются асинхронными views
+    path('', include('media.async_urls' if settings.MEDIA_ASYNC_VIEWS else 'media.urls'))
 ]
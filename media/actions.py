@@ -0,0 +1,141 @@
+from django.core.exceptions import FieldDoesNotExist
+
+
+def request_username(request):
+    return request.user.username if request.user.is_authenticated else 'Гость'
+
+
+class MediaAction:
+    """Действие над объектом медиа, объявляемое в миксине или модели.
+
+    handler(obj, request) выполняет действие и возвращает строку результата;
+    condition(obj) решает, показывать ли кнопку для конкретного объекта;
+    скрытые (visible=False) действия доступны через media_action, но не
+    выводятся кнопками; неподдерживаемые (supported=False) вдобавок не входят
+    в набор возможностей типа.
+    """
+
+    def __init__(self, code, label, btn_class='btn-secondary', handler=None, condition=None,
+                 visible=True, supported=True, order=100):
+        self.code = code
+        self.label = label
+        self.btn_class = btn_class
+        self.handler = handler or (lambda obj, request: getattr(obj, code)())
+        self.condition = condition
+        self.visible = visible and supported
+        self.supported = supported
+        self.order = order
+
+    @classmethod
+    def unsupported(cls, code, message):
+        # Действие, которое тип не поддерживает: отвечает сообщением и не входит в возможности
+        return cls(code, code, handler=lambda obj, request: message, supported=False)
+
+    def run(self, obj, request):
+        return self.handler(obj, request)
+
+    def is_available(self, obj):
+        return self.visible and (self.condition is None or self.condition(obj))
+
+    def as_button(self):
+        return self.code, self.label, self.btn_class
+
+
+# Служебные поля моделей: не выдаются в JSON API и выгрузку. Сумма и гистограмма
+# оценок — внутренние агрегаты, наружу идут rating_count и rating_avg
+HIDDEN_FIELDS = frozenset([
+    '_internal_id', 'updated_at', 'borrowed_by', 'media_file', 'rating_sum',
+    *(f'rating_hist_{value}' for value in range(1, 6)),
+])
+
+
+class MediaTypeInfo:
+    def __init__(self, media_type, media_class, label, code):
+        self.media_type = media_type
+        self.media_class = media_class
+        self.label = label
+        self.code = code
+        # Поля данных типа в порядке объявления: новый тип получает их без настройки API и выгрузки
+        self.data_fields = [field.name for field in media_class._meta.concrete_fields
+                            if not field.primary_key and field.name not in HIDDEN_FIELDS]
+        self.actions = self._collect_actions(media_class)
+        self.buttons = sorted((a for a in self.actions.values() if a.visible), key=lambda a: a.order)
+        self.capabilities = frozenset(code for code, action in self.actions.items() if action.supported)
+
+    @staticmethod
+    def _collect_actions(media_class):
+        # Проходим MRO от базовых классов к модели: модель может переопределить действие миксина
+        actions = {}
+        for klass in reversed(media_class.__mro__):
+            for action in klass.__dict__.get('media_actions', ()):
+                actions[action.code] = action
+        return actions
+
+    def has_field(self, name):
+        try:
+            self.media_class._meta.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        return True
+
+
+class ActionRegistry:
+    """Реестр типов медиа и их действий.
+
+    Заполняется один раз при импорте моделей (декоратор register); дальше
+    диспетчеризация действия — поиск в словаре, а наборы возможностей
+    по типам вычислены заранее и общие для views, шаблонов и MediaFactory.
+    """
+
+    def __init__(self):
+        self._types = {}
+        self._by_class = {}
+
+    def register(self, media_type, label, code):
+        """Декоратор модели: регистрирует тип медиа вместе с действиями его миксинов.
+
+        code — стабильный числовой код типа (используется в rowid поискового индекса).
+        """
+        def decorator(media_class):
+            info = MediaTypeInfo(media_type, media_class, label, code)
+            self._types[media_type] = info
+            self._by_class[media_class] = info
+            return media_class
+        return decorator
+
+    def get_type(self, media_type):
+        return self._types.get(media_type)
+
+    def get_data_fields(self, media_type):
+        info = self._types.get(media_type)
+        return list(info.data_fields) if info else []
+
+    def get_media_class(self, media_type):
+        info = self._types.get(media_type)
+        return info.media_class if info else None
+
+    def get_media_types(self):
+        return list(self._types)
+
+    def get_choices(self):
+        return [(media_type, info.label) for media_type, info in self._types.items()]
+
+    def get_action(self, media_type, code):
+        info = self._types.get(media_type)
+        return info.actions.get(code) if info else None
+
+    def get_available_actions(self, media_item):
+        info = self._by_class.get(type(media_item))
+        if info is None:
+            return []
+        return [action.as_button() for action in info.buttons if action.is_available(media_item)]
+
+    def get_capabilities(self, media_type):
+        info = self._types.get(media_type)
+        return info.capabilities if info else frozenset()
+
+    def capabilities_by_type(self):
+        return {media_type: info.capabilities for media_type, info in self._types.items()}
+
+
+registry = ActionRegistry()
@@ -0,0 +1,65 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Value
+from django.db.models.functions import NullIf
+from django.http import HttpResponse
+
+from media.actions import registry
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость: без нее ответы кодирует json
+    orjson = None
+
+# Поля, доступные через ?fields=, — поля данных типа из реестра (actions.HIDDEN_FIELDS
+# не выдаются); id и media_type есть в ответе всегда. Строки выбираются проекцией
+# .values() — модели не создаются. Поля модели, которые в API называются иначе:
+RENAMED = {'rating_avg': 'rating'}
+# Вычисляемые поля: имя в API -> выражение SQL
+EXPRESSIONS = {
+    # У фильма без оценок rating_avg = 0, в API — null (как Movie.get_average_rating)
+    'rating': NullIf(F('rating_avg'), Value(0.0)),
+}
+
+
+def get_fields(media_type):
+    return [RENAMED.get(name, name) for name in registry.get_data_fields(media_type)]
+
+
+def parse_fields(value, media_types):
+    """Разбирает ?fields=title,creator в {тип: [поля]}; пустое значение — все поля.
+
+    Поле, которого нет у типа (genre у книг), для этого типа пропускается;
+    поле, неизвестное всем запрошенным типам, — ValueError.
+    """
+    requested = list(dict.fromkeys(name.strip() for name in (value or '').split(',') if name.strip()))
+    fields = {media_type: get_fields(media_type) for media_type in media_types}
+    if not requested:
+        return fields
+    known = {name for names in fields.values() for name in names}
+    unknown = [name for name in requested if name not in known]
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(unknown)}")
+    return {media_type: [name for name in requested if name in fields[media_type]] for media_type in media_types}
+
+
+def project(queryset, fields, *extra):
+    """queryset.values() с полями API; extra — служебные столбцы (например, ключ курсора)."""
+    columns = [name for name in dict.fromkeys(['id', *fields, *extra]) if name not in EXPRESSIONS]
+    expressions = {name: EXPRESSIONS[name] for name in fields if name in EXPRESSIONS}
+    return queryset.values(*columns, **expressions)
+
+
+def to_record(row, media_type, fields):
+    return {'id': row['id'], 'media_type': media_type, **{name: row[name] for name in fields}}
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False).encode()
+
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), content_type='application/json', status=status)
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class MediaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'media'
+
+    def ready(self):
+        # Регистрируем обработчики сигналов
+        from django.db.models.signals import post_migrate
+        from media import signals
+
+        post_migrate.connect(signals.install_triggers, sender=self)
@@ -0,0 +1,120 @@
+# async_views.py
+# Асинхронные версии страниц для запуска под ASGI (см. README, MEDIA_ASYNC_VIEWS).
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.shortcuts import redirect
+from django.views.decorators.http import require_POST
+
+from . import views
+from .actions import registry
+from .catalog import CatalogQuery
+from .mixins import BorrowError
+from .services import MediaFactory
+
+
+async def run_in_thread(func, *args):
+    """Выполняет синхронный код с ORM в отдельном потоке со своим соединением с БД.
+
+    В отличие от встроенного async ORM (все запросы идут через один поток),
+    несколько таких вызовов действительно выполняются параллельно.
+    """
+    def call():
+        try:
+            return func(*args)
+        finally:
+            # Соединение потока пула закрывается по тем же правилам, что и после запроса
+            close_old_connections()
+
+    return await sync_to_async(call, thread_sensitive=False)()
+
+
+class MediaListView(views.MediaListView):
+    async def get(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        not_modified = self.not_modified_response()
+        if not_modified:
+            return not_modified
+        # Страницы всех типов запрашиваются параллельно
+        self.catalog = CatalogQuery.from_request(request)
+        media_types = self.catalog.media_types
+        pages = await asyncio.gather(*(
+            run_in_thread(self.catalog.get_page, media_type, self.paginate_by, self.get_projection())
+            for media_type in media_types
+        ))
+        self.pages = dict(zip(media_types, pages))
+        self.object_list = [item for page in pages for item in page]
+        context = self.get_context_data()
+        return self.add_validators(self.render_to_response(context))
+
+
+class MediaListJsonView(MediaListView, views.MediaListJsonView):
+    async def get(self, request, *args, **kwargs):
+        return self.parse_fields() or await super().get(request, *args, **kwargs)
+
+
+class MediaDetailView(views.MediaDetailView):
+    async def get(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        # Для If-Modified-Since без ETag проверка читает updated_at из БД
+        not_modified = await sync_to_async(self.not_modified_response)()
+        if not_modified:
+            return not_modified
+        await sync_to_async(self.load_detail_data)()
+        context = self.get_context_data(object=self.object)
+        return self.add_validators(self.render_to_response(context))
+
+
+async def media_action(request, media_type, item_id):
+    media_class = MediaFactory.get_media_class(media_type)
+    if not media_class:
+        return JsonResponse({'error': 'Неизвестный тип медиа'}, status=400)
+
+    action = registry.get_action(media_type, request.POST.get('action', 'describe'))
+    if not action:
+        return JsonResponse({'error': 'Неизвестное действие'}, status=400)
+
+    # Пользователь загружается асинхронно, чтобы обработчики не обращались к сессии из event loop
+    request.user = await request.auser()
+    try:
+        item = await media_class.objects.aget(id=item_id)
+        result = await sync_to_async(action.run)(item, request)
+    except media_class.DoesNotExist:
+        return JsonResponse({'error': 'Объект не найден'}, status=404)
+    except BorrowError as e:
+        return JsonResponse({'error': str(e)}, status=409)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({'result': result})
+    return redirect('media_library:media_detail', media_type=media_type, pk=item_id)
+
+
+@require_POST
+async def add_review(request, media_type, pk):
+    media_class = MediaFactory.get_media_class(media_type)
+    if not media_class:
+        messages.error(request, 'Неизвестный тип медиа')
+        return redirect('media_library:media_list')
+
+    try:
+        item = await media_class.objects.aget(pk=pk)
+    except media_class.DoesNotExist:
+        messages.error(request, 'Объект не найден')
+        return redirect('media_library:media_list')
+
+    if 'review' not in registry.get_capabilities(media_type):
+        messages.error(request, 'Нельзя оставить отзыв для этого типа медиа')
+        return redirect('media_library:media_detail', media_type=media_type, pk=pk)
+
+    try:
+        await sync_to_async(item.add_review)(request.POST.get('comment', ''), request.POST.get('rating'))
+        messages.success(request, 'Спасибо — отзыв добавлен')
+    except Exception as e:
+        messages.error(request, f'Не удалось добавить отзыв: {e}')
+
+    return redirect('media_library:media_detail', media_type=media_type, pk=pk)
@@ -0,0 +1,185 @@
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+
+from media.actions import registry
+from media.search import WORD_RE, normalize
+
+# Поля, по которым строятся подсказки. Название ведет на конкретный объект,
+# остальные (люди) объединяются по тексту: «Тарковский» — одна подсказка
+# на все его фильмы, и чем их больше, тем она выше
+FIELDS = ('title', 'creator', 'director', 'narrator')
+OBJECT_FIELDS = ('title',)
+
+# Ключ — не длиннее KEY_LENGTH символов: подсказка ищется по началу, хвост не нужен
+KEY_LENGTH = 40
+
+
+def make_key(text):
+    return ' '.join(WORD_RE.findall(normalize(text).casefold()))
+
+
+def word_keys(text):
+    # Ключ на каждое слово: «марг» находит «Мастер и Маргарита»
+    words = make_key(text).split(' ')
+    return [(' '.join(words[i:])[:KEY_LENGTH], i) for i in range(len(words)) if words[i]]
+
+
+class PrefixIndex:
+    """Префиксный индекс подсказок в памяти процесса.
+
+    Отсортированный список кортежей (ключ, номер слова, поле, текст, тип, id):
+    поиск — bisect до первого ключа с префиксом и просмотр вперед, пока ключи
+    с него начинаются. Подсказка (поле, текст, тип, id) хранится один раз,
+    сколько бы объектов ее ни давали (refs); у людей тип и id пустые.
+
+    Строится при первом запросе и после MEDIA_AUTOCOMPLETE_REFRESH секунд,
+    между пересборками обновляется сигналами сохранения и удаления. Сигналы
+    приходят только в процесс, который изменил объект: остальные процессы
+    видят изменения после своей пересборки.
+
+    Пересборка читает таблицы без блокировки индекса и подменяет его целиком:
+    пока она идет, остальные запросы отвечают по старому индексу (ждут только
+    первой сборки), а изменения из сигналов запоминаются и повторяются на новом.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()  # данные индекса
+        self.build_lock = threading.Lock()  # не больше одной пересборки
+        self.keys = []
+        self.refs = {}
+        self.objects = {}  # (тип, id) -> подсказки объекта
+        self.built_at = None
+        self.expired = False
+        self.pending = None  # изменения, пришедшие во время пересборки
+
+    def suggest(self, query, limit=10):
+        """Лучшие подсказки для начала слова query: [(поле, текст, тип, id)].
+
+        Выше — совпадение с началом значения, затем популярные (больше объектов),
+        затем короткие. Просматривается не больше MEDIA_AUTOCOMPLETE_SCAN ключей:
+        на префиксе из одной буквы порядок приблизительный.
+        """
+        prefix = make_key(query)
+        if not prefix:
+            return []
+        self.ensure_built()
+        with self.lock:
+            best = {}
+            position = bisect_left(self.keys, (prefix,))
+            for key, word, *suggestion in self.keys[position:position + settings.MEDIA_AUTOCOMPLETE_SCAN]:
+                if not key.startswith(prefix):
+                    break
+                suggestion = tuple(suggestion)
+                rank = (key != prefix, word > 0, -self.refs[suggestion], len(suggestion[1]), suggestion[1])
+                if suggestion not in best or rank < best[suggestion]:
+                    best[suggestion] = rank
+        return sorted(best, key=best.get)[:limit]
+
+    def is_stale(self):
+        return (self.built_at is None or self.expired
+                or time.monotonic() - self.built_at > settings.MEDIA_AUTOCOMPLETE_REFRESH)
+
+    def ensure_built(self):
+        if not self.is_stale():
+            return
+        # Пересобирает один запрос; остальные ждут, только если индекса еще нет
+        if not self.build_lock.acquire(blocking=self.built_at is None):
+            return
+        try:
+            if self.is_stale():
+                self.build()
+        finally:
+            self.build_lock.release()
+
+    def build(self):
+        with self.lock:
+            self.pending = []
+            self.expired = False
+        try:
+            # Только нужные столбцы, без создания моделей
+            fresh = PrefixIndex()
+            for media_type in registry.get_media_types():
+                fields = self.get_fields(media_type)
+                queryset = registry.get_media_class(media_type).objects.values_list('pk', *fields)
+                for pk, *values in queryset.iterator(chunk_size=5000):
+                    fresh._add(media_type, pk, self.get_suggestions(media_type, pk, dict(zip(fields, values))))
+            fresh.keys.sort()
+            with self.lock:
+                self.keys, self.refs, self.objects = fresh.keys, fresh.refs, fresh.objects
+                # Сигналы, пришедшие во время чтения таблиц: выборка могла их не увидеть
+                for media_type, pk, suggestions in self.pending:
+                    self._replace(media_type, pk, suggestions)
+                self.built_at = time.monotonic()
+        finally:
+            with self.lock:
+                self.pending = None
+
+    def invalidate(self):
+        # Массовые изменения в обход сигналов (bulk_create): пересборка при следующем запросе
+        with self.lock:
+            self.expired = True
+
+    def update_object(self, item):
+        media_type = item.get_media_type()
+        values = {field: getattr(item, field) for field in self.get_fields(media_type)}
+        self._record(media_type, item.pk, self.get_suggestions(media_type, item.pk, values))
+
+    def remove_object(self, item):
+        self._record(item.get_media_type(), item.pk, None)
+
+    def _record(self, media_type, pk, suggestions):
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append((media_type, pk, suggestions))
+            if self.built_at is not None:
+                self._replace(media_type, pk, suggestions)
+
+    def _replace(self, media_type, pk, suggestions):
+        # suggestions=None — объект удален
+        self._remove(media_type, pk)
+        if suggestions is not None:
+            self._add(media_type, pk, suggestions, insort)
+
+    @staticmethod
+    def get_fields(media_type):
+        media_class = registry.get_media_class(media_type)
+        fields = []
+        for field in FIELDS:
+            try:
+                media_class._meta.get_field(field)
+            except FieldDoesNotExist:
+                continue
+            fields.append(field)
+        return fields
+
+    @staticmethod
+    def get_suggestions(media_type, pk, values):
+        return [(field, text, *((media_type, pk) if field in OBJECT_FIELDS else ('', 0)))
+                for field, text in values.items() if text]
+
+    def _add(self, media_type, pk, suggestions, insert=list.append):
+        self.objects[media_type, pk] = suggestions
+        for suggestion in suggestions:
+            self.refs[suggestion] = self.refs.get(suggestion, 0) + 1
+            if self.refs[suggestion] == 1:
+                for key, word in word_keys(suggestion[1]):
+                    insert(self.keys, (key, word, *suggestion))
+
+    def _remove(self, media_type, pk):
+        for suggestion in self.objects.pop((media_type, pk), ()):
+            self.refs[suggestion] -= 1
+            if self.refs[suggestion]:
+                continue
+            del self.refs[suggestion]
+            for key, word in word_keys(suggestion[1]):
+                entry = (key, word, *suggestion)
+                position = bisect_left(self.keys, entry)
+                if position < len(self.keys) and self.keys[position] == entry:
+                    del self.keys[position]
+
+
+index = PrefixIndex()
@@ -0,0 +1,261 @@
+import platform
+import random
+import sqlite3
+import statistics
+import time
+from datetime import date, timedelta
+
+import django
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from media import leaderboard
+from media.models import AudioBook, Book, Movie, Rating
+from media.services import RatingStatsService
+
+# Размеры каталога: общее число записей медиа; отзывов столько же
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+# Доли типов в каталоге
+SHARES = {'book': 0.4, 'movie': 0.3, 'audiobook': 0.3}
+RATINGS_PER_ITEM = 1
+# Сколько объектов каждого типа запрашивает сценарий detail_cached
+HOT_ITEMS = 5
+
+ADJECTIVES = ['Тихий', 'Последний', 'Белый', 'Далекий', 'Забытый', 'Новый', 'Старый', 'Красный',
+              'Северный', 'Ночной', 'Первый', 'Золотой']
+NOUNS = ['дом', 'город', 'берег', 'путь', 'сад', 'остров', 'ветер', 'мир', 'лес', 'поезд', 'сон', 'след']
+PEOPLE = ['Иванов', 'Петрова', 'Смирнов', 'Кузнецова', 'Попов', 'Соколова', 'Лебедев', 'Козлова',
+          'Новиков', 'Морозова', 'Волков', 'Павлова']
+GENRES = ['drama', 'comedy', 'action', 'documentary', 'thriller']
+FORMATS = ['mp4', 'mkv', 'avi']
+
+
+def parse_scale(value):
+    """'10k' / '100k' / '1m' или число записей."""
+    if value in SCALES:
+        return SCALES[value]
+    total = int(value)
+    if total <= 0:
+        raise ValueError('Размер должен быть положительным')
+    return total
+
+
+def _title(rng, i):
+    return f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}'
+
+
+def _pub_date(rng):
+    return date(1950, 1, 1) + timedelta(days=rng.randrange(75 * 365))
+
+
+def _build(media_type, rng, i):
+    common = {'title': _title(rng, i), 'creator': rng.choice(PEOPLE), 'publication_date': _pub_date(rng)}
+    if media_type == 'book':
+        return Book(isbn=f'978{i:010d}', page_count=rng.randint(50, 1200), **common)
+    if media_type == 'movie':
+        return Movie(duration=rng.randint(60, 200), format=rng.choice(FORMATS), director=rng.choice(PEOPLE),
+                     genre=rng.choice(GENRES), **common)
+    return AudioBook(duration=rng.randint(60, 2000), narrator=rng.choice(PEOPLE), **common)
+
+
+def seed(total, batch_size=5000, random_seed=42, progress=None):
+    """Заполняет БД синтетическим каталогом из total записей и таким же числом отзывов.
+
+    Записи вставляются через bulk_create пачками; агрегаты рейтинга и лидерборды
+    пересчитываются один раз в конце. Возвращает число записей по моделям.
+    """
+    rng = random.Random(random_seed)
+    models = {'book': Book, 'movie': Movie, 'audiobook': AudioBook}
+    for media_type, share in SHARES.items():
+        count = int(total * share)
+        for start in range(0, count, batch_size):
+            objects = [_build(media_type, rng, i) for i in range(start, min(start + batch_size, count))]
+            models[media_type].objects.bulk_create(objects, batch_size=batch_size)
+            if progress:
+                progress(media_type, start + len(objects), count)
+
+    movie_ids = list(Movie.objects.values_list('pk', flat=True))
+    ratings = total * RATINGS_PER_ITEM if movie_ids else 0
+    for start in range(0, ratings, batch_size):
+        Rating.objects.bulk_create([
+            Rating(movie_id=rng.choice(movie_ids), rating=rng.randint(1, 5), comment=f'Отзыв {i}')
+            for i in range(start, min(start + batch_size, ratings))
+        ], batch_size=batch_size)
+        if progress:
+            progress('rating', min(start + batch_size, ratings), ratings)
+
+    RatingStatsService.rebuild()
+    leaderboard.rebuild()
+    return row_counts()
+
+
+def row_counts():
+    return {
+        'book': Book.objects.count(),
+        'movie': Movie.objects.count(),
+        'audiobook': AudioBook.objects.count(),
+        'rating': Rating.objects.count(),
+    }
+
+
+class Scenarios:
+    """Пути, которые измеряет bench: каждый метод выполняет один запрос тестовым клиентом.
+
+    Объекты выбираются случайно (с фиксированным зерном) по всему диапазону id,
+    чтобы не измерять один и тот же горячий ряд.
+    """
+
+    NAMES = ['list', 'list_filtered', 'detail', 'detail_cached', 'action', 'add_review', 'form_save']
+
+    def __init__(self, client, random_seed=42):
+        self.client = client
+        self.rng = random.Random(random_seed)
+        self.ids = {
+            media_type: list(model.objects.values_list('pk', flat=True))
+            for media_type, model in (('book', Book), ('movie', Movie), ('audiobook', AudioBook))
+        }
+        self.counter = 0
+        self.borrowed_id = None
+
+    def pick(self, media_type):
+        return self.rng.choice(self.ids[media_type])
+
+    def list(self):
+        return self.client.get(reverse('media_library:media_list'))
+
+    def list_filtered(self):
+        return self.client.get(reverse('media_library:media_list'),
+                               {'genre': self.rng.choice(GENRES), 'sort': '-rating'})
+
+    def detail(self):
+        # Холодный кэш: измеряем построение страницы
+        cache.clear()
+        return self._detail(self.pick)
+
+    def detail_cached(self):
+        # Небольшой набор популярных объектов: после прогрева страницы берутся из кэша
+        return self._detail(lambda media_type: self.rng.choice(self.ids[media_type][:HOT_ITEMS]))
+
+    def _detail(self, pick):
+        media_type = self.rng.choice(['book', 'movie', 'audiobook'])
+        return self.client.get(reverse('media_library:media_detail',
+                                       kwargs={'media_type': media_type, 'pk': pick(media_type)}))
+
+    def action(self):
+        # Чередуем аренду и возврат той же книги, чтобы действие всегда было допустимым
+        if self.borrowed_id is None:
+            book_id, code = self.pick('book'), 'borrow'
+        else:
+            book_id, code = self.borrowed_id, 'return'
+        response = self._book_action(book_id, code)
+        self.borrowed_id = book_id if code == 'borrow' and response.status_code == 200 else None
+        return response
+
+    def teardown(self):
+        # Данные bench переиспользуются между запусками: выданную книгу возвращаем
+        if self.borrowed_id is not None:
+            self._book_action(self.borrowed_id, 'return')
+            self.borrowed_id = None
+
+    def _book_action(self, book_id, code):
+        return self.client.post(
+            reverse('media_library:media_action', kwargs={'media_type': 'book', 'item_id': book_id}),
+            {'action': code}, headers={'X-Requested-With': 'XMLHttpRequest'},
+        )
+
+    def add_review(self):
+        return self.client.post(
+            reverse('media_library:media_add_review', kwargs={'media_type': 'movie', 'pk': self.pick('movie')}),
+            {'rating': self.rng.randint(1, 5), 'comment': 'bench'},
+        )
+
+    def form_save(self):
+        self.counter += 1
+        return self.client.post(reverse('media_library:media_create'), {
+            'media_type': 'movie', 'title': f'Bench {time.time_ns()} {self.counter}', 'creator': 'Bench',
+            'publication_date': '2020-01-01', 'duration': 100, 'format': 'mp4', 'director': 'Bench',
+            'genre': 'drama',
+        })
+
+
+def percentile(sorted_values, fraction):
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(timings, query_counts, errors=0):
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p90_ms': round(percentile(timings, 0.90), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'max_ms': round(timings[-1], 3),
+        'queries_median': statistics.median(query_counts),
+        'queries_max': max(query_counts),
+    }
+
+
+def run(names=None, repeat=50, warmup=5, random_seed=42):
+    """Выполняет сценарии и возвращает {имя: сводка}. Время — в миллисекундах."""
+    scenarios = Scenarios(Client(), random_seed)
+    results = {}
+    try:
+        for name in names or Scenarios.NAMES:
+            request = getattr(scenarios, name)
+            for _ in range(warmup):
+                request()
+            timings, query_counts, errors = [], [], 0
+            for _ in range(repeat):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = request()
+                    elapsed = time.perf_counter() - started
+                if response.status_code >= 400:
+                    errors += 1
+                timings.append(elapsed * 1000)
+                query_counts.append(len(queries))
+            results[name] = summarize(timings, query_counts, errors)
+    finally:
+        scenarios.teardown()
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'machine': platform.machine(),
+    }
+
+
+def compare(results, baseline, threshold=0.2, min_delta_ms=1.0):
+    """Сравнивает результаты с сохраненным прогоном.
+
+    Регрессия — рост p50 или p95 больше чем на threshold (доля) и не меньше
+    min_delta_ms, либо рост максимального числа запросов. Возвращает
+    список строк-описаний регрессий.
+    """
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            delta = current[metric] - base[metric]
+            if delta >= min_delta_ms and current[metric] > base[metric] * (1 + threshold):
+                regressions.append(f'{name}: {metric} {base[metric]:.2f} -> {current[metric]:.2f} мс')
+        if current['queries_max'] > base['queries_max']:
+            regressions.append(f"{name}: запросов {base['queries_max']} -> {current['queries_max']}")
+    return regressions
@@ -0,0 +1,190 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Версия объекта хранится в кэше и увеличивается при каждом изменении
+# (сохранение, удаление, отзыв, аренда). Закэшированные данные адресуются
+# ключом с версией, поэтому инвалидация — это один incr, без удаления ключей.
+# Версии увеличиваются после фиксации транзакции (on_commit): иначе параллельный
+# запрос успеет прочитать старую строку и закэшировать ее под новой версией.
+VERSION_KEY = 'media:version:{media_type}:{pk}'
+# Поколение кэша — общая часть всех ключей с версией и ETag. Версии растут при
+# фиксации в основной БД, а реплика догоняет ее позже: запрос, прочитавший
+# реплику в этом промежутке, кэширует старые строки под новой версией.
+# sync_replica меняет поколение, и такие записи перестают использоваться
+GENERATION_KEY = 'media:generation'
+DETAIL_KEY = 'media:detail:{generation}:{media_type}:{pk}:{version}'
+# HTML карточки объекта в списке (template/media_library/_card_<тип>.html)
+CARD_KEY = 'media:card:{generation}:{media_type}:{pk}:{version}'
+# Версия типа меняется при изменении любого объекта этого типа (списки, фасеты);
+# рядом хранится время последнего изменения для заголовка Last-Modified
+TYPE_VERSION_KEY = 'media:type-version:{media_type}'
+TYPE_MODIFIED_KEY = 'media:type-modified:{media_type}'
+# Счетчики фасетов типа для набора фильтров (digest — хэш параметров фильтра)
+FACETS_KEY = 'media:facets:{generation}:{media_type}:{version}:{digest}'
+
+# Сколько ждать результата чужого пересчета, прежде чем считать самим
+LOCK_TIMEOUT = 10
+WAIT_TIMEOUT = 2.0
+WAIT_INTERVAL = 0.05
+
+
+def _initial_version():
+    # Если ключ версии вытеснен из кэша, новая версия не должна совпасть
+    # со старой — иначе можно получить устаревшие данные
+    return time.time_ns()
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, _initial_version(), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    # Значение — время в наносекундах: по нему же определяется Last-Modified
+    cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+def get_item_version(media_type, pk):
+    key = VERSION_KEY.format(media_type=media_type, pk=pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_item_versions(media_type, pks):
+    # Версии всех объектов страницы одним get_many
+    keys = {VERSION_KEY.format(media_type=media_type, pk=pk): pk for pk in pks}
+    found = cache.get_many(keys)
+    return {pk: found.get(key) or get_item_version(media_type, pk) for key, pk in keys.items()}
+
+
+def _incr(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _initial_version()
+        cache.set(key, version, None)
+        return version
+
+
+def bump_item_version(media_type, pk):
+    bump_item_versions(media_type, [pk])
+
+
+def bump_item_versions(media_type, pks):
+    # Для массовых изменений в обход сигналов (bulk_update и т.п.)
+    pks = list(pks)
+    transaction.on_commit(lambda: _bump(media_type, pks))
+
+
+def _bump(media_type, pks):
+    _bump_type(media_type)
+    for pk in pks:
+        _incr(VERSION_KEY.format(media_type=media_type, pk=pk))
+
+
+def get_type_version(media_type):
+    key = TYPE_VERSION_KEY.format(media_type=media_type)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_type_versions(media_types):
+    # Один обход кэша на все типы (get_many), без запросов к БД
+    keys = {TYPE_VERSION_KEY.format(media_type=media_type): media_type for media_type in media_types}
+    found = cache.get_many(keys)
+    return {media_type: found.get(key) or get_type_version(media_type) for key, media_type in keys.items()}
+
+
+def get_type_modified(media_type):
+    # Если отметка вытеснена из кэша, считаем тип измененным сейчас: клиент получит 200
+    key = TYPE_MODIFIED_KEY.format(media_type=media_type)
+    modified = cache.get(key)
+    if modified is None:
+        cache.add(key, int(time.time()), None)
+        modified = cache.get(key)
+    # После обновления реплики страницы тоже считаются измененными
+    return max(modified, get_generation() // 10 ** 9)
+
+
+def bump_type_version(media_type):
+    transaction.on_commit(lambda: _bump_type(media_type))
+
+
+def _bump_type(media_type):
+    cache.set(TYPE_MODIFIED_KEY.format(media_type=media_type), int(time.time()), None)
+    _incr(TYPE_VERSION_KEY.format(media_type=media_type))
+
+
+def invalidate_media(media_item):
+    bump_item_version(media_item.get_media_type(), media_item.pk)
+
+
+def get_or_compute(key, compute, timeout=None):
+    """Берет значение из кэша или вычисляет его, схлопывая параллельные промахи.
+
+    Пересчет выполняет только тот запрос, который первым захватил блокировку
+    (cache.add атомарен); остальные ждут появления значения до WAIT_TIMEOUT.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            value = compute()
+            cache.set(key, value, timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    return compute()
+
+
+def get_detail_context(media_type, pk, compute):
+    key = DETAIL_KEY.format(generation=get_generation(), media_type=media_type, pk=pk,
+                            version=get_item_version(media_type, pk))
+    return get_or_compute(key, compute, settings.MEDIA_DETAIL_CACHE_TIMEOUT)
+
+
+def get_facets(media_type, digest, compute):
+    key = FACETS_KEY.format(generation=get_generation(), media_type=media_type,
+                            version=get_type_version(media_type), digest=digest)
+    return get_or_compute(key, compute, settings.MEDIA_FACET_CACHE_TIMEOUT)
+
+
+def get_cards(media_type, items, render, timeout=None):
+    """Возвращает HTML карточек items в том же порядке.
+
+    Версии и готовые карточки читаются двумя get_many на всю страницу;
+    шаблон рендерится только для объектов, изменившихся с прошлого раза
+    (их версия новая, ключа в кэше еще нет).
+    """
+    generation = get_generation()
+    versions = get_item_versions(media_type, [item.pk for item in items])
+    keys = [CARD_KEY.format(generation=generation, media_type=media_type, pk=item.pk, version=versions[item.pk])
+            for item in items]
+    cards = cache.get_many(keys)
+    missing = {key: render(item) for key, item in zip(keys, items) if key not in cards}
+    if missing:
+        cache.set_many(missing, timeout)
+        cards.update(missing)
+    return [cards[key] for key in keys]
@@ -0,0 +1,215 @@
+import hashlib
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Count, Q
+from django.db.models.expressions import RawSQL
+from django.http import QueryDict
+
+from media import cache as media_cache
+from media import search
+from media.pagination import KeysetPaginator
+from media.services import MediaFactory
+
+
+class CatalogQuery:
+    """Параметры каталога, разобранные из запроса один раз.
+
+    Строит по одному ленивому queryset на тип медиа; их разделяют список,
+    JSON-вариант и контекст шаблона.
+    """
+
+    # Сортировки, доступные в интерфейсе: параметр sort -> подпись
+    SORT_CHOICES = [
+        ('title', 'По названию'),
+        ('-publication_date', 'Сначала новые'),
+        ('publication_date', 'Сначала старые'),
+        ('duration', 'По длительности'),
+        ('-rating', 'По рейтингу'),
+    ]
+    # Параметр сортировки -> поле модели (с индексом (поле, id))
+    SORT_FIELDS = {
+        'title': 'title',
+        'publication_date': 'publication_date',
+        'duration': 'duration',
+        'rating': 'rating_avg',
+    }
+
+    # Фасеты: имя в ответе -> поле модели; у типа считаются только его поля
+    FACET_FIELDS = {
+        'genre': 'genre',
+        'format': 'format',
+        'director': 'director',
+        'borrowed': 'is_borrowed',
+    }
+
+    def __init__(self, params, media_types=None):
+        self.params = QueryDict(mutable=True)
+        self.params.update(params)
+        self.q = params.get('q', '').strip()
+        self.genre = params.get('genre', '')
+        self.director = params.get('director', '').strip()
+        self.sort = params.get('sort') or 'title'
+        self.media_types = media_types or MediaFactory.get_all_media_types()
+        self._querysets = {}
+
+    @classmethod
+    def from_request(cls, request, media_types=None):
+        return cls(request.GET, media_types)
+
+    def get_queryset(self, media_type):
+        if media_type not in self._querysets:
+            self._querysets[media_type] = self.build_queryset(media_type)
+        return self._querysets[media_type]
+
+    def build_queryset(self, media_type):
+        return self.build_search_queryset(media_type).filter(*self.get_filters(media_type).values())
+
+    def build_search_queryset(self, media_type):
+        # Поиск действует на все типы
+        queryset = MediaFactory.get_media_class(media_type).objects.all()
+        if self.q:
+            queryset = self.apply_search(queryset, media_type)
+        return queryset
+
+    def get_filters(self, media_type):
+        """Фильтры по полям-фасетам: имя фасета -> условие Q.
+
+        Жанр и режиссер действуют только на типы, у которых есть такое поле.
+        """
+        media_class = MediaFactory.get_media_class(media_type)
+        filters = {}
+        if self.genre and self._has_field(media_class, 'genre'):
+            filters['genre'] = Q(genre=self.genre)
+        if self.director and self._has_field(media_class, 'director'):
+            filters['director'] = self.director_filter(media_type)
+        return filters
+
+    def apply_search(self, queryset, media_type):
+        # Полнотекстовый индекс (FTS5) по названию, автору, режиссеру и чтецу;
+        # без SQLite — запасной вариант через LIKE по названию и автору
+        if not search.is_available():
+            return queryset.filter(Q(title__icontains=self.q) | Q(creator__icontains=self.q))
+        return self._match(queryset, media_type, search.build_match_expression(self.q))
+
+    def director_filter(self, media_type):
+        # Подстрока имени, как у icontains. LIKE '%...%' B-tree индекс не ускоряет —
+        # ищем по триграммному индексу; запрос короче трех символов триграммы
+        # не покрывают, он фильтруется LIKE
+        expression = search.build_director_expression(self.director) if search.trigram_available() else None
+        if expression is None:
+            return Q(director__icontains=self.director)
+        return Q(pk__in=RawSQL(search.director_subquery_sql(), (expression, media_type)))
+
+    @staticmethod
+    def _match(queryset, media_type, expression):
+        if not expression:
+            return queryset.none()
+        return queryset.filter(pk__in=RawSQL(search.match_subquery_sql(), (expression, media_type)))
+
+    def get_ordering(self, media_class):
+        # Если у типа нет поля сортировки (например, длительности у книг), сортируем по названию
+        field = self.SORT_FIELDS.get(self.sort.lstrip('-'))
+        if not field or not self._has_field(media_class, field):
+            return 'title'
+        return f'-{field}' if self.sort.startswith('-') else field
+
+    def get_page(self, media_type, per_page, project=None):
+        queryset = self.get_queryset(media_type)
+        ordering = self.get_ordering(queryset.model)
+        if project is not None:
+            # Проекция (.values()): в строке должен быть столбец сортировки для курсора
+            queryset = project(media_type, queryset, ordering.lstrip('-'))
+        paginator = KeysetPaginator(queryset, ordering, per_page)
+        page = paginator.get_page(self.params.get(self.cursor_param(media_type)))
+        page.next_query = self.cursor_query(media_type, page.next_cursor)
+        page.previous_query = self.cursor_query(media_type, page.previous_cursor)
+        return page
+
+    def get_pages(self, per_page, project=None):
+        return {media_type: self.get_page(media_type, per_page, project) for media_type in self.media_types}
+
+    def get_facets(self):
+        """Счетчики значений для фильтров по текущей выборке.
+
+        {'media_type': {тип: n}, 'genre': {значение: n}, 'format': ..., 'director': ...,
+        'borrowed': {'true': n, 'false': n}}; значения — по убыванию счетчика, не
+        больше MEDIA_FACET_LIMIT. Фасеты жанра и режиссера считаются без собственного
+        фильтра (?genre=drama не обнуляет остальные жанры), прочие — по всей выборке.
+        На тип — один GROUP BY по всем его полям-фасетам сразу, результат кэшируется
+        по версии типа и параметрам фильтра.
+        """
+        facets = {'media_type': {}, **{name: Counter() for name in self.FACET_FIELDS}}
+        for media_type in self.media_types:
+            counts = media_cache.get_facets(media_type, self.filter_digest(media_type),
+                                            lambda: self.count_facets(media_type))
+            facets['media_type'][media_type] = counts.pop('total')
+            for name, values in counts.items():
+                facets[name].update(values)
+        facets['borrowed'] = {str(value).lower(): n for value, n in facets['borrowed'].items()}
+        return {name: dict(sorted(values.items(), key=lambda item: (-item[1], str(item[0])))
+                           [:settings.MEDIA_FACET_LIMIT])
+                for name, values in facets.items()}
+
+    def count_facets(self, media_type):
+        filters = self.get_filters(media_type)
+        queryset = self.build_search_queryset(media_type)
+        names = [name for name, field in self.FACET_FIELDS.items() if self._has_field(queryset.model, field)]
+        fields = [self.FACET_FIELDS[name] for name in names]
+        if not fields:
+            return {'total': queryset.filter(*filters.values()).count()}
+        # Группируем выборку без фильтров-фасетов; каждому фасету — свой счетчик
+        # с условием по всем фильтрам, кроме его собственного
+        own = [name for name in names if name in filters]
+        annotations = {'n': self._count(filters.values())}
+        for name in own:
+            annotations[f'n_{name}'] = self._count(q for other, q in filters.items() if other != name)
+        counts = {'total': 0, **{name: {} for name in names}}
+        # Строка на сочетание значений; суммы по каждому полю — в Python
+        for row in queryset.values_list(*fields).annotate(**annotations).order_by():
+            values, n, own_counts = row[:len(fields)], row[len(fields)], dict(zip(own, row[len(fields) + 1:]))
+            counts['total'] += n
+            for name, value in zip(names, values):
+                count = own_counts.get(name, n)
+                if value != '' and count:
+                    counts[name][value] = counts[name].get(value, 0) + count
+        return counts
+
+    @staticmethod
+    def _count(conditions):
+        conditions = list(conditions)
+        if not conditions:
+            return Count('pk')
+        condition = conditions[0]
+        for other in conditions[1:]:
+            condition &= other
+        return Count('pk', filter=condition)
+
+    def filter_digest(self, media_type):
+        # Только фильтры, действующие на тип: жанр не меняет счетчики книг
+        media_class = MediaFactory.get_media_class(media_type)
+        parts = [self.q]
+        if self._has_field(media_class, 'genre'):
+            parts.append(self.genre)
+        if self._has_field(media_class, 'director'):
+            parts.append(self.director)
+        return hashlib.md5('\0'.join(parts).encode()).hexdigest()
+
+    def cursor_param(self, media_type):
+        return f'{media_type}_cursor'
+
+    def cursor_query(self, media_type, cursor):
+        if cursor is None:
+            return None
+        params = self.params.copy()
+        params[self.cursor_param(media_type)] = cursor
+        return params.urlencode()
+
+    @staticmethod
+    def _has_field(media_class, field_name):
+        try:
+            media_class._meta.get_field(field_name)
+        except FieldDoesNotExist:
+            return False
+        return True
@@ -0,0 +1,10 @@
+class GlobalIdConverter:
+    # Глобальный id медиа (MediaIndex): '42' или с префиксом типа 'movie-42'.
+    # В обоих случаях 42 — глобальный id; префикс, не совпавший с типом, — объект не найден
+    regex = r'(?:[a-z]+-)?[0-9]+'
+
+    def to_python(self, value):
+        return value
+
+    def to_url(self, value):
+        return str(value)
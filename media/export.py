@@ -0,0 +1,87 @@
+import csv
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from media.actions import registry
+from media.services import MediaFactory
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+# Строки склеиваются в блоки примерно такого размера перед отправкой
+BUFFER_SIZE = 64 * 1024
+
+
+def get_export_fields(media_type):
+    # Проекция .values() типа: только нужные столбцы, без создания моделей
+    return ['id', *registry.get_data_fields(media_type)]
+
+
+def get_csv_columns():
+    # Общий заголовок CSV: объединение полей всех типов
+    return ['media_type'] + list(dict.fromkeys(
+        field for media_type in MediaFactory.get_all_media_types() for field in get_export_fields(media_type)
+    ))
+
+
+def iter_records(media_types=None, chunk_size=2000):
+    for media_type in media_types or MediaFactory.get_all_media_types():
+        queryset = (MediaFactory.get_media_class(media_type).objects
+                    .order_by('pk').values(*get_export_fields(media_type)))
+        for row in queryset.iterator(chunk_size=chunk_size):
+            # У фильма без оценок rating_avg = 0: выгружаем null (в CSV — пусто), как в JSON API
+            if row.get('rating_avg') == 0:
+                row['rating_avg'] = None
+            yield {'media_type': media_type, **row}
+
+
+def iter_ndjson(records):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    return _buffered(encoder.encode(record) + '\n' for record in records)
+
+
+class _Echo:
+    # csv.writer пишет в объект с методом write; возвращаем строку без накопления
+    def write(self, value):
+        return value
+
+
+def iter_csv(records):
+    writer = csv.DictWriter(_Echo(), fieldnames=get_csv_columns(), restval='')
+
+    def rows():
+        yield writer.writeheader()
+        for record in records:
+            yield writer.writerow(record)
+
+    return _buffered(rows())
+
+
+def iter_export(file_format, media_types=None, chunk_size=2000):
+    records = iter_records(media_types, chunk_size)
+    return iter_csv(records) if file_format == 'csv' else iter_ndjson(records)
+
+
+def gzip_stream(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _buffered(lines):
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
@@ -1,15 +1,12 @@
 # forms.py
 from django import forms
+from .actions import registry
 from .services import MediaFactory
 from .models import Movie
 
 
 class MediaForm(forms.Form):
-    MEDIA_TYPES = [
-        ('book', 'Книга'),
-        ('movie', 'Фильм'),
-        ('audiobook', 'Аудиокнига'),
-    ]
+    MEDIA_TYPES = registry.get_choices()
 
     media_type = forms.ChoiceField(choices=MEDIA_TYPES, label='Тип медиа')
     title = forms.CharField(max_length=200, label='Название')
@@ -33,14 +30,31 @@ class MediaForm(forms.Form):
     director = forms.CharField(max_length=100, required=False, label='Режиссер')
     genre = forms.ChoiceField(choices=Movie.GENRE_CHOICES, required=False, label='Жанр')
 
+    # Файл для скачивания и просмотра: только у типов с полем media_file (фильмы, аудиокниги)
+    media_file = forms.FileField(required=False, label='Файл')
+
     def __init__(self, *args, **kwargs):
         kwargs.pop('instance', None)
         super().__init__(*args, **kwargs)
 
+    def rebind(self, data):
+        """Привязывает уже созданную форму к новым данным.
+
+        Конструктор формы глубоко копирует все поля; при потоковом импорте
+        один экземпляр переиспользуется для каждой строки.
+        """
+        self.data = data
+        self.is_bound = True
+        self._errors = None
+        return self
+
     def clean(self):
         cleaned_data = super().clean()
         media_type = cleaned_data.get('media_type')
 
+        if media_type and cleaned_data.get('media_file') and not hasattr(MediaFactory.get_media_class(media_type), 'media_file'):
+            self.add_error('media_file', 'Файл можно прикрепить только к фильму или аудиокниге')
+
         # Валидация в зависимости от типа медиа
         if media_type == 'book':
             if not cleaned_data.get('isbn'):
@@ -68,6 +82,12 @@ class MediaForm(forms.Form):
         return cleaned_data
 
     def save(self):
+        media_type, media_data = self.get_media_data()
+        # Используем фабрику для создания объекта
+        return MediaFactory.create_media(media_type, **media_data)
+
+    def get_media_data(self):
+        """Возвращает (media_type, kwargs для модели) из очищенных данных формы."""
         media_type = self.cleaned_data['media_type']
 
         # Подготавливаем данные для фабрики
@@ -96,5 +116,7 @@ class MediaForm(forms.Form):
                 'genre': self.cleaned_data.get('genre', ''),
             })
 
-        # Используем фабрику для создания объекта
-        return MediaFactory.create_media(media_type, **media_data)
\ No newline at end of file
+        if self.cleaned_data.get('media_file'):
+            media_data['media_file'] = self.cleaned_data['media_file']
+
+        return media_type, media_data
\ No newline at end of file
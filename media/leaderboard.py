@@ -0,0 +1,149 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from media.models import Movie, MovieRanking, MovieRatingDay, Rating
+
+# Оценка фильма — байесовское среднее: (m * C + сумма оценок) / (C + число оценок),
+# где m — априорная средняя оценка, C — вес априорного среднего. У фильма с парой
+# пятерок оценка ниже, чем у фильма с сотней оценок в среднем 4.8.
+
+
+def prior():
+    return settings.MEDIA_LEADERBOARD_PRIOR_MEAN, settings.MEDIA_LEADERBOARD_PRIOR_WEIGHT
+
+
+def bayesian_score(rating_sum, rating_count):
+    mean, weight = prior()
+    return (mean * weight + rating_sum) / (weight + rating_count)
+
+
+def refresh_rankings(movie_ids=None, using='default'):
+    """Пересчитывает строки MovieRanking из денормализованных агрегатов Movie.
+
+    Один INSERT ... ON CONFLICT DO UPDATE на пачку фильмов. Фильмы без оценок
+    в таблицу не попадают, но уже существующие строки обновляются (оценки удалены).
+    """
+    ranking = MovieRanking._meta.db_table
+    movie = Movie._meta.db_table
+    mean, weight = prior()
+    sql = (
+        f'INSERT INTO {ranking} (movie_id, genre, rating_count, score) '
+        f'SELECT m.id, m.genre, m.rating_count, (%s + m.rating_sum) / (%s + m.rating_count) FROM {movie} m '
+        f'WHERE (m.rating_count > 0 OR EXISTS (SELECT 1 FROM {ranking} r WHERE r.movie_id = m.id))'
+    )
+    params = [mean * weight, float(weight)]
+    if movie_ids is not None:
+        movie_ids = list(movie_ids)
+        if not movie_ids:
+            return
+        sql += f' AND m.id IN ({", ".join(["%s"] * len(movie_ids))})'
+        params += movie_ids
+    sql += (' ON CONFLICT (movie_id) DO UPDATE SET genre = excluded.genre, '
+            'rating_count = excluded.rating_count, score = excluded.score')
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def record_rating(rating, delta, using='default'):
+    """Учитывает добавленную (delta=1) или удаленную (delta=-1) оценку в лидербордах."""
+    day = timezone.localdate(rating.created_at)
+    if delta > 0:
+        _add_to_days([(rating.movie_id, day, delta, rating.rating * delta)], using)
+    else:
+        MovieRatingDay.objects.using(using).filter(
+            movie_id=rating.movie_id, day=day, rating_count__gt=0,
+        ).update(
+            rating_count=F('rating_count') + delta,
+            rating_sum=F('rating_sum') + rating.rating * delta,
+        )
+    refresh_rankings([rating.movie_id], using)
+
+
+def record_ratings(ratings, using='default'):
+    """Учитывает пачку новых оценок в дневных суммах: по строке на (фильм, день).
+
+    Рейтинги за все время не обновляет — их пересчитывает вызывающий
+    (RatingStatsService.rebuild вызывает refresh_rankings).
+    """
+    totals = {}
+    for rating in ratings:
+        key = (rating.movie_id, timezone.localdate(rating.created_at))
+        count, total = totals.get(key, (0, 0))
+        totals[key] = (count + 1, total + rating.rating)
+    _add_to_days([(movie_id, day, count, total) for (movie_id, day), (count, total) in totals.items()], using)
+
+
+def _add_to_days(rows, using):
+    # rows — [(movie_id, день, число оценок, сумма оценок)]; один INSERT ... ON CONFLICT на строку
+    if not rows:
+        return
+    table = MovieRatingDay._meta.db_table
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {table} (movie_id, day, rating_count, rating_sum) VALUES (%s, %s, %s, %s) '
+            'ON CONFLICT (day, movie_id) DO UPDATE SET '
+            'rating_count = rating_count + excluded.rating_count, '
+            'rating_sum = rating_sum + excluded.rating_sum',
+            [(movie_id, connection.ops.adapt_datefield_value(day), count, total)
+             for movie_id, day, count, total in rows],
+        )
+
+
+def sync_genre(movie):
+    MovieRanking.objects.filter(movie_id=movie.pk).exclude(genre=movie.genre).update(genre=movie.genre)
+
+
+def top_movies(genre=None, limit=10, min_votes=1):
+    """Топ фильмов за все время: чтение по индексу (score) или (genre, score).
+
+    Возвращает список (фильм, оценка, число оценок).
+    """
+    rankings = MovieRanking.objects.filter(rating_count__gte=min_votes)
+    if genre:
+        rankings = rankings.filter(genre=genre)
+    rankings = rankings.select_related('movie').order_by('-score', 'movie')[:limit]
+    return [(ranking.movie, ranking.score, ranking.rating_count) for ranking in rankings]
+
+
+def trending_movies(days=7, genre=None, limit=10, min_votes=1):
+    """Топ фильмов по оценкам за последние days дней (включая сегодня).
+
+    Суммируются дневные строки MovieRatingDay, а не сами оценки: объем работы
+    ограничен числом дней и фильмов с оценками за период.
+    """
+    mean, weight = prior()
+    since = timezone.localdate() - timedelta(days=days - 1)
+    rows = MovieRatingDay.objects.filter(day__gte=since)
+    if genre:
+        rows = rows.filter(movie__genre=genre)
+    rows = list(
+        rows.values('movie_id')
+        .annotate(count=Sum('rating_count'), total=Sum('rating_sum'))
+        .filter(count__gte=min_votes)
+        .annotate(score=(Value(mean * weight) + F('total')) / (Value(float(weight)) + F('count')))
+        .order_by('-score', 'movie_id')[:limit]
+    )
+    movies = Movie.objects.in_bulk([row['movie_id'] for row in rows])
+    return [(movies[row['movie_id']], row['score'], row['count'])
+            for row in rows if row['movie_id'] in movies]
+
+
+@transaction.atomic
+def rebuild():
+    """Полностью пересобирает дневные суммы и рейтинги из таблиц Rating и Movie."""
+    MovieRatingDay.objects.all().delete()
+    days = (Rating.objects.annotate(day=TruncDate('created_at'))
+            .values('movie_id', 'day').annotate(count=Count('id'), total=Sum('rating')).order_by())
+    MovieRatingDay.objects.bulk_create(
+        (MovieRatingDay(movie_id=row['movie_id'], day=row['day'],
+                        rating_count=row['count'], rating_sum=row['total'])
+         for row in days.iterator()),
+        batch_size=1000,
+    )
+    refresh_rankings()
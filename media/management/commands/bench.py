@@ -0,0 +1,103 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from media import bench
+from media.routers import pin_to_primary
+
+
+class Command(BaseCommand):
+    help = 'Замеры основных страниц на синтетическом каталоге (время, число запросов, перцентили)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', default='10k',
+                            help='Размер каталога: 10k, 100k, 1m или число записей')
+        parser.add_argument('--db', default=str(settings.BASE_DIR / 'bench_db.sqlite3'),
+                            help='Отдельный файл SQLite для замеров (рабочая БД не затрагивается)')
+        parser.add_argument('--reseed', action='store_true', help='Пересоздать данные, даже если они есть')
+        parser.add_argument('--scenario', action='append', dest='scenarios', choices=bench.Scenarios.NAMES)
+        parser.add_argument('--repeat', type=int, default=50, help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--output', '-o', help='Сохранить результаты в JSON')
+        parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Допустимый рост p50/p95 (доля, по умолчанию 0.2)')
+
+    # Замеры идут на отдельном файле, подставленном только в основной алиас: чтение
+    # с реплики ушло бы в рабочую БД и не попало бы в подсчет запросов
+    @pin_to_primary()
+    def handle(self, *args, **options):
+        try:
+            total = bench.parse_scale(options['scale'])
+        except ValueError:
+            raise CommandError(f"Некорректный размер: {options['scale']}")
+        baseline = None
+        if options['baseline']:
+            baseline_path = Path(options['baseline'])
+            if not baseline_path.exists():
+                raise CommandError(f'Файл не найден: {baseline_path}')
+            baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+
+        self.use_database(options['db'], total, options['reseed'])
+        counts = bench.row_counts()
+        self.stdout.write(f"Каталог: {counts}")
+
+        # Тестовый клиент обращается к хосту testserver
+        with override_settings(ALLOWED_HOSTS=['testserver', *settings.ALLOWED_HOSTS]):
+            results = bench.run(options['scenarios'], options['repeat'], options['warmup'])
+        self.print_results(results, baseline['scenarios'] if baseline else {})
+
+        if options['output']:
+            report = {
+                'created': timezone.now().isoformat(),
+                'scale': total,
+                'rows': counts,
+                'environment': bench.environment(),
+                'scenarios': results,
+            }
+            Path(options['output']).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+            self.stdout.write(f"Результаты записаны в {options['output']}")
+
+        if baseline:
+            if baseline.get('scale') != total:
+                self.stderr.write(f"Базовый прогон снят на другом размере каталога ({baseline.get('scale')})")
+            regressions = bench.compare(results, baseline['scenarios'], options['threshold'])
+            if regressions:
+                raise CommandError('Регрессии:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
+
+    def use_database(self, path, total, reseed):
+        # Переключаем соединение на отдельный файл, как это делает тестовый раннер
+        connection.close()
+        connection.settings_dict['NAME'] = path
+        call_command('migrate', verbosity=0, interactive=False)
+
+        counts = bench.row_counts()
+        if not reseed and sum(counts[t] for t in bench.SHARES) >= total:
+            return
+        self.stdout.write(f'Заполнение {path}: {total} записей...')
+        call_command('flush', verbosity=0, interactive=False)
+        bench.seed(total, progress=self.progress)
+
+    def progress(self, model, done, count):
+        self.stdout.write(f'\r  {model}: {done}/{count}', ending='\n' if done >= count else '')
+        self.stdout.flush()
+
+    def print_results(self, results, baseline):
+        header = f"{'сценарий':<15}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'запросы':>9}"
+        self.stdout.write(header)
+        for name, row in results.items():
+            line = (f"{name:<15}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+                    f"{row['max_ms']:>9.2f}{row['queries_max']:>9}")
+            base = baseline.get(name)
+            if base:
+                line += f"   (p95 было {base['p95_ms']:.2f})"
+            if row['errors']:
+                line += f"   ошибок: {row['errors']}"
+            self.stdout.write(line)
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from media import export
+from media.services import MediaFactory
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка каталога в NDJSON или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(export.FORMATS), default='ndjson')
+        parser.add_argument('--type', action='append', dest='media_types',
+                            choices=MediaFactory.get_all_media_types())
+        parser.add_argument('--output', '-o', help='Файл для записи (по умолчанию stdout)')
+        parser.add_argument('--gzip', action='store_true', help='Сжимать вывод gzip')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        chunks = export.iter_export(options['format'], options['media_types'], options['chunk_size'])
+        if options['gzip']:
+            chunks = export.gzip_stream(chunks)
+            mode, encoding = 'wb', None
+        else:
+            mode, encoding = 'w', 'utf-8'
+
+        if options['output']:
+            with open(options['output'], mode, encoding=encoding, newline='' if encoding else None) as target:
+                for chunk in chunks:
+                    target.write(chunk)
+        elif options['gzip']:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,45 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import CommandError
+
+from media.management.commands.import_media import Command as ImportMediaCommand
+from media.routers import pin_to_primary
+from media.services import RatingStatsService
+
+
+class Command(ImportMediaCommand):
+    help = 'Пакетный импорт отзывов о фильмах из CSV или JSONL (movie_id, rating, comment)'
+
+    # Команда читает и пишет: чтение с отстающей реплики затерло бы свежие данные
+    @pin_to_primary()
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл не найден: {path}')
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in ('csv', 'jsonl'):
+            raise CommandError('Укажите --format csv или --format jsonl')
+
+        self.invalid = 0
+        started = time.perf_counter()
+        with path.open(encoding='utf-8-sig', newline='') as source:
+            rows = self.read_csv(source) if file_format == 'csv' else self.read_jsonl(source)
+            created = RatingStatsService.add_reviews_bulk(
+                self.numbered(rows),
+                batch_size=options['batch_size'],
+                on_error=lambda review, message: self.report_error(review['line'], message),
+            )
+        elapsed = time.perf_counter() - started
+
+        total = created + self.invalid
+        rate = total / elapsed if elapsed else total
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено отзывов: {created}, ошибок: {self.invalid}; '
+            f'{total} строк за {elapsed:.1f} с ({rate:.0f} строк/с)'
+        ))
+
+    def numbered(self, rows):
+        # Номер строки едет вместе с отзывом, чтобы сообщить его в on_error
+        for line_no, row in rows:
+            yield {**row, 'line': line_no}
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from media import leaderboard
+from media.models import MovieRanking, MovieRatingDay
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает таблицы лидербордов (рейтинги фильмов и дневные суммы оценок)'
+
+    def handle(self, *args, **options):
+        leaderboard.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Фильмов в рейтинге: {MovieRanking.objects.count()}, '
+            f'дневных строк: {MovieRatingDay.objects.count()}'
+        ))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from media.routers import pin_to_primary
+from media.services import RatingStatsService
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные агрегаты рейтинга фильмов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movie', type=int, action='append', dest='movie_ids',
+                            help='id фильма (можно указать несколько раз)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    # Команда читает и пишет: чтение с отстающей реплики затерло бы свежие данные
+    @pin_to_primary()
+    def handle(self, *args, **options):
+        processed = RatingStatsService.rebuild(
+            movie_ids=options['movie_ids'],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано фильмов: {processed}'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from media import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс (FTS5) по всем типам медиа'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('Полнотекстовый индекс поддерживается только для SQLite')
+        search.install_triggers()
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано записей: {count}'))
@@ -0,0 +1,29 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from media import cache as media_cache
+from media.routers import REPLICA, replica_configured
+
+
+class Command(BaseCommand):
+    help = 'Копирует основную БД SQLite в файл реплики (MEDIA_DB_REPLICA)'
+
+    def handle(self, *args, **options):
+        if not replica_configured():
+            raise CommandError('Реплика не настроена: задайте переменную окружения MEDIA_DB_REPLICA')
+
+        # Онлайн-копия через backup API: основная БД остается доступной для записи
+        source = connections[DEFAULT_DB_ALIAS]
+        source.ensure_connection()
+        target = sqlite3.connect(connections.settings[REPLICA]['NAME'])
+        try:
+            source.connection.backup(target)
+        finally:
+            target.close()
+        # Соединения с репликой в этом процессе видят старый снимок до переоткрытия
+        connections[REPLICA].close()
+        # Пока реплика отставала, в кэш могли попасть ее старые строки под новыми версиями
+        media_cache.bump_generation()
+        self.stdout.write(self.style.SUCCESS(f"Реплика обновлена: {connections.settings[REPLICA]['NAME']}"))
@@ -0,0 +1,183 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from media.routers import pin_to_primary, replica_configured
+
+logger = logging.getLogger('media.requests')
+
+# Статистика текущего запроса. ContextVar, а не атрибут потока: под ASGI запросы
+# к БД выполняются в потоках пула (см. async_views.run_in_thread), куда контекст копируется
+_current_stats = ContextVar('media_request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = []  # [(sql, секунды)]
+        self.started = time.perf_counter()
+        self.duration = 0.0
+
+    def add(self, sql, duration):
+        self.queries.append((sql, duration))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def sql_time(self):
+        return sum(duration for _, duration in self.queries)
+
+    def slowest(self, limit=3):
+        return sorted(self.queries, key=lambda query: query[1], reverse=True)[:limit]
+
+    def duplicates(self, threshold):
+        # SQL приходит с плейсхолдерами: одинаковый текст с разными параметрами —
+        # признак запроса в цикле (N+1)
+        counts = Counter(sql for sql, _ in self.queries)
+        return [(sql, count) for sql, count in counts.most_common() if count >= threshold]
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add(sql, time.perf_counter() - started)
+
+
+def install_wrapper(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class QueryInstrumentationMiddleware:
+    """Замеры запроса: число SQL-запросов, время в БД, самые медленные запросы.
+
+    Включается настройкой MEDIA_INSTRUMENTATION. Добавляет заголовок Server-Timing
+    (виден во вкладке Network браузера) и пишет в лог media.requests JSON-запись
+    о медленных запросах (дольше MEDIA_SLOW_REQUEST_MS) и о повторяющихся
+    SQL-запросах (не меньше MEDIA_DUPLICATE_QUERY_THRESHOLD одинаковых).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.MEDIA_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        connection_created.connect(install_wrapper, dispatch_uid='media_instrumentation')
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats, token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.finish(request, response, stats)
+
+    def start(self):
+        # Соединения, открытые до включения middleware, сигнал connection_created не застал
+        for connection in connections.all(initialized_only=True):
+            install_wrapper(connection)
+        stats = RequestStats()
+        return stats, _current_stats.set(stats)
+
+    def finish(self, request, response, stats):
+        stats.duration = time.perf_counter() - stats.started
+        request.query_stats = stats
+        response['Server-Timing'] = (
+            f'sql;dur={stats.sql_time * 1000:.1f};desc="{stats.count} queries", '
+            f'total;dur={stats.duration * 1000:.1f}'
+        )
+
+        duplicates = stats.duplicates(settings.MEDIA_DUPLICATE_QUERY_THRESHOLD)
+        slow = stats.duration * 1000 >= settings.MEDIA_SLOW_REQUEST_MS
+        if slow or duplicates:
+            logger.warning(json.dumps({
+                'event': 'slow_request' if slow else 'duplicate_queries',
+                'method': request.method,
+                'path': request.path,
+                'view': request.resolver_match.view_name if request.resolver_match else None,
+                'status': response.status_code,
+                'duration_ms': round(stats.duration * 1000, 1),
+                'queries': stats.count,
+                'sql_ms': round(stats.sql_time * 1000, 1),
+                'slowest': [{'sql': sql, 'ms': round(duration * 1000, 2)} for sql, duration in stats.slowest()],
+                'duplicates': [{'sql': sql, 'count': count} for sql, count in duplicates],
+            }, ensure_ascii=False))
+        return response
+
+
+# Cookie, по которой браузер после записи еще несколько секунд читает с основной БД
+PIN_COOKIE = 'media_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaPinningMiddleware:
+    """Чтение с основной БД в запросах на запись и сразу после них.
+
+    Включается вместе с репликой (MEDIA_DB_REPLICA). После POST браузер получает
+    cookie на MEDIA_REPLICA_PIN_SECONDS: страница, на которую он перенаправлен,
+    показывает только что сделанные изменения, даже если реплика отстает.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replica_configured():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with self.pinning(request):
+            response = self.get_response(request)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        with self.pinning(request):
+            response = await self.get_response(request)
+        return self.finish(request, response)
+
+    def pinning(self, request):
+        if request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES:
+            return pin_to_primary()
+        return nullcontext()
+
+    def finish(self, request, response):
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.MEDIA_REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
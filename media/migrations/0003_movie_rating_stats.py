@@ -0,0 +1,66 @@
+# Generated by Django 5.2.8 on 2026-10-18 06:39
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_rating_stats(apps, schema_editor):
+    Movie = apps.get_model('media', 'Movie')
+    Rating = apps.get_model('media', 'Rating')
+
+    stats = {}
+    grouped = Rating.objects.values_list('movie_id', 'rating').annotate(n=Count('id')).order_by()
+    for movie_id, value, n in grouped:
+        fields = stats.setdefault(movie_id, {'rating_count': 0, 'rating_sum': 0})
+        fields['rating_count'] += n
+        fields['rating_sum'] += value * n
+        fields[f'rating_hist_{value}'] = n
+
+    for movie_id, fields in stats.items():
+        Movie.objects.filter(pk=movie_id).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0002_alter_movie_genre'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_hist_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_hist_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_hist_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_hist_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_hist_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_stats, migrations.RunPython.noop),
+    ]
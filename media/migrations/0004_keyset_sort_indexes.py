@@ -0,0 +1,64 @@
+# Generated by Django 5.2.8 on 2026-10-18 06:40
+
+from django.db import migrations, models
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+
+
+def backfill_rating_avg(apps, schema_editor):
+    Movie = apps.get_model('media', 'Movie')
+    Movie.objects.filter(rating_count__gt=0).update(
+        rating_avg=Cast(F('rating_sum'), FloatField()) / F('rating_count'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0003_movie_rating_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='rating_avg',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_avg, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='audiobook',
+            index=models.Index(fields=['title', 'id'], name='audiobook_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='audiobook',
+            index=models.Index(fields=['publication_date', 'id'], name='audiobook_pubdate_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='audiobook',
+            index=models.Index(fields=['duration', 'id'], name='audiobook_duration_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['publication_date', 'id'], name='book_pubdate_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['title', 'id'], name='movie_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['publication_date', 'id'], name='movie_pubdate_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['duration', 'id'], name='movie_duration_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['rating_avg', 'id'], name='movie_rating_id_idx'),
+        ),
+    ]
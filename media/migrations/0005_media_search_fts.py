@@ -0,0 +1,51 @@
+from django.db import migrations
+
+# Коды типов и шаг rowid совпадают с media/search.py.
+# Триггеры синхронизации устанавливаются после migrate (см. media/signals.py),
+# т.к. пересоздание таблиц SQLite в последующих миграциях их удаляет.
+SOURCES = [
+    # (тип, код, таблица, director, narrator)
+    ('book', 1, 'media_book', "''", "''"),
+    ('movie', 2, 'media_movie', 'director', "''"),
+    ('audiobook', 3, 'media_audiobook', "''", 'narrator'),
+]
+
+
+def _norm(expr):
+    return f"replace(replace({expr}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE media_search USING fts5('
+        'media_type UNINDEXED, item_id UNINDEXED, title, creator, director, narrator, '
+        'tokenize = "unicode61 remove_diacritics 2")'
+    )
+    for media_type, code, table, director, narrator in SOURCES:
+        schema_editor.execute(
+            'INSERT INTO media_search(rowid, media_type, item_id, title, creator, director, narrator) '
+            f"SELECT id * 4 + {code}, '{media_type}', id, {_norm('title')}, {_norm('creator')}, "
+            f'{_norm(director)}, {_norm(narrator)} FROM {table}'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for _, _, table, _, _ in SOURCES:
+        for suffix in ('ai', 'au', 'ad'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_search_{suffix}')
+    schema_editor.execute('DROP TABLE IF EXISTS media_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0004_keyset_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-18 06:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0005_media_search_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('media_type', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('media_type', 'object_id'), name='mediaindex_type_object_uniq')],
+            },
+        ),
+    ]
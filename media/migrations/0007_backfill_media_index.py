@@ -0,0 +1,33 @@
+from django.db import migrations
+
+MEDIA_MODELS = [('book', 'Book'), ('movie', 'Movie'), ('audiobook', 'AudioBook')]
+BATCH_SIZE = 1000
+
+
+def backfill_media_index(apps, schema_editor):
+    MediaIndex = apps.get_model('media', 'MediaIndex')
+    for media_type, model_name in MEDIA_MODELS:
+        model = apps.get_model('media', model_name)
+        batch = []
+        for pk in model.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=BATCH_SIZE):
+            batch.append(MediaIndex(media_type=media_type, object_id=pk))
+            if len(batch) >= BATCH_SIZE:
+                MediaIndex.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        if batch:
+            MediaIndex.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def clear_media_index(apps, schema_editor):
+    apps.get_model('media', 'MediaIndex').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0006_media_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_media_index, clear_media_index),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.8 on 2026-10-18 06:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+BATCH_SIZE = 1000
+
+
+def backfill_leaderboard(apps, schema_editor):
+    Movie = apps.get_model('media', 'Movie')
+    Rating = apps.get_model('media', 'Rating')
+    MovieRanking = apps.get_model('media', 'MovieRanking')
+    MovieRatingDay = apps.get_model('media', 'MovieRatingDay')
+    mean = settings.MEDIA_LEADERBOARD_PRIOR_MEAN
+    weight = settings.MEDIA_LEADERBOARD_PRIOR_WEIGHT
+
+    movies = (Movie.objects.filter(rating_count__gt=0)
+              .values_list('pk', 'genre', 'rating_count', 'rating_sum').iterator(chunk_size=BATCH_SIZE))
+    MovieRanking.objects.bulk_create(
+        (MovieRanking(movie_id=pk, genre=genre, rating_count=count,
+                      score=(mean * weight + total) / (weight + count))
+         for pk, genre, count, total in movies),
+        batch_size=BATCH_SIZE,
+    )
+    days = (Rating.objects.annotate(day=TruncDate('created_at'))
+            .values('movie_id', 'day').annotate(count=Count('id'), total=Sum('rating')).order_by())
+    MovieRatingDay.objects.bulk_create(
+        (MovieRatingDay(movie_id=row['movie_id'], day=row['day'],
+                        rating_count=row['count'], rating_sum=row['total'])
+         for row in days.iterator(chunk_size=BATCH_SIZE)),
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0007_backfill_media_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieRanking',
+            fields=[
+                ('movie', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ranking', serialize=False, to='media.movie')),
+                ('genre', models.CharField(blank=True, max_length=20)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('score', models.FloatField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-score', 'movie'], name='ranking_score_idx'), models.Index(fields=['genre', '-score', 'movie'], name='ranking_genre_score_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MovieRatingDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_days', to='media.movie')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'movie'], name='ratingday_day_movie_idx')],
+                'constraints': [models.UniqueConstraint(fields=('movie', 'day'), name='ratingday_movie_day_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_leaderboard, migrations.RunPython.noop),
+    ]
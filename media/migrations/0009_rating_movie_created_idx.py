@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 06:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0008_leaderboard'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['movie', 'created_at', 'id'], name='rating_movie_created_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.8 on 2026-10-18 06:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0009_rating_movie_created_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='movieratingday',
+            name='ratingday_movie_day_uniq',
+        ),
+        migrations.RemoveIndex(
+            model_name='movieratingday',
+            name='ratingday_day_movie_idx',
+        ),
+        migrations.AlterField(
+            model_name='movieratingday',
+            name='movie',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='rating_days', to='media.movie'),
+        ),
+        migrations.AddIndex(
+            model_name='audiobook',
+            index=models.Index(condition=models.Q(('is_borrowed', True)), fields=['id'], name='audiobook_borrowed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('is_borrowed', True)), fields=['id'], name='book_borrowed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['genre', 'title', 'id'], name='movie_genre_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['genre', 'rating_avg', 'id'], name='movie_genre_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movieratingday',
+            index=models.Index(fields=['day', 'movie', 'rating_count', 'rating_sum'], name='ratingday_day_cover_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='movieratingday',
+            constraint=models.UniqueConstraint(fields=('day', 'movie'), name='ratingday_day_movie_uniq'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0011_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audiobook',
+            name='media_file',
+            field=models.FileField(blank=True, upload_to='media_files/%Y/%m/'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='media_file',
+            field=models.FileField(blank=True, upload_to='media_files/%Y/%m/'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+# Режим журнала WAL хранится в самом файле БД, поэтому включается один раз
+# здесь, а не PRAGMA при каждом подключении (см. SQLITE_PRAGMAS в settings).
+# Внутри транзакции режим журнала не меняется — миграция неатомарная.
+
+
+def set_journal_mode(mode):
+    def apply(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA journal_mode={mode}')
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('media', '0012_media_file'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_journal_mode('WAL'), set_journal_mode('DELETE'), atomic=False),
+    ]
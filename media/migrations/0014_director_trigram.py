@@ -0,0 +1,43 @@
+from django.db import migrations
+
+# Триграммный индекс по режиссеру для фильтра director (см. media/search.py).
+# Токенизатор trigram появился в SQLite 3.34; на старых версиях таблица не
+# создается и фильтр остается на LIKE. Триггеры устанавливаются после migrate.
+TABLE = 'media_director'
+
+
+def _norm(expr):
+    return f"replace(replace({expr}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def create_director_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite' or connection.Database.sqlite_version_info < (3, 34, 0):
+        return
+    schema_editor.execute(
+        f'CREATE VIRTUAL TABLE {TABLE} USING fts5('
+        'media_type UNINDEXED, item_id UNINDEXED, director, tokenize = "trigram")'
+    )
+    schema_editor.execute(
+        f'INSERT INTO {TABLE}(rowid, media_type, item_id, director) '
+        f"SELECT id * 4 + 2, 'movie', id, {_norm('director')} FROM media_movie"
+    )
+
+
+def drop_director_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for suffix in ('ai', 'au', 'ad'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS media_movie_director_{suffix}')
+    schema_editor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0013_sqlite_wal'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_director_index, drop_director_index),
+    ]
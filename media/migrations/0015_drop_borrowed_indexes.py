@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0014_director_trigram'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='audiobook',
+            name='audiobook_borrowed_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='book',
+            name='book_borrowed_idx',
+        ),
+    ]
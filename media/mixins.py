@@ -1,25 +1,187 @@
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast
+from django.urls import reverse
+from django.utils import timezone
+
+from media.actions import MediaAction, request_username
+from media.cache import bump_item_versions, invalidate_media
+from media.pagination import KeysetPaginator
+
+
+class BorrowError(Exception):
+    pass
+
+
+class AlreadyBorrowedError(BorrowError):
+    pass
+
+
+class NotBorrowedError(BorrowError):
+    pass
+
+
 class BorrowableMixin:
+    media_actions = (
+        MediaAction('borrow', 'Взять в аренду', 'btn-success',
+                    handler=lambda obj, request: obj.borrow(request_username(request)),
+                    condition=lambda obj: not obj.is_borrowed, order=40),
+        MediaAction('return', 'Вернуть', 'btn-outline-success',
+                    handler=lambda obj, request: obj.return_item(),
+                    condition=lambda obj: obj.is_borrowed, order=45),
+    )
+
     def borrow(self, user):
+        # Условный UPDATE ... WHERE is_borrowed = false: из параллельных запросов
+        # выигрывает ровно один, остальные получают AlreadyBorrowedError
+        now = timezone.now()
+        updated = type(self).objects.filter(pk=self.pk, is_borrowed=False).update(
+            is_borrowed=True, borrowed_by=user, updated_at=now,
+        )
+        if not updated:
+            raise AlreadyBorrowedError(f"{self.title} уже взято в аренду")
+        self.is_borrowed = True
+        self.borrowed_by = user
+        self.updated_at = now
+        invalidate_media(self)
+        return f"{self.title} взято в аренду пользователем {user}"
+
+    def return_item(self):
+        now = timezone.now()
+        updated = type(self).objects.filter(pk=self.pk, is_borrowed=True).update(
+            is_borrowed=False, borrowed_by='', updated_at=now,
+        )
+        if not updated:
+            raise NotBorrowedError(f"{self.title} не находится в аренде")
+        self.is_borrowed = False
+        self.borrowed_by = ''
+        self.updated_at = now
+        invalidate_media(self)
+        return f"{self.title} возвращено"
+
+    # Пакетные действия (BatchActionService): состояние меняется в памяти,
+    # а в БД записывается одним UPDATE на группу объектов
+    def stage_borrow(self, user):
+        if self.is_borrowed:
+            raise AlreadyBorrowedError(f"{self.title} уже взято в аренду")
         self.is_borrowed = True
         self.borrowed_by = user
-        self.save()
         return f"{self.title} взято в аренду пользователем {user}"
 
+    def stage_return(self):
+        if not self.is_borrowed:
+            raise NotBorrowedError(f"{self.title} не находится в аренде")
+        self.is_borrowed = False
+        self.borrowed_by = ''
+        return f"{self.title} возвращено"
+
+    @classmethod
+    def save_borrow_states(cls, items, initial):
+        """Записывает состояние аренды объектов items, измененное stage_borrow/stage_return.
+
+        initial — {pk: is_borrowed до изменений}. Объекты группируются по
+        (старое состояние, новое состояние, арендатор), на группу — один условный
+        UPDATE ... WHERE pk IN (...) AND is_borrowed = старое. Если строк
+        обновлено меньше, чем объектов, их успел изменить другой запрос:
+        AlreadyBorrowedError/NotBorrowedError, транзакция вызывающего откатывается.
+        """
+        groups = {}
+        for item in items:
+            groups.setdefault((initial[item.pk], item.is_borrowed, item.borrowed_by), []).append(item.pk)
+        now = timezone.now()
+        for (was_borrowed, is_borrowed, borrowed_by), pks in groups.items():
+            updated = cls.objects.filter(pk__in=pks, is_borrowed=was_borrowed).update(
+                is_borrowed=is_borrowed, borrowed_by=borrowed_by, updated_at=now,
+            )
+            if updated != len(pks):
+                error = NotBorrowedError if was_borrowed else AlreadyBorrowedError
+                raise error('Состояние аренды изменилось во время выполнения пакета')
+        for item in items:
+            item.updated_at = now
+        if items:
+            bump_item_versions(items[0].get_media_type(), [item.pk for item in items])
+
 class DownloadableMixin:
+    media_actions = (
+        MediaAction('download', 'Скачать', 'btn-secondary', order=50),
+    )
+
     def download(self):
         return f"Скачивание {self.title} началось..."
 
+    def get_download_url(self):
+        # Ссылка на сам файл (с докачкой через Range); None, если файл не загружен
+        if not getattr(self, 'media_file', None):
+            return None
+        return reverse('media_library:media_file_download', kwargs={'media_type': self.get_media_type(), 'pk': self.pk})
+
+def _review_handler(obj, request):
+    obj.add_review(request.POST.get('comment', ''), request.POST.get('rating'))
+    return 'Спасибо — отзыв добавлен'
+
+
 class ReviewableMixin:
+    media_actions = (
+        # Отзыв оставляется формой на странице, поэтому кнопкой не выводится
+        MediaAction('review', 'Оставить отзыв', visible=False, handler=_review_handler),
+    )
+
     def add_review(self, review_text, rating):
         # Ожидаем, что в модели отзывов используется related_name='ratings'
         if rating is None or not (1 <= int(rating) <= 5):
             raise ValueError('Оценка должна быть от 1 до 5')
-        return self.ratings.create(comment=review_text, rating=int(rating))
+        # Вставка отзыва и обновление агрегатов (сигнал post_save у Rating)
+        # выполняются в одной транзакции
+        with transaction.atomic():
+            return self.ratings.create(comment=review_text, rating=int(rating))
+
+    # Сколько отзывов показывать на странице объекта и отдавать за одну подгрузку
+    reviews_per_page = 10
 
     def get_reviews(self):
         return self.ratings.all()
 
+    def get_reviews_page(self, cursor=None, per_page=None):
+        # Новые отзывы первыми; страница выбирается по индексу (movie, created_at, id),
+        # поэтому ее стоимость не зависит от общего числа отзывов
+        paginator = KeysetPaginator(self.get_reviews(), '-created_at', per_page or self.reviews_per_page)
+        return paginator.get_page(cursor)
+
+    @classmethod
+    def apply_rating_delta(cls, pk, rating, delta):
+        # Атомарный UPDATE ... SET x = x + delta, без чтения строки
+        # В правой части UPDATE используются старые значения столбцов
+        cls.objects.filter(pk=pk).update(
+            rating_count=F('rating_count') + delta,
+            rating_sum=F('rating_sum') + rating * delta,
+            rating_avg=Case(
+                When(rating_count__gt=-delta,
+                     then=Cast(F('rating_sum') + rating * delta, FloatField()) / (F('rating_count') + delta)),
+                default=Value(0.0),
+            ),
+            **{f'rating_hist_{rating}': F(f'rating_hist_{rating}') + delta},
+            updated_at=timezone.now(),
+        )
+
+    def shift_rating_stats(self, rating, delta):
+        # Синхронизирует уже загруженный экземпляр с результатом apply_rating_delta
+        self.rating_count += delta
+        self.rating_sum += rating * delta
+        self.rating_avg = self.rating_sum / self.rating_count if self.rating_count else 0.0
+        field = f'rating_hist_{rating}'
+        setattr(self, field, getattr(self, field) + delta)
+
 
 class StreamableMixin:
+    media_actions = (
+        MediaAction('stream', 'Смотреть онлайн', 'btn-dark', order=30),
+    )
+
     def stream(self):
-        return f"Начинается потоковая трансляция '{self.title}'"
\ No newline at end of file
+        return f"Начинается потоковая трансляция '{self.title}'"
+
+    def get_stream_url(self):
+        # Файл для просмотра в браузере: плеер перематывает его запросами Range
+        if not getattr(self, 'media_file', None):
+            return None
+        return reverse('media_library:media_file_stream', kwargs={'media_type': self.get_media_type(), 'pk': self.pk})
\ No newline at end of file
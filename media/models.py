@@ -4,8 +4,8 @@ from django.db import models
 
 from django.db import models
 
+from media.actions import MediaAction, registry
 from media.mixins import BorrowableMixin, DownloadableMixin, StreamableMixin, ReviewableMixin
-from django.db.models import Avg
 
 
 # Предопределенные жанры для Movie
@@ -17,15 +17,30 @@ GENRE_CHOICES = [
     ('thriller', 'Триллер'),
 ]
 
+# Каталог файлов фильмов и аудиокниг внутри MEDIA_ROOT
+MEDIA_FILES_PATH = 'media_files/%Y/%m/'
+
 
 class MediaItem(models.Model):
+    media_actions = (
+        MediaAction('describe', 'Описание', 'btn-primary',
+                    handler=lambda obj, request: obj.get_description(), order=0),
+    )
+
     title = models.CharField(max_length=200)
     creator = models.CharField(max_length=100)
     publication_date = models.DateField()
     _internal_id = models.CharField(max_length=50, blank=True)  # инкапсуляция
+    # Время последнего изменения (в т.ч. аренды и отзывов) — для Last-Modified
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         abstract = True
+        # Составные индексы под курсорную пагинацию: (поле сортировки, id)
+        indexes = [
+            models.Index(fields=['title', 'id'], name='%(class)s_title_id_idx'),
+            models.Index(fields=['publication_date', 'id'], name='%(class)s_pubdate_id_idx'),
+        ]
 
     def get_description(self):
         raise NotImplementedError("Метод должен быть переопределен в дочерних классах")
@@ -35,7 +50,14 @@ class MediaItem(models.Model):
 
 
 
+@registry.register('book', 'Книга', code=1)
 class Book(BorrowableMixin, MediaItem):
+    media_actions = (
+        MediaAction('read', 'Читать отрывок', 'btn-info',
+                    handler=lambda obj, request: obj.read_sample(), order=10),
+        MediaAction.unsupported('download', "Книги недоступны для скачивания"),
+    )
+
     isbn = models.CharField(max_length=20)
     page_count = models.IntegerField()
     is_borrowed = models.BooleanField(default=False)
@@ -50,12 +72,39 @@ class Book(BorrowableMixin, MediaItem):
     def get_media_type(self):
         return "book"
 
+@registry.register('movie', 'Фильм', code=2)
 class Movie(DownloadableMixin, StreamableMixin, ReviewableMixin, MediaItem):
+    media_actions = (
+        MediaAction('play_trailer', 'Смотреть трейлер', 'btn-warning', order=20),
+    )
+
     GENRE_CHOICES = GENRE_CHOICES
     duration = models.IntegerField()
     format = models.CharField(max_length=10)
     director = models.CharField(max_length=100, blank=True)
     genre = models.CharField(max_length=20, choices=GENRE_CHOICES, blank=True)
+    # Файл для скачивания и просмотра (см. DownloadableMixin, media/files.py)
+    media_file = models.FileField(upload_to=MEDIA_FILES_PATH, blank=True)
+
+    # Денормализованные агрегаты рейтинга: поддерживаются инкрементально
+    # (см. ReviewableMixin), пересчитываются командой rebuild_rating_stats
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_hist_1 = models.PositiveIntegerField(default=0)
+    rating_hist_2 = models.PositiveIntegerField(default=0)
+    rating_hist_3 = models.PositiveIntegerField(default=0)
+    rating_hist_4 = models.PositiveIntegerField(default=0)
+    rating_hist_5 = models.PositiveIntegerField(default=0)
+    rating_avg = models.FloatField(default=0)
+
+    class Meta(MediaItem.Meta):
+        indexes = MediaItem.Meta.indexes + [
+            models.Index(fields=['duration', 'id'], name='%(class)s_duration_id_idx'),
+            models.Index(fields=['rating_avg', 'id'], name='%(class)s_rating_id_idx'),
+            # Фильтр по жанру на главной и в API вместе с основными сортировками
+            models.Index(fields=['genre', 'title', 'id'], name='%(class)s_genre_title_idx'),
+            models.Index(fields=['genre', 'rating_avg', 'id'], name='%(class)s_genre_rating_idx'),
+        ]
 
     def get_description(self):  # полиморфизм
         director = self.director or self.creator
@@ -68,14 +117,30 @@ class Movie(DownloadableMixin, StreamableMixin, ReviewableMixin, MediaItem):
         return "movie"
 
     def get_average_rating(self):
-        agg = self.ratings.aggregate(avg=Avg('rating'))
-        return agg['avg']
+        # Читаем денормализованные поля — без запроса к таблице рейтингов
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
 
+    def get_rating_histogram(self):
+        return {value: getattr(self, f'rating_hist_{value}') for value in range(1, 6)}
+
+@registry.register('audiobook', 'Аудиокнига', code=3)
 class AudioBook(DownloadableMixin, BorrowableMixin, MediaItem):
+    media_actions = (
+        MediaAction.unsupported('play_trailer', "Аудиокниги не имеют трейлеров"),
+    )
+
     duration = models.IntegerField()
     narrator = models.CharField(max_length=100)
     is_borrowed = models.BooleanField(default=False)
     borrowed_by = models.CharField(max_length=100, blank=True)
+    media_file = models.FileField(upload_to=MEDIA_FILES_PATH, blank=True)
+
+    class Meta(MediaItem.Meta):
+        indexes = MediaItem.Meta.indexes + [
+            models.Index(fields=['duration', 'id'], name='%(class)s_duration_id_idx'),
+        ]
 
     def get_description(self):
         return f"Аудиокнига '{self.title}', читает {self.narrator}"
@@ -89,6 +154,71 @@ class Rating(models.Model):
     rating = models.IntegerField(choices=[(i, i) for i in range(1, 6)])
     comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Курсорная пагинация отзывов фильма по дате (см. ReviewableMixin.get_reviews_page)
+        indexes = [
+            models.Index(fields=['movie', 'created_at', 'id'], name='rating_movie_created_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.movie.title} - {self.rating}"
\ No newline at end of file
+        return f"{self.movie.title} - {self.rating}"
+
+
+class MediaIndex(models.Model):
+    """Глобальный реестр медиа: один сквозной id на запись любого типа.
+
+    Поддерживается триггерами SQLite на таблицах медиа (см. MediaIndexService),
+    поэтому учитывает и bulk_create, и массовое удаление.
+    """
+    media_type = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['media_type', 'object_id'], name='mediaindex_type_object_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.media_type}-{self.pk}"
+
+
+class MovieRanking(models.Model):
+    """Материализованная строка лидерборда: байесовская оценка фильма.
+
+    Обновляется при каждом отзыве (см. media/leaderboard.py), поэтому топ-K —
+    чтение по индексу (score) или (genre, score) без группировки по Rating.
+    """
+    movie = models.OneToOneField(Movie, primary_key=True, related_name='ranking', on_delete=models.CASCADE)
+    genre = models.CharField(max_length=20, blank=True)  # копия Movie.genre для индекса по жанру
+    rating_count = models.PositiveIntegerField(default=0)
+    score = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score', 'movie'], name='ranking_score_idx'),
+            models.Index(fields=['genre', '-score', 'movie'], name='ranking_genre_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.movie_id}: {self.score:.3f}"
+
+
+class MovieRatingDay(models.Model):
+    """Дневные суммы оценок фильма — основа лидерборда за последние N дней."""
+    # Без отдельного индекса по movie: иначе SQLite группирует по нему, сканируя
+    # всю таблицу вместо диапазона дат (удаление фильма — редкая операция)
+    movie = models.ForeignKey(Movie, related_name='rating_days', on_delete=models.CASCADE, db_index=False)
+    day = models.DateField()
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'movie'], name='ratingday_day_movie_uniq'),
+        ]
+        indexes = [
+            # Покрывающий: лидерборд за период читает только индекс
+            models.Index(fields=['day', 'movie', 'rating_count', 'rating_sum'], name='ratingday_day_cover_idx'),
+        ]
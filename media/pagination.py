@@ -0,0 +1,107 @@
+import base64
+import binascii
+import json
+from types import SimpleNamespace
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator:
+    """Курсорная (keyset) пагинация по паре (поле сортировки, pk).
+
+    Страница выбирается условием WHERE (field, id) > (значение, pk) по
+    составному индексу, поэтому ее стоимость не зависит от номера страницы
+    и размера таблицы (в отличие от OFFSET).
+    """
+
+    def __init__(self, queryset, ordering, per_page=12):
+        self.queryset = queryset
+        self.ordering = ordering
+        self.field_name = ordering.lstrip('-')
+        self.descending = ordering.startswith('-')
+        self.per_page = per_page
+        self.field = queryset.model._meta.get_field(self.field_name)
+
+    def get_page(self, cursor=None):
+        position = self.decode_cursor(cursor)
+        if position is None:
+            return self._fetch(forward=True)
+        value, pk, forward = position
+        return self._fetch(forward, value, pk)
+
+    def _fetch(self, forward, value=None, pk=None):
+        # При движении назад идем по индексу в обратном порядке, затем разворачиваем
+        descending = self.descending != (not forward)
+        prefix = '-' if descending else ''
+        queryset = self.queryset.order_by(f'{prefix}{self.field_name}', f'{prefix}pk')
+        if pk is not None:
+            lookup = 'lt' if descending else 'gt'
+            # Избыточная граница field >= value (<= при убывании) позволяет SQLite
+            # начать с нужного места индекса; одно условие с OR индекс не использует
+            queryset = queryset.filter(
+                Q(**{f'{self.field_name}__{lookup}e': value}),
+                Q(**{f'{self.field_name}__{lookup}': value})
+                | Q(**{self.field_name: value, f'pk__{lookup}': pk}),
+            )
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+        if not rows:
+            return KeysetPage([])
+
+        if forward:
+            next_cursor = self.encode_cursor(rows[-1], True) if has_more else None
+            previous_cursor = self.encode_cursor(rows[0], False) if pk is not None else None
+        else:
+            next_cursor = self.encode_cursor(rows[-1], True)
+            previous_cursor = self.encode_cursor(rows[0], False) if has_more else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    def encode_cursor(self, item, forward):
+        if isinstance(item, dict):
+            # Строка проекции .values(): поля доступны по ключам
+            item = SimpleNamespace(pk=item['id'], **item)
+        value = self.field.value_to_string(item)
+        payload = json.dumps([self.ordering, value, item.pk, forward], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        # Некорректный или устаревший (от другой сортировки) курсор -> первая страница
+        if not cursor:
+            return None
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            ordering, value, pk, forward = json.loads(base64.urlsafe_b64decode(padded))
+            if ordering != self.ordering:
+                return None
+            return self.field.to_python(value), int(pk), bool(forward)
+        except (binascii.Error, ValueError, TypeError, ValidationError):
+            return None
@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Алиас реплики в DATABASES; добавляется, только если задан MEDIA_DB_REPLICA
+REPLICA = 'replica'
+
+# Чтение с основной БД: в запросах на запись и сразу после них
+# (см. ReplicaPinningMiddleware), пока реплика могла не получить изменения
+_pinned = ContextVar('media_pinned_to_primary', default=False)
+
+
+@contextmanager
+def pin_to_primary():
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def replica_configured():
+    return REPLICA in connections.settings
+
+
+class PrimaryReplicaRouter:
+    """Чтение — с реплики, запись — в основную БД.
+
+    Без реплики роутер ни во что не вмешивается. Внутри транзакции основной БД
+    и в закрепленных запросах чтение тоже идет с основной: транзакция должна
+    видеть свои записи, а реплика может отставать.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not replica_configured():
+            return None
+        if _pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        # Связанные объекты читаем оттуда же, откуда загружен сам объект
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика — копия основной БД, объекты с обеих можно связывать
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема попадает на реплику вместе с данными (manage.py sync_replica)
+        return db == DEFAULT_DB_ALIAS
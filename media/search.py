@@ -0,0 +1,195 @@
+import re
+
+from django.db import connection, connections, router, transaction
+
+from media.actions import registry
+from media.models import MediaIndex
+
+# Полнотекстовый индекс (SQLite FTS5) по всем типам медиа.
+# rowid строки = id * ROWID_STRIDE + код типа из реестра: обновление и
+# удаление записи из триггеров идут по rowid, без сканирования индекса.
+SEARCH_TABLE = 'media_search'
+ROWID_STRIDE = 4
+
+# Веса столбцов для bm25: title, creator, director, narrator
+BM25_WEIGHTS = (10.0, 4.0, 4.0, 2.0)
+
+# Необязательные индексируемые столбцы: если у типа нет поля, пишется пустая строка
+OPTIONAL_COLUMNS = ('director', 'narrator')
+
+WORD_RE = re.compile(r'\w+')
+
+# Триграммный индекс (FTS5 tokenize=trigram, SQLite 3.34+) по режиссеру: фильтр
+# director ищет подстроку, как icontains («olan» находит «Nolan»), но по индексу.
+# Триграммы требуют не меньше трех символов запроса
+DIRECTOR_TABLE = 'media_director'
+TRIGRAM_MIN_LENGTH = 3
+TRIGRAM_SQLITE_VERSION = (3, 34, 0)
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def normalize(text):
+    # unicode61 сам приводит кириллицу к нижнему регистру, но не склеивает ё/е
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def build_match_expression(query, column=None):
+    """Превращает пользовательский ввод в выражение MATCH: все слова, каждое по префиксу.
+
+    column ограничивает поиск одним столбцом индекса (например, director).
+    """
+    terms = WORD_RE.findall(normalize(query))
+    expression = ' '.join(f'"{term}"*' for term in terms)
+    if column and expression:
+        return f'{column} : ({expression})'
+    return expression
+
+
+def trigram_available():
+    # Таблицу создает миграция 0014 там же, где токенизатор trigram доступен
+    return is_available() and connection.Database.sqlite_version_info >= TRIGRAM_SQLITE_VERSION
+
+
+def build_director_expression(text):
+    """Фраза MATCH для поиска подстроки в триграммном индексе; None — запрос короче трех символов."""
+    text = normalize(text.strip())
+    if len(text) < TRIGRAM_MIN_LENGTH:
+        return None
+    return '"{}"'.format(text.replace('"', '""'))
+
+
+def director_subquery_sql():
+    return f'SELECT item_id FROM {DIRECTOR_TABLE} WHERE {DIRECTOR_TABLE} MATCH %s AND media_type = %s'
+
+
+def match_subquery_sql():
+    return f'SELECT item_id FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s AND media_type = %s'
+
+
+def search_media(query, media_types=None, limit=50):
+    """Возвращает [(media_type, item_id, rank), ...], лучшие совпадения первыми."""
+    expression = build_match_expression(query)
+    if not expression:
+        return []
+
+    weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+    sql = (f'SELECT media_type, item_id, bm25({SEARCH_TABLE}, 0, 0, {weights}) AS rank '
+           f'FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s')
+    params = [expression]
+    if media_types:
+        sql += f" AND media_type IN ({', '.join(['%s'] * len(media_types))})"
+        params.extend(media_types)
+    sql += ' ORDER BY rank LIMIT %s'
+    params.append(limit)
+
+    # У FTS-таблицы нет модели: выбираем БД так же, как для индекса медиа (реплика)
+    with connections[router.db_for_read(MediaIndex)].cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _normalized_sql(column):
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def search_sources():
+    """[(тип, код, таблица, [столбцы title, creator, director, narrator]), ...] из реестра."""
+    sources = []
+    for media_type in registry.get_media_types():
+        info = registry.get_type(media_type)
+        columns = ['title', 'creator'] + [name if info.has_field(name) else "''" for name in OPTIONAL_COLUMNS]
+        sources.append((media_type, info.code, info.media_class._meta.db_table, columns))
+    return sources
+
+
+def _row_sql(media_type, code, columns, alias=None):
+    """Выражения столбцов строки индекса для записи таблицы-источника."""
+    def column(name):
+        return f'{alias}.{name}' if alias and name != "''" else name
+
+    values = ', '.join(_normalized_sql(column(name)) for name in columns)
+    return f"{column('id')} * {ROWID_STRIDE} + {code}, '{media_type}', {column('id')}, {values}"
+
+
+INDEX_COLUMNS = 'rowid, media_type, item_id, title, creator, director, narrator'
+DIRECTOR_COLUMNS = 'rowid, media_type, item_id, director'
+
+
+def director_sources():
+    return [(media_type, code, table) for media_type, code, table, columns in search_sources()
+            if columns[2] == 'director']
+
+
+def _director_row_sql(media_type, code, alias=None):
+    prefix = f'{alias}.' if alias else ''
+    return (f"{prefix}id * {ROWID_STRIDE} + {code}, '{media_type}', {prefix}id, "
+            f"{_normalized_sql(prefix + 'director')}")
+
+
+def trigger_statements():
+    """DDL триггеров, поддерживающих индекс при INSERT/UPDATE/DELETE (в т.ч. bulk_create)."""
+    statements = []
+    for media_type, code, table, columns in search_sources():
+        rowid = f'old.id * {ROWID_STRIDE} + {code}'
+        watched = ', '.join(name for name in columns if name != "''")
+        values = _row_sql(media_type, code, columns, 'new')
+        statements += [
+            f'CREATE TRIGGER IF NOT EXISTS {table}_search_ai AFTER INSERT ON {table} BEGIN '
+            f'INSERT INTO {SEARCH_TABLE}({INDEX_COLUMNS}) VALUES ({values}); END',
+            f'CREATE TRIGGER IF NOT EXISTS {table}_search_au AFTER UPDATE OF {watched} ON {table} BEGIN '
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid = {rowid}; '
+            f'INSERT INTO {SEARCH_TABLE}({INDEX_COLUMNS}) VALUES ({values}); END',
+            f'CREATE TRIGGER IF NOT EXISTS {table}_search_ad AFTER DELETE ON {table} BEGIN '
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid = {rowid}; END',
+        ]
+    return statements
+
+
+def director_trigger_statements():
+    statements = []
+    for media_type, code, table in director_sources():
+        rowid = f'old.id * {ROWID_STRIDE} + {code}'
+        values = _director_row_sql(media_type, code, 'new')
+        statements += [
+            f'CREATE TRIGGER IF NOT EXISTS {table}_director_ai AFTER INSERT ON {table} BEGIN '
+            f'INSERT INTO {DIRECTOR_TABLE}({DIRECTOR_COLUMNS}) VALUES ({values}); END',
+            f'CREATE TRIGGER IF NOT EXISTS {table}_director_au AFTER UPDATE OF director ON {table} BEGIN '
+            f'DELETE FROM {DIRECTOR_TABLE} WHERE rowid = {rowid}; '
+            f'INSERT INTO {DIRECTOR_TABLE}({DIRECTOR_COLUMNS}) VALUES ({values}); END',
+            f'CREATE TRIGGER IF NOT EXISTS {table}_director_ad AFTER DELETE ON {table} BEGIN '
+            f'DELETE FROM {DIRECTOR_TABLE} WHERE rowid = {rowid}; END',
+        ]
+    return statements
+
+
+def install_triggers(using='default'):
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return
+    tables = db.introspection.table_names()
+    statements = trigger_statements() if SEARCH_TABLE in tables else []
+    if DIRECTOR_TABLE in tables:
+        statements += director_trigger_statements()
+    with db.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def rebuild_index():
+    """Полностью перестраивает индекс из таблиц медиа. Возвращает число записей."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        for media_type, code, table, columns in search_sources():
+            cursor.execute(f'INSERT INTO {SEARCH_TABLE}({INDEX_COLUMNS}) '
+                           f'SELECT {_row_sql(media_type, code, columns)} FROM {table}')
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES('optimize')")
+        if trigram_available():
+            cursor.execute(f'DELETE FROM {DIRECTOR_TABLE}')
+            for media_type, code, table in director_sources():
+                cursor.execute(f'INSERT INTO {DIRECTOR_TABLE}({DIRECTOR_COLUMNS}) '
+                               f'SELECT {_director_row_sql(media_type, code)} FROM {table}')
+        cursor.execute(f'SELECT count(*) FROM {SEARCH_TABLE}')
+        return cursor.fetchone()[0]
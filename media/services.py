@@ -1,16 +1,22 @@
-from media.models import Book, AudioBook, Movie
+import re
+from itertools import islice
+
+from django.db import connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from media import autocomplete, leaderboard
+from media.actions import registry, request_username
+from media.cache import bump_item_versions, bump_type_version
+from media.mixins import BorrowableMixin, BorrowError
+from media.models import MediaIndex, Movie, Rating
 
 
 class MediaFactory:
+    # Типы медиа берутся из реестра: новый тип добавляется одной регистрацией модели
     @staticmethod
     def create_media(media_type, **kwargs):
-        creators = {
-            'book': Book,
-            'movie': Movie,
-            'audiobook': AudioBook,
-        }
-
-        media_class = creators.get(media_type)
+        media_class = registry.get_media_class(media_type)
         if not media_class:
             raise ValueError(f"Неизвестный тип медиа: {media_type}")
 
@@ -18,13 +24,296 @@ class MediaFactory:
 
     @staticmethod
     def get_media_class(media_type):
-        mapping = {
-            'book': Book,
-            'movie': Movie,
-            'audiobook': AudioBook,
-        }
-        return mapping.get(media_type)
+        return registry.get_media_class(media_type)
 
     @staticmethod
     def get_all_media_types():
-        return ['book', 'movie', 'audiobook']
\ No newline at end of file
+        return registry.get_media_types()
+
+    @staticmethod
+    def create_many(items, batch_size=1000):
+        """Потоково создает объекты из итерируемого [(media_type, kwargs), ...].
+
+        Элементы читаются пачками по batch_size; каждая пачка вставляется через
+        bulk_create в своей транзакции. Дубликаты по (тип, название, автор) —
+        внутри пачки и среди уже сохраненных — пропускаются.
+        Возвращает {'created': ..., 'duplicates': ...}.
+        """
+        stats = {'created': 0, 'duplicates': 0}
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, batch_size))
+            if not chunk:
+                return stats
+
+            by_type = {}
+            for media_type, kwargs in chunk:
+                if not MediaFactory.get_media_class(media_type):
+                    raise ValueError(f"Неизвестный тип медиа: {media_type}")
+                by_type.setdefault(media_type, []).append(kwargs)
+
+            with transaction.atomic():
+                for media_type, rows in by_type.items():
+                    media_class = MediaFactory.get_media_class(media_type)
+                    seen = set(
+                        media_class.objects
+                        .filter(title__in={row['title'] for row in rows})
+                        .values_list('title', 'creator')
+                    )
+                    objects = []
+                    for row in rows:
+                        key = (row['title'], row['creator'])
+                        if key in seen:
+                            stats['duplicates'] += 1
+                            continue
+                        seen.add(key)
+                        objects.append(media_class(**row))
+                    media_class.objects.bulk_create(objects, batch_size=batch_size)
+                    stats['created'] += len(objects)
+                    # bulk_create не шлет сигналы — списки этого типа устарели
+                    if objects:
+                        bump_type_version(media_type)
+                        autocomplete.index.invalidate()
+
+    @staticmethod
+    def resolve(ref):
+        """Находит объект по глобальному id: '42' или с префиксом типа 'movie-42'.
+
+        В 'movie-42' 42 — тоже глобальный id (MediaIndex), а не pk фильма:
+        префикс только проверяется. Один запрос к MediaIndex по первичному ключу и один — к таблице типа.
+        Возвращает None, если объект не найден или префикс не совпадает с типом.
+        """
+        match = MediaIndexService.REF_RE.fullmatch(str(ref))
+        if not match:
+            return None
+        prefix, global_id = match.group('media_type'), int(match.group('global_id'))
+        entry = MediaIndex.objects.filter(pk=global_id).values_list('media_type', 'object_id').first()
+        if entry is None or (prefix and prefix != entry[0]):
+            return None
+        media_class = MediaFactory.get_media_class(entry[0])
+        return media_class.objects.filter(pk=entry[1]).first()
+
+    @staticmethod
+    def find_by_pk(pk, capability):
+        """Старые ссылки /media/<pk>/...: pk — первичный ключ в таблице типа, а не глобальный id.
+
+        Типы перебираются в порядке реестра, подходит первый объект с действием capability.
+        """
+        for media_type in registry.get_media_types():
+            if capability in registry.get_capabilities(media_type):
+                item = registry.get_media_class(media_type).objects.filter(pk=pk).first()
+                if item is not None:
+                    return item
+        return None
+
+    @staticmethod
+    def get_global_id(media_item):
+        global_id = (MediaIndex.objects
+                     .filter(media_type=media_item.get_media_type(), object_id=media_item.pk)
+                     .values_list('pk', flat=True).first())
+        return f"{media_item.get_media_type()}-{global_id}" if global_id is not None else None
+
+
+class RatingStatsService:
+    STATS_FIELDS = ['rating_count', 'rating_sum', 'rating_avg'] + [f'rating_hist_{i}' for i in range(1, 6)]
+
+    @staticmethod
+    def rebuild(movie_ids=None, batch_size=1000):
+        """Пересчитывает агрегаты рейтинга из таблицы Rating.
+
+        Фильмы обходятся пачками по возрастанию id; для каждой пачки выполняется
+        один сгруппированный запрос, поэтому память не растет с размером каталога.
+        Возвращает количество обработанных фильмов.
+        """
+        movies = Movie.objects.order_by('pk').only('pk', *RatingStatsService.STATS_FIELDS)
+        if movie_ids is not None:
+            movies = movies.filter(pk__in=movie_ids)
+
+        processed = 0
+        last_pk = 0
+        while True:
+            batch = list(movies.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return processed
+            last_pk = batch[-1].pk
+
+            histograms = {movie.pk: dict.fromkeys(range(1, 6), 0) for movie in batch}
+            grouped = (Rating.objects.filter(movie_id__in=histograms)
+                       .values_list('movie_id', 'rating').annotate(n=Count('id')).order_by())
+            for movie_id, value, n in grouped:
+                histograms[movie_id][value] = n
+
+            now = timezone.now()
+            for movie in batch:
+                # bulk_update не трогает auto_now: без этого Last-Modified страницы не изменится
+                movie.updated_at = now
+                histogram = histograms[movie.pk]
+                movie.rating_count = sum(histogram.values())
+                movie.rating_sum = sum(value * n for value, n in histogram.items())
+                movie.rating_avg = movie.rating_sum / movie.rating_count if movie.rating_count else 0.0
+                for value, n in histogram.items():
+                    setattr(movie, f'rating_hist_{value}', n)
+            RatingStatsService._flush(batch)
+            bump_item_versions('movie', [movie.pk for movie in batch])
+            processed += len(batch)
+
+    @staticmethod
+    def add_reviews_bulk(reviews, batch_size=1000, on_error=None):
+        """Добавляет отзывы пачками: {'movie_id', 'rating', 'comment'} на отзыв.
+
+        Пачка проверяется целиком (существование фильмов — одним запросом) и
+        вставляется одним bulk_create. bulk_create не вызывает сигналы, поэтому
+        агрегаты затронутых фильмов, дневные суммы и рейтинги лидербордов
+        обновляются один раз на пачку. Некорректные отзывы пропускаются и
+        передаются в on_error(review, сообщение). Возвращает число созданных.
+        """
+        created = 0
+        reviews = iter(reviews)
+        while batch := list(islice(reviews, batch_size)):
+            valid = []
+            for review in batch:
+                try:
+                    valid.append((review, RatingStatsService._clean_review(review)))
+                except ValueError as e:
+                    if on_error:
+                        on_error(review, str(e))
+            existing = set(Movie.objects.filter(pk__in={rating.movie_id for _, rating in valid})
+                           .values_list('pk', flat=True))
+            ratings = []
+            for review, rating in valid:
+                if rating.movie_id in existing:
+                    ratings.append(rating)
+                elif on_error:
+                    on_error(review, f'фильм {rating.movie_id} не найден')
+            if not ratings:
+                continue
+            with transaction.atomic():
+                Rating.objects.bulk_create(ratings)
+                leaderboard.record_ratings(ratings)
+                RatingStatsService.rebuild({rating.movie_id for rating in ratings}, batch_size)
+            created += len(ratings)
+        return created
+
+    @staticmethod
+    def _clean_review(review):
+        # Те же правила, что у ReviewableMixin.add_review
+        try:
+            movie_id = int(review.get('movie_id'))
+            rating = int(review.get('rating'))
+        except (TypeError, ValueError):
+            raise ValueError('movie_id и rating должны быть числами')
+        if not 1 <= rating <= 5:
+            raise ValueError('Оценка должна быть от 1 до 5')
+        return Rating(movie_id=movie_id, rating=rating, comment=str(review.get('comment') or ''))
+
+    @staticmethod
+    def _flush(batch):
+        with transaction.atomic():
+            Movie.objects.bulk_update(batch, [*RatingStatsService.STATS_FIELDS, 'updated_at'])
+            leaderboard.refresh_rankings(movie.pk for movie in batch)
+
+
+class MediaIndexService:
+    # Глобальный id в URL: '42' или 'movie-42'
+    REF_RE = re.compile(r'(?:(?P<media_type>[a-z]+)-)?(?P<global_id>\d+)')
+
+    @staticmethod
+    def trigger_statements():
+        index_table = MediaIndex._meta.db_table
+        statements = []
+        for media_type in registry.get_media_types():
+            table = registry.get_media_class(media_type)._meta.db_table
+            statements += [
+                f'CREATE TRIGGER IF NOT EXISTS {table}_index_ai AFTER INSERT ON {table} BEGIN '
+                f"INSERT INTO {index_table}(media_type, object_id) VALUES ('{media_type}', new.id); END",
+                f'CREATE TRIGGER IF NOT EXISTS {table}_index_ad AFTER DELETE ON {table} BEGIN '
+                f"DELETE FROM {index_table} WHERE media_type = '{media_type}' AND object_id = old.id; END",
+            ]
+        return statements
+
+    @staticmethod
+    def install_triggers(using='default'):
+        db = connections[using]
+        if db.vendor != 'sqlite' or MediaIndex._meta.db_table not in db.introspection.table_names():
+            return
+        with db.cursor() as cursor:
+            for statement in MediaIndexService.trigger_statements():
+                cursor.execute(statement)
+
+
+class BatchActionService:
+    # Действия, которые в пакете выполняются set-based, а не по объекту
+    STAGED_ACTIONS = {
+        'borrow': lambda item, user: item.stage_borrow(user),
+        'return': lambda item, user: item.stage_return(),
+    }
+
+    @staticmethod
+    def run(operations, request):
+        """Выполняет список действий [{'media_type', 'id', 'action'}, ...] в одной транзакции.
+
+        Объекты загружаются одним in_bulk на тип, аренда и возврат пишутся
+        условными UPDATE по группам (BorrowableMixin.save_borrow_states), так что
+        число запросов не зависит от размера пакета. Возвращает результаты в
+        порядке операций: {'status': 200, 'result': ...} или {'status': 4xx, 'error': ...}.
+        """
+        results = [None] * len(operations)
+        tasks = []
+        for index, operation in enumerate(operations):
+            try:
+                tasks.append((index, *BatchActionService._parse(operation)))
+            except ValueError as e:
+                results[index] = {'status': 400, 'error': str(e)}
+
+        ids = {}
+        for _, media_type, pk, _ in tasks:
+            ids.setdefault(media_type, set()).add(pk)
+
+        user = request_username(request)
+        with transaction.atomic():
+            # select_for_update блокирует строки там, где СУБД это умеет; SQLite
+            # берет блокировку на запись при BEGIN (transaction_mode IMMEDIATE)
+            items = {media_type: registry.get_media_class(media_type).objects.select_for_update().in_bulk(pks)
+                     for media_type, pks in ids.items()}
+            initial = {media_type: {} for media_type in items}
+            for index, media_type, pk, action in tasks:
+                item = items[media_type].get(pk)
+                if item is None:
+                    results[index] = {'status': 404, 'error': 'Объект не найден'}
+                    continue
+                try:
+                    if action.code in BatchActionService.STAGED_ACTIONS and isinstance(item, BorrowableMixin):
+                        initial[media_type].setdefault(pk, (item.is_borrowed, item.borrowed_by))
+                        result = BatchActionService.STAGED_ACTIONS[action.code](item, user)
+                    else:
+                        result = action.run(item, request)
+                except BorrowError as e:
+                    results[index] = {'status': 409, 'error': str(e)}
+                except ValueError as e:
+                    results[index] = {'status': 400, 'error': str(e)}
+                else:
+                    results[index] = {'status': 200, 'result': result}
+
+            for media_type, states in initial.items():
+                # Аренда и возврат одного объекта в пакете дают исходное состояние — писать нечего
+                changed = [item for item in map(items[media_type].get, states)
+                           if (item.is_borrowed, item.borrowed_by) != states[item.pk]]
+                if changed:
+                    registry.get_media_class(media_type).save_borrow_states(
+                        changed, {pk: is_borrowed for pk, (is_borrowed, _) in states.items()})
+        return results
+
+    @staticmethod
+    def _parse(operation):
+        if not isinstance(operation, dict):
+            raise ValueError('Операция должна быть объектом')
+        media_type, code = operation.get('media_type'), operation.get('action', 'describe')
+        if not isinstance(media_type, str) or not registry.get_media_class(media_type):
+            raise ValueError('Неизвестный тип медиа')
+        action = registry.get_action(media_type, code) if isinstance(code, str) else None
+        if not action:
+            raise ValueError('Неизвестное действие')
+        pk = operation.get('id')
+        if isinstance(pk, bool) or not isinstance(pk, (int, str)) or not str(pk).isdigit():
+            raise ValueError('Некорректный id')
+        return media_type, int(pk), action
@@ -0,0 +1,68 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from media import autocomplete, leaderboard, search
+from media.cache import bump_item_version, invalidate_media
+from media.models import AudioBook, Book, Movie, Rating
+from media.services import MediaIndexService
+
+
+@receiver(post_save, sender=Rating)
+def rating_created(sender, instance, created, raw=False, **kwargs):
+    if not created or raw:
+        return
+    Movie.apply_rating_delta(instance.movie_id, instance.rating, 1)
+    if Rating.movie.is_cached(instance):
+        instance.movie.shift_rating_stats(instance.rating, 1)
+    leaderboard.record_rating(instance, 1)
+    bump_item_version('movie', instance.movie_id)
+
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, **kwargs):
+    # При удалении самого фильма отзывы и строки лидербордов удаляются каскадом:
+    # агрегаты удаляемого фильма не пересчитываем, его версию меняет media_changed
+    if isinstance(kwargs.get('origin'), Movie):
+        return
+    Movie.apply_rating_delta(instance.movie_id, instance.rating, -1)
+    if Rating.movie.is_cached(instance):
+        instance.movie.shift_rating_stats(instance.rating, -1)
+    leaderboard.record_rating(instance, -1)
+    bump_item_version('movie', instance.movie_id)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=AudioBook)
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=AudioBook)
+def media_changed(sender, instance, **kwargs):
+    invalidate_media(instance)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=AudioBook)
+def media_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.index.update_object(instance)
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=AudioBook)
+def media_deleted(sender, instance, **kwargs):
+    autocomplete.index.remove_object(instance)
+
+
+@receiver(post_save, sender=Movie)
+def movie_saved(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        leaderboard.sync_genre(instance)
+
+
+def install_triggers(sender, using='default', **kwargs):
+    # Пересоздание таблицы в миграциях SQLite удаляет триггеры — восстанавливаем их
+    search.install_triggers(using)
+    MediaIndexService.install_triggers(using)
@@ -1,9 +1,53 @@
-from django.test import TestCase
-from django.urls import reverse
+import gzip
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
 
-from .models import Movie, Rating
-from .services import MediaFactory
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from .models import AudioBook, Book, MediaIndex, Movie, MovieRanking, MovieRatingDay, Rating
+from . import cache as media_cache
+from . import api, autocomplete, bench, export, files, leaderboard, search, views
+from .actions import MediaAction, MediaTypeInfo, registry
+from .catalog import CatalogQuery
+from .services import MediaFactory, RatingStatsService
 from .forms import MediaForm
+from .middleware import ReplicaPinningMiddleware
+from .mixins import AlreadyBorrowedError, NotBorrowedError
+from .routers import PrimaryReplicaRouter, pin_to_primary
+
+
+class CacheTestCase(TestCase):
+	"""Тесты закэшированных страниц и счетчиков.
+
+	Версии в кэше увеличиваются после фиксации транзакции, а тест откатывается
+	без нее: кэш очищается перед каждым тестом, а записи, которые должны
+	сбросить кэш, выполняются внутри self.commit().
+	"""
+
+	def setUp(self):
+		cache.clear()
+
+	def commit(self):
+		return self.captureOnCommitCallbacks(execute=True)
 
 
 class MovieModelTests(TestCase):
@@ -81,3 +125,1373 @@ class RatingsAndFilteringTests(TestCase):
 		movies = resp.context['movies']
 		self.assertEqual(len(movies), 1)
 		self.assertEqual(movies[0].title, 'M1')
+
+	def test_director_filter_matches_substring(self):
+		movie = dict(creator='C', publication_date='2020-01-01', duration=90, format='mp4')
+		Movie.objects.create(title='Inception', director='Christopher Nolan', **movie)
+		Movie.objects.create(title='Зеркало', director='Андрей Тарковский', **movie)
+		Movie.objects.create(title='Hero', director='Jet Li', **movie)
+
+		def titles(director):
+			return [m.title for m in CatalogQuery({'director': director}).get_queryset('movie')]
+		self.assertEqual(titles('olan'), ['Inception'])
+		self.assertEqual(titles('NOLAN'), ['Inception'])
+		self.assertEqual(titles('арковск'), ['Зеркало'])
+		# Короче трех символов — без триграмм, тем же LIKE
+		self.assertEqual(titles('li'), ['Hero'])
+		Movie.objects.filter(title='Inception').update(director='Denis Villeneuve')
+		self.assertEqual(titles('olan'), [])
+
+
+class RatingAggregateTests(TestCase):
+	def setUp(self):
+		self.movie = Movie.objects.create(title='Agg', creator='C', publication_date='2020-01-01', duration=90, format='mp4', director='D')
+
+	def test_add_review_updates_stats(self):
+		self.movie.add_review('Хорошо', 4)
+		self.movie.add_review('Отлично', 5)
+		self.assertEqual(self.movie.rating_count, 2)
+		fresh = Movie.objects.get(pk=self.movie.pk)
+		self.assertEqual((fresh.rating_count, fresh.rating_sum), (2, 9))
+		self.assertEqual(fresh.get_rating_histogram(), {1: 0, 2: 0, 3: 0, 4: 1, 5: 1})
+		with self.assertNumQueries(0):
+			self.assertEqual(fresh.get_average_rating(), 4.5)
+
+	def test_delete_rating_updates_stats(self):
+		review = self.movie.add_review('', 2)
+		self.movie.add_review('', 4)
+		review.delete()
+		fresh = Movie.objects.get(pk=self.movie.pk)
+		self.assertEqual((fresh.rating_count, fresh.rating_sum, fresh.rating_hist_2), (1, 4, 0))
+
+	def test_movie_delete_cost_does_not_grow_with_reviews(self):
+		def delete_queries(reviews):
+			movie = Movie.objects.create(title='Del', creator='C', publication_date='2020-01-01', duration=90, format='mp4', director='D')
+			for rating in range(1, reviews + 1):
+				movie.add_review('', rating)
+			with CaptureQueriesContext(connection) as ctx:
+				movie.delete()
+			return len(ctx)
+		self.assertEqual(delete_queries(5), delete_queries(1))
+
+	def test_rebuild_command_fixes_drift(self):
+		self.movie.add_review('', 3)
+		Movie.objects.filter(pk=self.movie.pk).update(rating_count=10, rating_sum=0, rating_hist_1=7)
+		call_command('rebuild_rating_stats', stdout=StringIO())
+		fresh = Movie.objects.get(pk=self.movie.pk)
+		self.assertEqual((fresh.rating_count, fresh.rating_sum, fresh.rating_hist_1, fresh.rating_hist_3), (1, 3, 0, 1))
+
+	def test_list_page_reads_stored_average(self):
+		for i in range(3):
+			movie = Movie.objects.create(title=f'L{i}', creator='C', publication_date='2020-01-01', duration=90, format='mp4', director='D')
+			movie.add_review('', 5)
+		with CaptureQueriesContext(connection) as ctx:
+			self.client.get(reverse('media_library:media_list'))
+		self.assertFalse([q for q in ctx.captured_queries if 'media_rating' in q['sql']])
+
+
+class KeysetPaginationTests(TestCase):
+	def setUp(self):
+		for i in range(30):
+			Book.objects.create(title=f'Book {i:02d}', creator='A', publication_date=f'2000-01-{i % 28 + 1:02d}', isbn=str(i), page_count=100)
+
+	def test_next_and_previous_cursors(self):
+		url = reverse('media_library:media_list')
+		first = self.client.get(url)
+		page = first.context['pages']['book']
+		self.assertEqual([b.title for b in page], [f'Book {i:02d}' for i in range(12)])
+		self.assertFalse(page.has_previous)
+
+		second = self.client.get(url, {'book_cursor': page.next_cursor}).context['pages']['book']
+		self.assertEqual([b.title for b in second], [f'Book {i:02d}' for i in range(12, 24)])
+
+		back = self.client.get(url, {'book_cursor': second.previous_cursor}).context['pages']['book']
+		self.assertEqual([b.title for b in back], [f'Book {i:02d}' for i in range(12)])
+		self.assertFalse(back.has_previous)
+
+	def test_descending_sort_with_ties_is_stable(self):
+		url = reverse('media_library:media_list')
+		seen = []
+		cursor = None
+		while True:
+			params = {'sort': '-publication_date'}
+			if cursor:
+				params['book_cursor'] = cursor
+			page = self.client.get(url, params).context['pages']['book']
+			seen.extend(page)
+			cursor = page.next_cursor
+			if not cursor:
+				break
+		self.assertEqual(len({b.pk for b in seen}), 30)
+		dates = [b.publication_date for b in seen]
+		self.assertEqual(dates, sorted(dates, reverse=True))
+
+	def test_rating_sort_and_json_variant(self):
+		low = Movie.objects.create(title='Low', creator='C', publication_date='2020-01-01', duration=90, format='mp4', director='D')
+		high = Movie.objects.create(title='High', creator='C', publication_date='2020-01-01', duration=90, format='mp4', director='D')
+		low.add_review('', 2)
+		high.add_review('', 5)
+		resp = self.client.get(reverse('media_library:media_list_json'), {'sort': '-rating'})
+		data = resp.json()
+		self.assertEqual([m['title'] for m in data['movie']['results']], ['High', 'Low'])
+		self.assertEqual(len(data['book']['results']), 12)
+		self.assertIsNotNone(data['book']['next'])
+
+	def test_invalid_cursor_falls_back_to_first_page(self):
+		resp = self.client.get(reverse('media_library:media_list'), {'book_cursor': 'garbage!'})
+		self.assertEqual(resp.context['books'][0].title, 'Book 00')
+
+
+class CatalogQueryTests(TestCase):
+	def setUp(self):
+		Book.objects.create(title='Война и мир', creator='Толстой', publication_date='1869-01-01', isbn='1', page_count=1200)
+		Book.objects.create(title='Анна Каренина', creator='Толстой', publication_date='1877-01-01', isbn='2', page_count=800)
+		AudioBook.objects.create(title='Война миров', creator='Уэллс', publication_date='1898-01-01', duration=400, narrator='N')
+		Movie.objects.create(title='Война', creator='C', publication_date='2002-01-01', duration=120, format='mp4', director='Балабанов', genre='drama')
+
+	def test_search_applies_to_all_types(self):
+		resp = self.client.get(reverse('media_library:media_list'), {'q': 'Война'})
+		self.assertEqual([b.title for b in resp.context['books']], ['Война и мир'])
+		self.assertEqual([a.title for a in resp.context['audiobooks']], ['Война миров'])
+		self.assertEqual([m.title for m in resp.context['movies']], ['Война'])
+
+	def test_type_specific_filters_leave_other_types(self):
+		catalog = CatalogQuery({'genre': 'comedy'})
+		self.assertEqual(catalog.get_queryset('movie').count(), 0)
+		self.assertEqual(catalog.get_queryset('book').count(), 2)
+
+	def test_querysets_are_built_once(self):
+		catalog = CatalogQuery({'q': 'Война'})
+		self.assertIs(catalog.get_queryset('book'), catalog.get_queryset('book'))
+
+	def test_list_page_query_budget(self):
+		for i in range(20):
+			Movie.objects.create(title=f'M{i}', creator='C', publication_date='2020-01-01', duration=90, format='mp4', director='D')
+		# Ровно один запрос на тип медиа, независимо от числа записей
+		with self.assertNumQueries(3):
+			self.client.get(reverse('media_library:media_list'), {'q': 'M', 'genre': '', 'sort': '-rating'})
+
+
+class FacetTests(CacheTestCase):
+	def setUp(self):
+		super().setUp()
+		movie = {'creator': 'C', 'publication_date': '2000-01-01', 'duration': 90}
+		self.war = Movie.objects.create(title='Война', format='mp4', director='Балабанов', genre='drama', **movie)
+		Movie.objects.create(title='Брат', format='mkv', director='Балабанов', genre='drama', **movie)
+		Movie.objects.create(title='Жмурки', format='mp4', director='Балабанов', genre='comedy', **movie)
+		Movie.objects.create(title='Сталкер', format='mp4', director='Тарковский', genre='drama', **movie)
+		Book.objects.create(title='Война и мир', creator='Толстой', publication_date='1869-01-01', isbn='1', page_count=1200).borrow('alice')
+		Book.objects.create(title='Анна Каренина', creator='Толстой', publication_date='1877-01-01', isbn='2', page_count=800)
+		AudioBook.objects.create(title='Война миров', creator='Уэллс', publication_date='1898-01-01', duration=400, narrator='N')
+
+	def test_counts_follow_filters(self):
+		with self.assertNumQueries(3):
+			facets = CatalogQuery({}).get_facets()
+		self.assertEqual(facets['media_type'], {'book': 2, 'movie': 4, 'audiobook': 1})
+		self.assertEqual(facets['genre'], {'drama': 3, 'comedy': 1})
+		self.assertEqual(facets['format'], {'mp4': 3, 'mkv': 1})
+		self.assertEqual(facets['director'], {'Балабанов': 3, 'Тарковский': 1})
+		self.assertEqual(facets['borrowed'], {'false': 2, 'true': 1})
+		facets = CatalogQuery({'q': 'Война', 'genre': 'drama'}).get_facets()
+		self.assertEqual(facets['media_type'], {'book': 1, 'movie': 1, 'audiobook': 1})
+		self.assertEqual(facets['director'], {'Балабанов': 1})
+		with override_settings(MEDIA_FACET_LIMIT=1):
+			self.assertEqual(CatalogQuery({}).get_facets()['director'], {'Балабанов': 3})
+
+	def test_filter_does_not_hide_its_own_facet(self):
+		# Фасет считается без собственного фильтра: остальные жанры видны, чтобы переключиться на них
+		with self.assertNumQueries(3):
+			facets = CatalogQuery({'genre': 'drama'}).get_facets()
+		self.assertEqual(facets['genre'], {'drama': 3, 'comedy': 1})
+		self.assertEqual(facets['media_type']['movie'], 3)
+		self.assertEqual(facets['format'], {'mp4': 2, 'mkv': 1})
+		self.assertEqual(facets['director'], {'Балабанов': 2, 'Тарковский': 1})
+		facets = CatalogQuery({'genre': 'comedy', 'director': 'тарк'}).get_facets()
+		self.assertEqual(facets['media_type']['movie'], 0)
+		self.assertEqual(facets['genre'], {'drama': 1})
+		self.assertEqual(facets['director'], {'Балабанов': 1})
+		self.assertEqual(facets['format'], {})
+
+	def test_cached_until_type_changes(self):
+		CatalogQuery({'genre': 'drama'}).get_facets()
+		with self.assertNumQueries(0):
+			CatalogQuery({'genre': 'drama'}).get_facets()
+		# Жанр не действует на книги: их счетчики берутся из того же ключа
+		with self.assertNumQueries(1):
+			CatalogQuery({'genre': 'comedy'}).get_facets()
+		self.war.genre = 'comedy'
+		with self.commit():
+			self.war.save()
+		with self.assertNumQueries(1):
+			facets = CatalogQuery({'genre': 'comedy'}).get_facets()
+		self.assertEqual(facets['media_type']['movie'], 2)
+
+	def test_facets_endpoint(self):
+		data = self.client.get(reverse('media_library:media_facets'), {'director': 'тарк'}).json()
+		self.assertEqual(data['media_type']['movie'], 1)
+		self.assertEqual(data['genre'], {'drama': 1})
+		self.assertEqual(data['borrowed'], {'false': 2, 'true': 1})
+		resp = self.client.get(reverse('media_library:media_list'))
+		self.assertContains(resp, reverse('media_library:media_facets'))
+
+
+class JsonApiTests(TestCase):
+	def setUp(self):
+		for i in range(3):
+			Book.objects.create(title=f'Api book {i}', creator='A', publication_date='2000-01-01', isbn=str(i), page_count=10)
+		self.movie = Movie.objects.create(title='Api movie', creator='C', publication_date='2001-02-03', duration=90, format='mp4', director='D', genre='drama')
+		Movie.objects.create(title='Other movie', creator='C', publication_date='2001-02-03', duration=90, format='mp4', director='D', genre='comedy')
+		self.movie.add_review('', 4)
+
+	def test_list_sparse_fields_and_cursor(self):
+		url = reverse('media_library:media_list_json')
+		with self.assertNumQueries(3):
+			data = self.client.get(url, {'fields': 'title,genre', 'genre': 'drama', 'sort': '-rating'}).json()
+		self.assertEqual(data['movie']['results'], [{'id': self.movie.pk, 'media_type': 'movie', 'title': 'Api movie', 'genre': 'drama'}])
+		self.assertEqual(data['book']['results'][0], {'id': Book.objects.order_by('title')[0].pk, 'media_type': 'book', 'title': 'Api book 0'})
+
+		with patch.object(views.MediaListJsonView, 'paginate_by', 2):
+			first = self.client.get(url, {'fields': 'page_count'}).json()['book']
+			second = self.client.get(url, {'fields': 'page_count', 'book_cursor': first['next']}).json()['book']
+		self.assertEqual(len(first['results']) + len(second['results']), 3)
+		self.assertIsNone(second['next'])
+
+	def test_unknown_field_rejected(self):
+		resp = self.client.get(reverse('media_library:media_list_json'), {'fields': 'title,password'})
+		self.assertEqual(resp.status_code, 400)
+		self.assertIn('password', resp.json()['error'])
+
+	def test_detail_and_search(self):
+		url = reverse('media_library:media_detail_json', kwargs={'media_type': 'movie', 'pk': self.movie.pk})
+		self.assertEqual(self.client.get(url, {'fields': 'rating,publication_date'}).json(),
+		                 {'id': self.movie.pk, 'media_type': 'movie', 'rating': 4.0, 'publication_date': '2001-02-03'})
+		self.assertEqual(self.client.get(url).json()['rating_count'], 1)
+		self.assertEqual(self.client.post(url).status_code, 405)
+		missing = reverse('media_library:media_detail_json', kwargs={'media_type': 'movie', 'pk': 999})
+		self.assertEqual(self.client.get(missing).status_code, 404)
+		data = self.client.get(reverse('media_library:media_search'), {'q': 'api', 'fields': 'title'}).json()
+		self.assertEqual({tuple(sorted(r)) for r in data['results']}, {('id', 'media_type', 'rank', 'title')})
+
+	def test_registered_type_gets_fields_without_configuration(self):
+		# Новый тип — одна регистрация: поля API и выгрузки берутся из модели
+		with patch.dict(registry._types, {'ebook': MediaTypeInfo('ebook', Book, 'Электронная книга', 9)}):
+			fields = api.parse_fields('', ['ebook'])['ebook']
+			self.assertEqual(fields, ['title', 'creator', 'publication_date', 'isbn', 'page_count', 'is_borrowed'])
+			records = list(export.iter_records(['ebook']))
+			self.assertEqual(len(records), 3)
+			self.assertNotIn('borrowed_by', records[0])
+			self.assertEqual(api.parse_fields('rating', ['ebook', 'movie']), {'ebook': [], 'movie': ['rating']})
+
+	def test_encoder_fallback_matches_orjson(self):
+		data = {'title': 'Сталкер', 'publication_date': date(1979, 5, 25), 'rating': None}
+		with patch.object(api, 'orjson', None):
+			fallback = api.dumps(data)
+		self.assertEqual(json.loads(fallback), json.loads(api.dumps(data)))
+
+
+class FullTextSearchTests(TestCase):
+	def setUp(self):
+		self.book = Book.objects.create(title='Ёжик в тумане', creator='Козлов', publication_date='1975-01-01', isbn='1', page_count=30)
+		self.audiobook = AudioBook.objects.create(title='Сказки', creator='Пушкин', publication_date='1830-01-01', duration=60, narrator='Смоктуновский')
+		self.movie = Movie.objects.create(title='Сталкер', creator='Мосфильм', publication_date='1979-01-01', duration=160, format='mkv', director='Тарковский')
+
+	def hits(self, query, **kwargs):
+		return [(t, i) for t, i, _ in search.search_media(query, **kwargs)]
+
+	def test_prefix_and_case_insensitive_russian(self):
+		self.assertEqual(self.hits('ежик'), [('book', self.book.pk)])
+		self.assertEqual(self.hits('ТАРКОВ'), [('movie', self.movie.pk)])
+		self.assertEqual(self.hits('смокт'), [('audiobook', self.audiobook.pk)])
+
+	def test_index_follows_update_and_delete(self):
+		self.movie.title = 'Солярис'
+		self.movie.save()
+		self.assertEqual(self.hits('стал'), [])
+		self.assertEqual(self.hits('соляр'), [('movie', self.movie.pk)])
+		self.movie.delete()
+		self.assertEqual(self.hits('соляр'), [])
+
+	def test_title_match_ranks_above_creator_match(self):
+		other = Book.objects.create(title='Записки', creator='Сталкер Петров', publication_date='2000-01-01', isbn='2', page_count=10)
+		self.assertEqual(self.hits('сталкер'), [('movie', self.movie.pk), ('book', other.pk)])
+		self.assertEqual(self.hits('сталкер', media_types=['book']), [('book', other.pk)])
+
+	def test_search_endpoint_and_rebuild_command(self):
+		with connection.cursor() as cursor:
+			cursor.execute('DELETE FROM media_search')
+		self.assertEqual(self.hits('сталк'), [])
+		call_command('rebuild_search_index', stdout=StringIO())
+		data = self.client.get(reverse('media_library:media_search'), {'q': 'сталк'}).json()
+		self.assertEqual([r['title'] for r in data['results']], ['Сталкер'])
+		Movie.objects.create(title='Сталкер 2', creator='C', publication_date='2000-01-01', duration=90, format='mp4', director='D')
+		# Отрицательный LIMIT SQLite понимает как «без ограничения»
+		data = self.client.get(reverse('media_library:media_search'), {'q': 'сталк', 'limit': -1}).json()
+		self.assertEqual(len(data['results']), 1)
+
+
+class MediaIndexTests(TestCase):
+	def setUp(self):
+		self.book = Book.objects.create(title='B', creator='A', publication_date='2000-01-01', isbn='1', page_count=10)
+		self.movie = Movie.objects.create(title='M', creator='C', publication_date='2000-01-01', duration=90, format='mp4', director='D')
+
+	def test_index_rows_follow_create_and_delete(self):
+		# Одинаковые pk у разных типов получают разные глобальные id
+		self.assertEqual(self.book.pk, self.movie.pk)
+		self.assertEqual(MediaIndex.objects.count(), 2)
+		Book.objects.bulk_create([Book(title='X', creator='A', publication_date='2000-01-01', isbn='2', page_count=1)])
+		self.assertEqual(MediaIndex.objects.filter(media_type='book').count(), 2)
+		self.movie.delete()
+		self.assertFalse(MediaIndex.objects.filter(media_type='movie').exists())
+
+	def test_resolve_plain_and_prefixed_ids(self):
+		ref = MediaFactory.get_global_id(self.movie)
+		self.assertTrue(ref.startswith('movie-'))
+		global_id = ref.split('-')[1]
+		with self.assertNumQueries(2):
+			self.assertEqual(MediaFactory.resolve(ref), self.movie)
+		self.assertEqual(MediaFactory.resolve(global_id), self.movie)
+		self.assertIsNone(MediaFactory.resolve(f'book-{global_id}'))
+		self.assertIsNone(MediaFactory.resolve('999999'))
+
+	def test_borrow_and_detail_by_global_id(self):
+		ref = MediaFactory.get_global_id(self.book)
+		resp = self.client.post(reverse('media_library:borrow_media', kwargs={'ref': ref}))
+		self.assertEqual(resp.status_code, 200)
+		self.book.refresh_from_db()
+		self.assertTrue(self.book.is_borrowed)
+
+		resp = self.client.get(reverse('media_library:media_detail_global', kwargs={'ref': ref}))
+		self.assertEqual(resp.context['media_item'], self.book)
+		resp = self.client.get(reverse('media_library:media_detail_global', kwargs={'ref': 'movie-999999'}))
+		self.assertEqual(resp.status_code, 404)
+
+	def test_legacy_links_use_table_pk(self):
+		# /media/<pk>/borrow/ — первичный ключ книги, даже если глобальный id с ним не совпадает
+		book = Book.objects.create(title='B2', creator='A', publication_date='2000-01-01', isbn='3', page_count=10)
+		self.assertNotEqual(MediaFactory.get_global_id(book), f'book-{book.pk}')
+		self.assertEqual(reverse('media_library:borrow_media_by_pk', kwargs={'pk': book.pk}), f'/media/{book.pk}/borrow/')
+		resp = self.client.post(reverse('media_library:borrow_media_by_pk', kwargs={'pk': book.pk}))
+		self.assertEqual(resp.status_code, 200)
+		book.refresh_from_db()
+		self.assertTrue(book.is_borrowed)
+
+	def test_mismatched_prefix_is_rejected(self):
+		global_id = MediaFactory.get_global_id(self.book).split('-')[1]
+		resp = self.client.post(reverse('media_library:borrow_media', kwargs={'ref': f'movie-{global_id}'}))
+		self.assertEqual(resp.status_code, 400)
+		self.book.refresh_from_db()
+		self.assertFalse(self.book.is_borrowed)
+
+
+class BorrowTests(TestCase):
+	def setUp(self):
+		self.book = Book.objects.create(title='B', creator='A', publication_date='2000-01-01', isbn='1', page_count=10)
+
+	def test_borrow_and_return(self):
+		self.book.borrow('alice')
+		stale = Book.objects.get(pk=self.book.pk)
+		with self.assertRaises(AlreadyBorrowedError):
+			Book.objects.get(pk=self.book.pk).borrow('bob')
+		stale.return_item()
+		with self.assertRaises(NotBorrowedError):
+			stale.return_item()
+		self.book.refresh_from_db()
+		self.assertEqual((self.book.is_borrowed, self.book.borrowed_by), (False, ''))
+
+	def test_borrow_touches_only_borrow_columns(self):
+		with CaptureQueriesContext(connection) as ctx:
+			self.book.borrow('alice')
+		self.assertEqual(len(ctx.captured_queries), 1)
+		self.assertNotIn('"isbn"', ctx.captured_queries[0]['sql'])
+
+	def test_action_reports_conflict(self):
+		url = reverse('media_library:media_action', kwargs={'media_type': 'book', 'item_id': self.book.pk})
+		headers = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+		self.assertEqual(self.client.post(url, {'action': 'borrow'}, **headers).status_code, 200)
+		resp = self.client.post(url, {'action': 'borrow'}, **headers)
+		self.assertEqual(resp.status_code, 409)
+		self.assertIn('уже взято', resp.json()['error'])
+		self.assertEqual(self.client.post(url, {'action': 'return'}, **headers).status_code, 200)
+
+
+class BatchActionTests(TestCase):
+	def setUp(self):
+		self.books = [Book.objects.create(title=f'B{i}', creator='A', publication_date='2000-01-01', isbn=str(i), page_count=10) for i in range(3)]
+		self.audiobook = AudioBook.objects.create(title='AB', creator='A', publication_date='2000-01-01', duration=60, narrator='N')
+		self.movie = Movie.objects.create(title='M', creator='C', publication_date='2000-01-01', duration=90, format='mp4', director='D')
+		self.url = reverse('media_library:media_action_batch')
+
+	def post(self, actions):
+		return self.client.post(self.url, json.dumps({'actions': actions}), content_type='application/json')
+
+	def test_mixed_batch_reports_per_item_results(self):
+		self.books[0].borrow('bob')
+		actions = [{'media_type': 'book', 'id': book.pk, 'action': 'borrow'} for book in self.books] + [
+			{'media_type': 'audiobook', 'id': self.audiobook.pk, 'action': 'borrow'},
+			{'media_type': 'movie', 'id': self.movie.pk, 'action': 'describe'},
+			{'media_type': 'book', 'id': 999999, 'action': 'borrow'},
+			{'media_type': 'song', 'id': 1, 'action': 'borrow'},
+			{'media_type': 'movie', 'id': self.movie.pk, 'action': 'borrow'},
+		]
+		with self.captureOnCommitCallbacks(execute=True):
+			results = self.post(actions).json()['results']
+		self.assertEqual([r['status'] for r in results], [409, 200, 200, 200, 200, 404, 400, 400])
+		self.assertIn('уже взято', results[0]['error'])
+		self.assertIn('Гость', results[1]['result'])
+		self.assertEqual(Book.objects.get(pk=self.books[0].pk).borrowed_by, 'bob')
+		self.assertEqual(Book.objects.filter(is_borrowed=True, borrowed_by='Гость').count(), 2)
+		self.assertTrue(AudioBook.objects.get(pk=self.audiobook.pk).is_borrowed)
+
+	def test_query_count_does_not_grow_with_batch(self):
+		books = Book.objects.bulk_create([Book(title=f'X{i}', creator='A', publication_date='2000-01-01', isbn=f'x{i}', page_count=1) for i in range(50)])
+		actions = [{'media_type': 'book', 'id': book.pk, 'action': 'borrow'} for book in books]
+		actions.append({'media_type': 'audiobook', 'id': self.audiobook.pk, 'action': 'borrow'})
+		# SAVEPOINT, по одному in_bulk и UPDATE на тип, RELEASE
+		with self.assertNumQueries(6):
+			resp = self.post(actions)
+		self.assertTrue(all(r['status'] == 200 for r in resp.json()['results']))
+		self.assertEqual(Book.objects.filter(is_borrowed=True).count(), 50)
+
+	def test_borrow_and_return_in_one_batch(self):
+		book = self.books[0]
+		with self.captureOnCommitCallbacks(execute=True) as callbacks:
+			results = self.post([{'media_type': 'book', 'id': book.pk, 'action': code} for code in ('borrow', 'return', 'return')]).json()['results']
+		self.assertEqual([r['status'] for r in results], [200, 200, 409])
+		self.assertFalse(Book.objects.get(pk=book.pk).is_borrowed)
+		# Итоговое состояние совпало с исходным — ни UPDATE, ни сброса кэша
+		self.assertEqual(callbacks, [])
+		version = media_cache.get_item_version('book', book.pk)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.post([{'media_type': 'book', 'id': book.pk, 'action': 'borrow'}])
+		self.assertNotEqual(media_cache.get_item_version('book', book.pk), version)
+
+	def test_rejects_bad_payload_and_stale_state(self):
+		self.assertEqual(self.client.post(self.url, 'nope', content_type='application/json').status_code, 400)
+		self.assertEqual(self.post('book').status_code, 400)
+		with override_settings(MEDIA_BATCH_MAX_ACTIONS=1):
+			self.assertEqual(self.post([{}, {}]).status_code, 400)
+		# Объект изменили в обход пакета: условный UPDATE не находит строку
+		stale = Book.objects.get(pk=self.books[0].pk)
+		self.books[0].borrow('bob')
+		stale.stage_borrow('alice')
+		with self.assertRaises(AlreadyBorrowedError):
+			Book.save_borrow_states([stale], {stale.pk: False})
+
+
+class ConcurrentBorrowTests(TransactionTestCase):
+	def test_only_one_of_concurrent_borrowers_wins(self):
+		book = Book.objects.create(title='Hot', creator='A', publication_date='2000-01-01', isbn='1', page_count=10)
+		workers = 8
+		barrier = threading.Barrier(workers)
+		results = []
+
+		def borrow(user):
+			try:
+				item = Book.objects.get(pk=book.pk)
+				barrier.wait()
+				try:
+					item.borrow(user)
+					results.append(user)
+				except AlreadyBorrowedError:
+					pass
+			finally:
+				connection.close()
+
+		threads = [threading.Thread(target=borrow, args=(f'user{i}',)) for i in range(workers)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(len(results), 1)
+		book.refresh_from_db()
+		self.assertEqual(book.borrowed_by, results[0])
+
+
+class ImportMediaTests(TestCase):
+	def write_file(self, suffix, content):
+		handle, path = tempfile.mkstemp(suffix=suffix)
+		with os.fdopen(handle, 'w', encoding='utf-8') as f:
+			f.write(content)
+		self.addCleanup(os.remove, path)
+		return path
+
+	def test_factory_create_many_skips_duplicates(self):
+		Book.objects.create(title='Old', creator='A', publication_date='2000-01-01', isbn='1', page_count=10)
+		book = {'creator': 'A', 'publication_date': '2000-01-01', 'isbn': '2', 'page_count': 5}
+		items = [('book', {**book, 'title': 'Old'}), ('book', {**book, 'title': 'New'}), ('book', {**book, 'title': 'New'})]
+		stats = MediaFactory.create_many(items, batch_size=2)
+		self.assertEqual(stats, {'created': 1, 'duplicates': 2})
+		self.assertEqual(Book.objects.count(), 2)
+
+	def test_import_csv(self):
+		path = self.write_file('.csv', (
+			'media_type,title,creator,publication_date,isbn,page_count,duration,format,director,narrator,genre\n'
+			'book,Мастер и Маргарита,Булгаков,1967-01-01,978-5,480,,,,,\n'
+			'movie,Зеркало,Мосфильм,1975-03-07,,,106,mkv,Тарковский,,drama\n'
+			'movie,Без режиссера,Мосфильм,1975-03-07,,,106,mkv,,,\n'
+			'book,Мастер и Маргарита,Булгаков,1967-01-01,978-5,480,,,,,\n'
+		))
+		out, err = StringIO(), StringIO()
+		call_command('import_media', path, stdout=out, stderr=err)
+		self.assertIn('Создано: 2, дубликатов: 1, ошибок: 1', out.getvalue())
+		self.assertIn('Строка 4', err.getvalue())
+		movie = Movie.objects.get(title='Зеркало')
+		self.assertEqual((movie.director, movie.genre), ('Тарковский', 'drama'))
+		# Триггеры поддерживают поиск и глобальный индекс и при bulk_create
+		self.assertEqual(MediaIndex.objects.count(), 2)
+		self.assertEqual([(t, i) for t, i, _ in search.search_media('тарков')], [('movie', movie.pk)])
+
+	def test_import_jsonl(self):
+		rows = [
+			{'media_type': 'audiobook', 'title': 'Сказки', 'creator': 'Пушкин', 'publication_date': '1830-01-01', 'duration': 60, 'narrator': 'N'},
+			{'media_type': 'audiobook', 'title': 'Без чтеца', 'creator': 'X', 'publication_date': '1830-01-01', 'duration': 60},
+		]
+		path = self.write_file('.jsonl', '\n'.join(json.dumps(row, ensure_ascii=False) for row in rows) + '\n{broken\n')
+		out = StringIO()
+		call_command('import_media', path, '--batch-size', '1', stdout=out, stderr=StringIO())
+		self.assertIn('Создано: 1, дубликатов: 0, ошибок: 2', out.getvalue())
+		self.assertTrue(AudioBook.objects.filter(title='Сказки').exists())
+
+	def test_import_jsonl_non_object_lines(self):
+		row = {'media_type': 'book', 'title': 'B', 'creator': 'A', 'publication_date': '2000-01-01', 'isbn': '1', 'page_count': 10}
+		path = self.write_file('.jsonl', '[1, 2]\n"x"\n3\n' + json.dumps(row) + '\n')
+		out, err = StringIO(), StringIO()
+		call_command('import_media', path, stdout=out, stderr=err)
+		self.assertIn('Создано: 1, дубликатов: 0, ошибок: 3', out.getvalue())
+		self.assertIn('Строка 1: ожидается объект JSON', err.getvalue())
+		out = StringIO()
+		call_command('import_reviews', path, stdout=out, stderr=StringIO())
+		self.assertIn('ошибок: 4', out.getvalue())
+
+	def test_import_reviews(self):
+		movie = Movie.objects.create(title='M', creator='C', publication_date='2000-01-01', duration=90, format='mp4', director='D')
+		path = self.write_file('.csv', f'movie_id,rating,comment\n{movie.pk},5,Отлично\n{movie.pk},0,\n999999,4,\n')
+		out, err = StringIO(), StringIO()
+		call_command('import_reviews', path, stdout=out, stderr=err)
+		self.assertIn('Добавлено отзывов: 1, ошибок: 2', out.getvalue())
+		self.assertIn('Строка 3', err.getvalue())
+		self.assertIn('Строка 4', err.getvalue())
+		self.assertEqual(Movie.objects.get(pk=movie.pk).get_average_rating(), 5)
+
+
+class BulkReviewTests(TestCase):
+	def setUp(self):
+		self.movies = [Movie.objects.create(title=f'M{i}', creator='C', publication_date='2000-01-01', duration=90, format='mp4', director='D', genre='drama') for i in range(2)]
+
+	def test_bulk_matches_one_by_one(self):
+		first, second = self.movies
+		first.add_review('old', 2)
+		reviews = [{'movie_id': first.pk, 'rating': 5, 'comment': 'x'}, {'movie_id': second.pk, 'rating': '4'}, {'movie_id': first.pk, 'rating': 3}]
+		with self.captureOnCommitCallbacks(execute=True):
+			self.assertEqual(RatingStatsService.add_reviews_bulk(reviews), 3)
+		first.refresh_from_db()
+		self.assertEqual((first.rating_count, first.rating_sum, first.rating_hist_5), (3, 10, 1))
+		self.assertEqual(MovieRatingDay.objects.get(movie=first).rating_count, 3)
+		self.assertEqual({m: n for m, _, n in leaderboard.top_movies()}, {first: 3, second: 1})
+		self.assertEqual(len(leaderboard.trending_movies(days=1)), 2)
+
+	def test_bulk_reviews_update_last_modified(self):
+		movie = self.movies[0]
+		Movie.objects.filter(pk=movie.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+		url = reverse('media_library:media_detail', kwargs={'media_type': 'movie', 'pk': movie.pk})
+		last_modified = self.client.get(url)['Last-Modified']
+		RatingStatsService.add_reviews_bulk([{'movie_id': movie.pk, 'rating': 1}])
+		self.assertEqual(self.client.get(url, headers={'If-Modified-Since': last_modified}).status_code, 200)
+
+	def test_query_count_does_not_grow_with_reviews(self):
+		def queries(count):
+			reviews = [{'movie_id': self.movies[i % 2].pk, 'rating': i % 5 + 1} for i in range(count)]
+			with CaptureQueriesContext(connection) as ctx:
+				RatingStatsService.add_reviews_bulk(reviews)
+			return len(ctx.captured_queries)
+		# 150 отзывов укладываются в один INSERT (лимит параметров SQLite)
+		self.assertEqual(queries(5), queries(150))
+		self.assertEqual(Movie.objects.get(pk=self.movies[0].pk).rating_count, 78)
+
+	def test_invalid_reviews_reported(self):
+		errors = []
+		reviews = [{'movie_id': self.movies[0].pk, 'rating': 6}, {'movie_id': 999999, 'rating': 5}, {'movie_id': 'x', 'rating': 1}, {'movie_id': self.movies[0].pk, 'rating': 1}]
+		created = RatingStatsService.add_reviews_bulk(reviews, batch_size=2, on_error=lambda review, message: errors.append(message))
+		self.assertEqual(created, 1)
+		self.assertEqual(len(errors), 3)
+		self.assertIn('от 1 до 5', errors[0])
+		self.assertIn('не найден', errors[1])
+
+
+class AutocompleteTests(TestCase):
+	def setUp(self):
+		# Индекс живет в процессе, а данные тестов откатываются — начинаем с пустого
+		autocomplete.index.invalidate()
+		self.addCleanup(autocomplete.index.invalidate)
+		movie = {'creator': 'Мосфильм', 'publication_date': '1975-01-01', 'duration': 100, 'format': 'mp4'}
+		self.mirror = Movie.objects.create(title='Зеркало', director='Тарковский', **movie)
+		Movie.objects.create(title='Сталкер', director='Тарковский', **movie)
+		Movie.objects.create(title='Тарас Бульба', director='Бортко', **movie)
+		self.book = Book.objects.create(title='Мастер и Маргарита', creator='Булгаков', publication_date='1967-01-01', isbn='1', page_count=480)
+		AudioBook.objects.create(title='Ёлка', creator='Автор', publication_date='2000-01-01', duration=60, narrator='Тарасова')
+		self.url = reverse('media_library:media_autocomplete')
+
+	def suggest(self, query, **params):
+		return [(s['field'], s['text']) for s in self.client.get(self.url, {'q': query, **params}).json()['suggestions']]
+
+	def test_ranked_suggestions_from_memory(self):
+		# Два фильма у режиссера — выше; при равенстве короче — выше
+		self.assertEqual(self.suggest('тар'), [('director', 'Тарковский'), ('narrator', 'Тарасова'), ('title', 'Тарас Бульба')])
+		# Слово в середине значения и ё/е
+		self.assertEqual(self.suggest('марг'), [('title', 'Мастер и Маргарита')])
+		self.assertEqual(self.suggest('елк'), [('title', 'Ёлка')])
+		self.assertEqual(self.suggest('тар', limit=1), [('director', 'Тарковский')])
+		self.assertEqual(self.suggest('тар', limit=-1), [('director', 'Тарковский')])
+		resp = self.client.get(self.url, {'q': 'мастер'}).json()
+		self.assertEqual(resp['suggestions'][0], {'text': 'Мастер и Маргарита', 'field': 'title', 'media_type': 'book', 'id': self.book.pk})
+		with self.assertNumQueries(0):
+			self.assertEqual(self.suggest('булг'), [('creator', 'Булгаков')])
+		self.assertEqual(self.suggest(''), [])
+
+	def test_signals_keep_index_current(self):
+		self.suggest('тар')
+		with self.assertNumQueries(0):
+			self.assertNotIn(('title', 'Солярис'), self.suggest('сол'))
+		self.mirror.title = 'Солярис'
+		self.mirror.save()
+		Movie.objects.filter(director='Тарковский').exclude(pk=self.mirror.pk).get().delete()
+		with self.assertNumQueries(0):
+			self.assertEqual(self.suggest('сол'), [('title', 'Солярис')])
+			self.assertEqual(self.suggest('зерк'), [])
+			# Режиссер остался у одного фильма — подсказка жива
+			self.assertEqual(self.suggest('тарк'), [('director', 'Тарковский')])
+		self.mirror.delete()
+		self.assertEqual(self.suggest('тарк'), [])
+
+	def test_bulk_import_invalidates_index(self):
+		self.suggest('тар')
+		MediaFactory.create_many([('book', {'title': 'Таинственный остров', 'creator': 'Верн', 'publication_date': '1875-01-01', 'isbn': '2', 'page_count': 500})])
+		self.assertIn(('title', 'Таинственный остров'), self.suggest('таин'))
+		with override_settings(MEDIA_AUTOCOMPLETE_REFRESH=0):
+			Book.objects.filter(pk=self.book.pk).update(title='Белая гвардия')
+			self.assertEqual(self.suggest('бела'), [('title', 'Белая гвардия')])
+
+	def test_rebuild_does_not_block_suggestions(self):
+		self.suggest('тар')
+		autocomplete.index.invalidate()
+		seen = []
+		get_suggestions = autocomplete.PrefixIndex.get_suggestions
+
+		def slow_get_suggestions(media_type, pk, values):
+			if not seen:
+				# Пока таблицы читаются, другой поток отвечает по старому индексу
+				thread = threading.Thread(target=lambda: seen.append(autocomplete.index.suggest('тарк')))
+				thread.start()
+				thread.join(5)
+				self.assertEqual([text for _, text, _, _ in seen[0]], ['Тарковский'])
+				# Изменение во время чтения повторяется на новом индексе
+				self.mirror.director = 'Тарковский А.'
+				autocomplete.index.update_object(self.mirror)
+			return get_suggestions(media_type, pk, values)
+
+		with patch.object(autocomplete.PrefixIndex, 'get_suggestions', staticmethod(slow_get_suggestions)):
+			autocomplete.index.ensure_built()
+		self.assertEqual(self.suggest('тарк'), [('director', 'Тарковский'), ('director', 'Тарковский А.')])
+
+
+class MediaFileTests(TestCase):
+	def setUp(self):
+		root = tempfile.mkdtemp()
+		settings_patch = override_settings(MEDIA_ROOT=root)
+		settings_patch.enable()
+		self.addCleanup(settings_patch.disable)
+		self.content = bytes(range(256)) * 4
+		self.movie = Movie.objects.create(title='Файл', creator='C', publication_date='2000-01-01', duration=90, format='mp4', director='D')
+		self.movie.media_file.save('movie.mp4', ContentFile(self.content))
+		self.url = reverse('media_library:media_file_download', kwargs={'media_type': 'movie', 'pk': self.movie.pk})
+
+	def test_full_download(self):
+		resp = self.client.get(self.url)
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(b''.join(resp.streaming_content), self.content)
+		self.assertEqual(resp['Content-Length'], str(len(self.content)))
+		self.assertEqual(resp['Accept-Ranges'], 'bytes')
+		self.assertEqual(resp['Content-Type'], 'video/mp4')
+		self.assertIn('attachment', resp['Content-Disposition'])
+		stream = self.client.get(reverse('media_library:media_file_stream', kwargs={'media_type': 'movie', 'pk': self.movie.pk}))
+		self.assertIn('inline', stream['Content-Disposition'])
+		self.assertEqual(self.movie.get_stream_url(), stream.request['PATH_INFO'])
+
+	def test_range_requests(self):
+		cases = {'bytes=10-19': (10, 19), 'bytes=1000-': (1000, 1023), 'bytes=-4': (1020, 1023), 'bytes=1020-5000': (1020, 1023)}
+		for header, (start, end) in cases.items():
+			resp = self.client.get(self.url, headers={'Range': header})
+			self.assertEqual(resp.status_code, 206, header)
+			self.assertEqual(b''.join(resp.streaming_content), self.content[start:end + 1], header)
+			self.assertEqual(resp['Content-Range'], f'bytes {start}-{end}/1024')
+			self.assertEqual(resp['Content-Length'], str(end - start + 1))
+
+		self.assertEqual(self.client.get(self.url, headers={'Range': 'bytes=2000-'}).status_code, 416)
+		self.assertEqual(self.client.get(self.url, headers={'Range': 'bytes=0-1,5-6'}).status_code, 200)
+		last_modified = self.client.get(self.url)['Last-Modified']
+		self.assertEqual(self.client.get(self.url, headers={'Range': 'bytes=0-1', 'If-Range': last_modified}).status_code, 206)
+		self.assertEqual(self.client.get(self.url, headers={'Range': 'bytes=0-1', 'If-Range': 'Sat, 01 Jan 2000 00:00:00 GMT'}).status_code, 200)
+		self.assertEqual(self.client.get(self.url, headers={'Range': 'bytes=2000-', 'If-Range': 'Sat, 01 Jan 2000 00:00:00 GMT'}).status_code, 200)
+		self.assertEqual(self.client.get(self.url, headers={'Range': 'bytes=2000-', 'If-Range': last_modified}).status_code, 416)
+
+	def test_range_file_is_positioned_for_sendfile(self):
+		with open(self.movie.media_file.path, 'rb') as file:
+			part = files.FileRange(file, 100, 10)
+			self.assertEqual(os.lseek(part.fileno(), 0, os.SEEK_CUR), 100)
+			self.assertEqual(part.read(), self.content[100:110])
+			self.assertEqual(part.read(), b'')
+
+	def test_empty_file_suffix_range(self):
+		with self.assertRaises(ValueError):
+			files.parse_range('bytes=-10', 0)
+		self.movie.media_file.save('empty.mp4', ContentFile(b''))
+		resp = self.client.get(self.url, headers={'Range': 'bytes=-10'})
+		self.assertEqual(resp.status_code, 416)
+		self.assertEqual(resp['Content-Range'], 'bytes */0')
+
+	def test_upload_with_create_form(self):
+		resp = self.client.get(reverse('media_library:media_create'))
+		self.assertContains(resp, 'enctype="multipart/form-data"')
+		data = {'title': 'Загрузка', 'creator': 'C', 'publication_date': '2020-01-01', 'duration': 60}
+		resp = self.client.post(reverse('media_library:media_create'), {
+			**data, 'media_type': 'audiobook', 'narrator': 'N', 'media_file': SimpleUploadedFile('book.mp3', b'audio'),
+		})
+		self.assertEqual(resp.status_code, 302)
+		audiobook = AudioBook.objects.get(title='Загрузка')
+		self.assertEqual(b''.join(self.client.get(audiobook.get_download_url()).streaming_content), b'audio')
+		# У книг файла нет: форма отклоняет загрузку
+		with self.assertLogs('media.views', 'INFO'):
+			resp = self.client.post(reverse('media_library:media_create'), {
+				**data, 'media_type': 'book', 'isbn': '1', 'page_count': 10, 'media_file': SimpleUploadedFile('b.pdf', b'x'),
+			})
+		self.assertEqual(resp.status_code, 200)
+		self.assertIn('media_file', resp.context['form'].errors)
+
+	def test_unavailable_files(self):
+		book = Book.objects.create(title='B', creator='A', publication_date='2000-01-01', isbn='1', page_count=10)
+		audiobook = AudioBook.objects.create(title='A', creator='A', publication_date='2000-01-01', duration=60, narrator='N')
+		for name, media_type, pk in [('media_file_download', 'book', book.pk), ('media_file_stream', 'audiobook', audiobook.pk),
+		                             ('media_file_download', 'audiobook', audiobook.pk)]:
+			self.assertEqual(self.client.get(reverse(f'media_library:{name}', kwargs={'media_type': media_type, 'pk': pk})).status_code, 404)
+		self.assertIsNone(audiobook.get_download_url())
+
+
+class ExportTests(TestCase):
+	def setUp(self):
+		Book.objects.create(title='Книга', creator='A', publication_date='2000-01-01', isbn='1', page_count=10)
+		movie = Movie.objects.create(title='Фильм', creator='C', publication_date='2001-01-01', duration=90, format='mp4', director='D')
+		movie.add_review('', 4)
+
+	def test_ndjson_stream(self):
+		resp = self.client.get(reverse('media_library:media_export'))
+		self.assertTrue(resp.streaming)
+		records = [json.loads(line) for line in b''.join(resp.streaming_content).decode().splitlines()]
+		self.assertEqual([(r['media_type'], r['title']) for r in records], [('book', 'Книга'), ('movie', 'Фильм')])
+		self.assertEqual((records[1]['rating_count'], records[1]['rating_avg']), (1, 4.0))
+		self.assertEqual(records[0]['publication_date'], '2000-01-01')
+
+	def test_unrated_movie_exported_as_null(self):
+		movie = Movie.objects.create(title='Без оценок', creator='C', publication_date='2001-01-01', duration=90, format='mp4', director='D')
+		record = [r for r in export.iter_records(['movie']) if r['id'] == movie.pk][0]
+		api_record = self.client.get(reverse('media_library:media_detail_json', kwargs={'media_type': 'movie', 'pk': movie.pk})).json()
+		self.assertIsNone(record['rating_avg'])
+		self.assertIsNone(api_record['rating'])
+
+	def test_csv_gzip_stream(self):
+		resp = self.client.get(reverse('media_library:media_export'), {'format': 'csv', 'compress': 'gzip', 'type': 'movie'})
+		self.assertEqual(resp['Content-Type'], 'application/gzip')
+		lines = gzip.decompress(b''.join(resp.streaming_content)).decode().splitlines()
+		self.assertTrue(lines[0].startswith('media_type,id,title'))
+		self.assertEqual(len(lines), 2)
+		self.assertIn('Фильм', lines[1])
+
+	def test_export_command(self):
+		out = StringIO()
+		call_command('export_media', '--type', 'book', stdout=out)
+		self.assertEqual(json.loads(out.getvalue())['title'], 'Книга')
+
+
+class DetailCacheTests(CacheTestCase):
+	def setUp(self):
+		super().setUp()
+		self.movie = Movie.objects.create(title='Cached', creator='C', publication_date='2000-01-01', duration=90, format='mp4', director='D')
+		self.book = Book.objects.create(title='Cached book', creator='A', publication_date='2000-01-01', isbn='1', page_count=10)
+
+	def detail(self, media_type, pk):
+		return self.client.get(reverse('media_library:media_detail', kwargs={'media_type': media_type, 'pk': pk}))
+
+	def test_missing_object_is_404(self):
+		self.assertEqual(self.detail('movie', 999999).status_code, 404)
+		self.assertEqual(self.detail('podcast', self.movie.pk).status_code, 404)
+
+	def test_repeat_view_hits_cache(self):
+		self.detail('movie', self.movie.pk)
+		with self.assertNumQueries(0):
+			resp = self.detail('movie', self.movie.pk)
+		self.assertEqual(resp.context['media_item'].title, 'Cached')
+
+	def test_review_invalidates(self):
+		self.detail('movie', self.movie.pk)
+		with self.commit():
+			self.client.post(reverse('media_library:media_add_review', kwargs={'media_type': 'movie', 'pk': self.movie.pk}), {'rating': 5, 'comment': 'Супер'})
+		resp = self.detail('movie', self.movie.pk)
+		self.assertEqual([r.comment for r in resp.context['reviews']], ['Супер'])
+		self.assertEqual(resp.context['avg_rating'], 5)
+
+	def test_borrow_and_save_invalidate(self):
+		self.detail('book', self.book.pk)
+		with self.commit():
+			self.book.borrow('alice')
+		resp = self.detail('book', self.book.pk)
+		self.assertIn('return', [code for code, _, _ in resp.context['available_actions']])
+		self.book.title = 'Renamed'
+		with self.commit():
+			self.book.save()
+		self.assertEqual(self.detail('book', self.book.pk).context['media_item'].title, 'Renamed')
+
+	def test_versions_bumped_after_commit(self):
+		version = media_cache.get_item_version('movie', self.movie.pk)
+		type_version = media_cache.get_type_version('movie')
+		with self.commit():
+			self.movie.add_review('ok', 5)
+			# До фиксации параллельный запрос не должен видеть новую версию
+			self.assertEqual(media_cache.get_item_version('movie', self.movie.pk), version)
+			self.assertEqual(media_cache.get_type_version('movie'), type_version)
+		self.assertNotEqual(media_cache.get_item_version('movie', self.movie.pk), version)
+		self.assertNotEqual(media_cache.get_type_version('movie'), type_version)
+		version = media_cache.get_item_version('book', self.book.pk)
+		with self.commit():
+			with self.assertRaises(RuntimeError), transaction.atomic():
+				self.book.borrow('alice')
+				raise RuntimeError
+		self.assertEqual(media_cache.get_item_version('book', self.book.pk), version)
+
+	def test_concurrent_misses_compute_once(self):
+		key = 'test:collapse'
+		calls = []
+		started = threading.Event()
+
+		def slow_compute():
+			calls.append(1)
+			started.set()
+			time.sleep(0.2)
+			return 'value'
+
+		results = []
+		first = threading.Thread(target=lambda: results.append(media_cache.get_or_compute(key, slow_compute)))
+		first.start()
+		started.wait()
+		results.append(media_cache.get_or_compute(key, slow_compute))
+		first.join()
+		self.assertEqual(results, ['value', 'value'])
+		self.assertEqual(len(calls), 1)
+
+
+class ConditionalGetTests(CacheTestCase):
+	def setUp(self):
+		super().setUp()
+		self.book = Book.objects.create(title='Etag book', creator='A', publication_date='2000-01-01', isbn='1', page_count=10)
+		self.movie = Movie.objects.create(title='Etag movie', creator='C', publication_date='2000-01-01', duration=90, format='mp4', director='D')
+		self.list_url = reverse('media_library:media_list')
+
+	def test_list_not_modified_without_queries(self):
+		etag = self.client.get(self.list_url)['ETag']
+		with self.assertNumQueries(0):
+			resp = self.client.get(self.list_url, headers={'If-None-Match': etag})
+		self.assertEqual(resp.status_code, 304)
+		self.assertEqual(resp['ETag'], etag)
+		self.assertNotEqual(self.client.get(self.list_url, {'sort': 'title'})['ETag'], etag)
+
+	def test_list_etag_changes_on_writes(self):
+		etags = [self.client.get(self.list_url)['ETag']]
+		with self.commit():
+			self.book.borrow('alice')
+		etags.append(self.client.get(self.list_url)['ETag'])
+		with self.commit():
+			self.movie.add_review('ok', 4)
+		etags.append(self.client.get(self.list_url)['ETag'])
+		with self.commit():
+			MediaFactory.create_many([('audiobook', {'title': 'New', 'creator': 'A', 'publication_date': '2000-01-01', 'duration': 60, 'narrator': 'N'})])
+		etags.append(self.client.get(self.list_url)['ETag'])
+		self.assertEqual(len(set(etags)), 4)
+		resp = self.client.get(self.list_url, headers={'If-None-Match': etags[0]})
+		self.assertEqual(resp.status_code, 200)
+
+	def test_detail_if_modified_since(self):
+		url = reverse('media_library:media_detail', kwargs={'media_type': 'book', 'pk': self.book.pk})
+		resp = self.client.get(url)
+		self.assertIn('no-cache', resp['Cache-Control'])
+		last_modified = resp['Last-Modified']
+		with self.assertNumQueries(1):
+			self.assertEqual(self.client.get(url, headers={'If-Modified-Since': last_modified}).status_code, 304)
+		updated_at = self.book.updated_at
+		with self.commit():
+			self.book.borrow('alice')
+		self.assertGreater(Book.objects.get(pk=self.book.pk).updated_at, updated_at)
+		resp = self.client.get(url, headers={'If-None-Match': resp['ETag']})
+		self.assertEqual(resp.status_code, 200)
+
+
+class CardCacheTests(CacheTestCase):
+	def setUp(self):
+		super().setUp()
+		self.books = [Book.objects.create(title=f'Card book {i}', creator='A', publication_date='2000-01-01', isbn=str(i), page_count=10) for i in range(3)]
+		self.movie = Movie.objects.create(title='Card movie', creator='C', publication_date='2000-01-01', duration=90, format='mp4', director='D')
+		self.url = reverse('media_library:media_list')
+
+	def rendered_cards(self):
+		with patch('media.views.render_to_string', wraps=render_to_string) as render:
+			resp = self.client.get(self.url)
+		return resp, [call.args[1] for call in render.call_args_list]
+
+	def test_cards_rendered_once(self):
+		resp, rendered = self.rendered_cards()
+		self.assertEqual(len(rendered), 4)
+		self.assertContains(resp, '<h5 class="card-title">Card book 0</h5>', html=True)
+		resp, rendered = self.rendered_cards()
+		self.assertEqual(rendered, [])
+		self.assertContains(resp, '<h5 class="card-title">Card movie</h5>', html=True)
+
+	def test_borrow_and_review_rerender_only_changed_cards(self):
+		self.rendered_cards()
+		with self.commit():
+			self.books[1].borrow('alice')
+			self.movie.add_review('ok', 4)
+		resp, rendered = self.rendered_cards()
+		self.assertEqual([context.get('book', context.get('movie')).title for context in rendered], ['Card book 1', 'Card movie'])
+		self.assertContains(resp, 'В аренде', count=1)
+		self.assertContains(resp, 'Рейтинг: 4.0')
+
+	def test_rating_rebuild_invalidates_cards(self):
+		self.rendered_cards()
+		Rating.objects.bulk_create([Rating(movie=self.movie, rating=2, comment='bulk')])
+		with self.commit():
+			RatingStatsService.rebuild()
+		resp, rendered = self.rendered_cards()
+		self.assertEqual(len(rendered), 1)
+		self.assertContains(resp, 'Рейтинг: 2.0')
+
+
+class ActionRegistryTests(TestCase):
+	def test_capabilities_collected_from_mixins_and_models(self):
+		self.assertEqual(registry.get_capabilities('book'), {'describe', 'read', 'borrow', 'return'})
+		self.assertEqual(registry.get_capabilities('movie'), {'describe', 'play_trailer', 'stream', 'download', 'review'})
+		self.assertEqual(registry.get_capabilities('audiobook'), {'describe', 'download', 'borrow', 'return'})
+		self.assertEqual(MediaFactory.get_all_media_types(), ['book', 'movie', 'audiobook'])
+
+	def test_available_actions_follow_object_state(self):
+		book = Book.objects.create(title='B', creator='A', publication_date='2000-01-01', isbn='1', page_count=10)
+		codes = [code for code, _, _ in registry.get_available_actions(book)]
+		self.assertEqual(codes, ['describe', 'read', 'borrow'])
+		book.borrow('alice')
+		codes = [code for code, _, _ in registry.get_available_actions(book)]
+		self.assertEqual(codes, ['describe', 'read', 'return'])
+
+	def test_dispatch_uses_registry(self):
+		book = Book.objects.create(title='B', creator='A', publication_date='2000-01-01', isbn='1', page_count=10)
+		url = reverse('media_library:media_action', kwargs={'media_type': 'book', 'item_id': book.pk})
+		headers = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+		self.assertEqual(self.client.post(url, {'action': 'download'}, **headers).json(), {'result': 'Книги недоступны для скачивания'})
+		self.assertEqual(self.client.post(url, {'action': 'stream'}, **headers).status_code, 400)
+		self.assertIsInstance(registry.get_action('movie', 'play_trailer'), MediaAction)
+
+
+class LeaderboardTests(TestCase):
+	def setUp(self):
+		def movie(title, genre):
+			return Movie.objects.create(title=title, creator='C', publication_date='2020-01-01', duration=90, format='mp4', genre=genre)
+		self.few = movie('Few fives', 'drama')
+		self.many = movie('Many fours', 'drama')
+		self.comedy = movie('Comedy', 'comedy')
+		self.few.add_review('', 5)
+		for _ in range(20):
+			self.many.add_review('', 5)
+			self.many.add_review('', 4)
+		self.comedy.add_review('', 3)
+
+	def test_bayesian_score_prefers_many_votes(self):
+		top = leaderboard.top_movies()
+		self.assertEqual([m.title for m, _, _ in top], ['Many fours', 'Few fives', 'Comedy'])
+		self.assertAlmostEqual(top[0][1], leaderboard.bayesian_score(180, 40))
+		self.assertEqual([m.title for m, _, _ in leaderboard.top_movies(genre='comedy')], ['Comedy'])
+		self.assertEqual(len(leaderboard.top_movies(min_votes=2)), 1)
+
+	def test_ranking_follows_deletes_and_genre_changes(self):
+		self.few.ratings.get().delete()
+		self.assertEqual(MovieRanking.objects.get(movie=self.few).rating_count, 0)
+		self.assertNotIn(self.few, [m for m, _, _ in leaderboard.top_movies()])
+		self.comedy.genre = 'drama'
+		self.comedy.save()
+		self.assertEqual(len(leaderboard.top_movies(genre='drama')), 2)
+		self.comedy.delete()
+		self.assertFalse(MovieRatingDay.objects.filter(movie_id=self.comedy.pk).exists())
+
+	def test_trending_counts_only_recent_days(self):
+		Rating.objects.filter(movie=self.many).update(created_at=timezone.now() - timedelta(days=30))
+		leaderboard.rebuild()
+		self.assertEqual([m.title for m, _, _ in leaderboard.trending_movies(days=7)], ['Few fives', 'Comedy'])
+		self.assertEqual(len(leaderboard.trending_movies(days=60)), 3)
+		self.assertEqual(leaderboard.top_movies()[0][0], self.many)
+
+	def test_endpoints(self):
+		with self.assertNumQueries(1):
+			data = self.client.get(reverse('media_library:leaderboard'), {'genre': 'drama', 'limit': 1}).json()
+		self.assertEqual([r['title'] for r in data['results']], ['Many fours'])
+		self.assertEqual(data['results'][0]['votes'], 40)
+		data = self.client.get(reverse('media_library:leaderboard_trending'), {'days': 1}).json()
+		self.assertEqual((data['days'], len(data['results'])), (1, 3))
+		self.assertEqual(self.client.get(reverse('media_library:leaderboard'), {'genre': 'nope'}).status_code, 400)
+		for limit in ('-1', '0'):
+			data = self.client.get(reverse('media_library:leaderboard'), {'limit': limit}).json()
+			self.assertEqual(len(data['results']), 1)
+
+
+class ReviewPaginationTests(CacheTestCase):
+	def setUp(self):
+		super().setUp()
+		self.movie = Movie.objects.create(title='Reviewed', creator='C', publication_date='2020-01-01', duration=90, format='mp4')
+		now = timezone.now()
+		Rating.objects.bulk_create([
+			Rating(movie=self.movie, rating=i % 5 + 1, comment=f'r{i}') for i in range(25)
+		])
+		# Часть отзывов с одинаковым временем — порядок должен оставаться стабильным
+		for i, review in enumerate(Rating.objects.order_by('pk')):
+			Rating.objects.filter(pk=review.pk).update(created_at=now - timedelta(minutes=(25 - i) // 2))
+
+	def test_detail_shows_newest_page_only(self):
+		resp = self.client.get(reverse('media_library:media_detail', kwargs={'media_type': 'movie', 'pk': self.movie.pk}))
+		reviews = resp.context['reviews']
+		self.assertEqual([r.comment for r in reviews], [f'r{i}' for i in range(24, 14, -1)])
+		self.assertIsNotNone(resp.context['reviews_next_cursor'])
+		self.assertContains(resp, 'Показать еще')
+
+	def test_load_more_walks_all_reviews(self):
+		url = reverse('media_library:media_reviews', kwargs={'media_type': 'movie', 'pk': self.movie.pk})
+		comments, cursor = [], None
+		while True:
+			with self.assertNumQueries(2):
+				data = self.client.get(url, {'cursor': cursor} if cursor else {}).json()
+			comments += [r['comment'] for r in data['results']]
+			cursor = data['next_cursor']
+			if not cursor:
+				break
+		self.assertEqual(comments, [f'r{i}' for i in range(24, -1, -1)])
+		book = Book.objects.create(title='B', creator='A', publication_date='2000-01-01', isbn='1', page_count=1)
+		self.assertEqual(self.client.get(reverse('media_library:media_reviews', kwargs={'media_type': 'book', 'pk': book.pk})).status_code, 400)
+
+
+# Шаг плана SQLite, читающий таблицу или индекс целиком (не по диапазону ключа)
+FULL_SCAN_RE = re.compile(r'SCAN (?P<table>\w+)(?P<index> USING (?:COVERING )?INDEX \w+)?$')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN в формате SQLite')
+class QueryPlanTests(CacheTestCase):
+	"""Планы запросов страниц и API: горячие запросы не сканируют таблицы целиком.
+
+	Выгрузка каталога (api/export) читает все строки намеренно и не проверяется.
+	"""
+
+	@classmethod
+	def setUpTestData(cls):
+		Movie.objects.bulk_create([
+			Movie(title=f'Фильм {i}', creator='C', publication_date='2020-01-01', duration=90 + i, format='mp4',
+				  director='Балабанов' if i % 2 else 'Тарковский', genre='drama' if i % 3 else 'comedy')
+			for i in range(30)
+		])
+		Book.objects.bulk_create([
+			Book(title=f'Книга {i}', creator='A', publication_date='2000-01-01', isbn=str(i), page_count=100)
+			for i in range(15)
+		])
+		AudioBook.objects.create(title='Аудио', creator='A', publication_date='2000-01-01', duration=60, narrator='N')
+		cls.movie = Movie.objects.order_by('pk').first()
+		cls.book = Book.objects.order_by('pk').first()
+		for i in range(15):
+			cls.movie.add_review(f'r{i}', i % 5 + 1)
+
+	def explain(self, method, url, data=None):
+		# Запросы перехватываются вместе с параметрами: план SQLite для подставленных
+		# литералов может отличаться от плана того же запроса с параметрами
+		queries = []
+
+		def capture(execute, sql, params, many, context):
+			if not many:
+				queries.append((sql, params))
+			return execute(sql, params, many, context)
+
+		with connection.execute_wrapper(capture):
+			response = getattr(self.client, method)(url, data or {})
+		self.assertLess(response.status_code, 400, url)
+		plans = []
+		for sql, params in queries:
+			if not sql.startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE')):
+				continue
+			with connection.cursor() as cursor:
+				cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+				plans.append((sql, [row[3] for row in cursor.fetchall()]))
+		return response, plans
+
+	def assertNoFullScans(self, method, url, data=None):
+		response, plans = self.explain(method, url, data)
+		for sql, plan in plans:
+			for step in plan:
+				match = FULL_SCAN_RE.match(step)
+				if not match:
+					continue
+				# Обход индекса по порядку допустим, только если LIMIT его останавливает
+				# (первая страница без фильтра, топ-K); с фильтром и без LIMIT — это полный скан
+				if match['index'] and (' LIMIT ' in sql or ' WHERE ' not in sql):
+					continue
+				self.fail(f'Полный скан {match["table"]} ({step}) в запросе {url}:\n{sql}')
+		return response, plans
+
+	def assertSearches(self, plans, table):
+		steps = [step for _, plan in plans for step in plan]
+		self.assertTrue(any(step.startswith(f'SEARCH {table} ') for step in steps),
+						f'{table} читается не по индексу: {steps}')
+
+	def test_list_filters_and_sorts(self):
+		url = reverse('media_library:media_list')
+		for params in [{}, {'sort': '-publication_date'}, {'sort': 'duration'}, {'sort': '-rating'}, {'q': 'фильм'}]:
+			self.assertNoFullScans('get', url, params)
+		for params in [{'genre': 'drama'}, {'genre': 'drama', 'sort': '-rating'}, {'director': 'балаб'}]:
+			_, plans = self.assertNoFullScans('get', url, params)
+			self.assertSearches(plans, 'media_movie')
+		self.assertNoFullScans('get', reverse('media_library:media_list_json'), {'genre': 'comedy'})
+
+	def test_next_pages_seek_by_cursor(self):
+		url = reverse('media_library:media_list')
+		for sort in ('title', '-rating', 'duration'):
+			response = self.client.get(url, {'sort': sort})
+			_, plans = self.assertNoFullScans('get', f"{url}?{response.context['pages']['movie'].next_query}")
+			self.assertSearches(plans, 'media_movie')
+
+	def test_detail_reviews_and_search(self):
+		detail = reverse('media_library:media_detail', kwargs={'media_type': 'movie', 'pk': self.movie.pk})
+		response, _ = self.assertNoFullScans('get', detail)
+		reviews = reverse('media_library:media_reviews', kwargs={'media_type': 'movie', 'pk': self.movie.pk})
+		_, plans = self.assertNoFullScans('get', reviews, {'cursor': response.context['reviews_next_cursor']})
+		self.assertSearches(plans, 'media_rating')
+		self.assertNoFullScans('get', reverse('media_library:media_detail_global', kwargs={'ref': MediaFactory.get_global_id(self.movie)}))
+		self.assertNoFullScans('get', reverse('media_library:media_search'), {'q': 'книга'})
+
+	def test_leaderboards(self):
+		_, plans = self.assertNoFullScans('get', reverse('media_library:leaderboard'), {'genre': 'comedy'})
+		self.assertSearches(plans, 'media_movieranking')
+		self.assertNoFullScans('get', reverse('media_library:leaderboard'))
+		_, plans = self.assertNoFullScans('get', reverse('media_library:leaderboard_trending'), {'genre': 'comedy'})
+		self.assertSearches(plans, 'media_movieratingday')
+
+	def test_writes(self):
+		self.assertNoFullScans('post', reverse('media_library:media_action', kwargs={'media_type': 'book', 'item_id': self.book.pk}), {'action': 'borrow'})
+		self.assertNoFullScans('post', reverse('media_library:borrow_media', kwargs={'ref': MediaFactory.get_global_id(Book.objects.last())}))
+		self.assertNoFullScans('post', reverse('media_library:media_add_review', kwargs={'media_type': 'movie', 'pk': self.movie.pk}), {'rating': 5})
+		# Невалидная форма вернула бы страницу с ошибками, и план вставки не проверялся бы
+		response, _ = self.assertNoFullScans('post', reverse('media_library:media_create'), {
+			'media_type': 'movie', 'title': 'Новый', 'creator': 'C', 'publication_date': '2020-01-01',
+			'duration': 90, 'format': 'mp4', 'director': 'D', 'genre': 'drama',
+		})
+		self.assertRedirects(response, reverse('media_library:media_list'), fetch_redirect_response=False)
+		self.assertTrue(Movie.objects.filter(title='Новый').exists())
+
+
+class DatabaseSetupTests(TransactionTestCase):
+	def setUp(self):
+		self.replica = patch.dict(connections.settings, {'replica': {**connections.settings['default'], 'NAME': os.path.join(tempfile.mkdtemp(), 'replica.sqlite3')}})
+
+	def test_sqlite_pragmas(self):
+		with connection.cursor() as cursor:
+			pragmas = {}
+			for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size'):
+				cursor.execute(f'PRAGMA {name}')
+				pragmas[name] = cursor.fetchone()[0]
+		self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 20000, 'cache_size': -65536})
+		# WAL включает миграция: подключение не должно переписывать файл БД
+		self.assertNotIn('journal_mode', connection.settings_dict['OPTIONS']['init_command'])
+
+	def test_router_reads_from_replica_outside_writes(self):
+		router = PrimaryReplicaRouter()
+		self.assertIsNone(router.db_for_read(Book))
+		with self.replica:
+			self.assertEqual(router.db_for_read(Book), 'replica')
+			self.assertEqual(router.db_for_write(Book), 'default')
+			with pin_to_primary():
+				self.assertEqual(router.db_for_read(Book), 'default')
+			self.assertFalse(router.allow_migrate('replica', 'media'))
+
+			seen = []
+
+			def view(request):
+				seen.append(router.db_for_read(Book))
+				return HttpResponse()
+
+			middleware = ReplicaPinningMiddleware(view)
+			response = middleware(RequestFactory().post('/'))
+			middleware(RequestFactory().get('/'))
+			request = RequestFactory().get('/')
+			request.COOKIES = {key: morsel.value for key, morsel in response.cookies.items()}
+			middleware(request)
+		self.assertEqual(seen, ['default', 'replica', 'default'])
+
+	def test_write_commands_read_from_primary(self):
+		seen = []
+
+		def rebuild(*args, **kwargs):
+			seen.append(PrimaryReplicaRouter().db_for_read(Movie))
+			return 0
+
+		with self.replica, patch.object(RatingStatsService, 'rebuild', rebuild):
+			call_command('rebuild_rating_stats', stdout=StringIO())
+		self.assertEqual(seen, ['default'])
+
+		def use_database(*args):
+			seen.append(PrimaryReplicaRouter().db_for_read(Movie))
+			raise CommandError('stop')
+
+		# bench подменяет файл только основной БД: чтение с реплики ушло бы мимо замеров
+		with self.replica, patch('media.management.commands.bench.Command.use_database', use_database):
+			with self.assertRaises(CommandError):
+				call_command('bench', stdout=StringIO())
+		self.assertEqual(seen, ['default', 'default'])
+
+	def test_sync_replica_command(self):
+		book = Book.objects.create(title='Replica', creator='A', publication_date='2000-01-01', isbn='1', page_count=10)
+		url = reverse('media_library:media_detail', kwargs={'media_type': 'book', 'pk': book.pk})
+		etag = self.client.get(url)['ETag']
+		with self.assertRaises(CommandError):
+			call_command('sync_replica', stdout=StringIO())
+		with self.replica:
+			call_command('sync_replica', stdout=StringIO())
+			replica = sqlite3.connect(connections.settings['replica']['NAME'])
+		# Закэшированное до обновления реплики (возможно, с ее старых строк) больше не отдается
+		self.assertNotEqual(self.client.get(url)['ETag'], etag)
+		try:
+			self.assertEqual(replica.execute('SELECT title FROM media_book').fetchall(), [('Replica',)])
+		finally:
+			replica.close()
+
+
+class BenchTests(TestCase):
+	def test_seed_and_run_scenarios(self):
+		self.assertEqual(bench.parse_scale('100k'), 100_000)
+		counts = bench.seed(40, batch_size=7)
+		self.assertEqual(counts, {'book': 16, 'movie': 12, 'audiobook': 12, 'rating': 40})
+		self.assertEqual(sum(Movie.objects.values_list('rating_count', flat=True)), 40)
+
+		results = bench.run(['list', 'detail', 'action', 'add_review'], repeat=4, warmup=1)
+		self.assertEqual(set(results), {'list', 'detail', 'action', 'add_review'})
+		for summary in results.values():
+			self.assertEqual((summary['requests'], summary['errors']), (4, 0))
+			self.assertLessEqual(summary['p50_ms'], summary['p95_ms'])
+		self.assertEqual(results['list']['queries_max'], 3)
+		# Выданная в последнем прогоне книга возвращается в конце
+		self.assertFalse(Book.objects.filter(is_borrowed=True).exists())
+
+	def test_action_alternates_independently_of_other_scenarios(self):
+		bench.seed(10, batch_size=10)
+		# form_save перед action не должен сбивать чередование аренды и возврата
+		results = bench.run(['form_save', 'action'], repeat=3, warmup=0)
+		self.assertEqual(results['action']['errors'], 0)
+		self.assertFalse(Book.objects.filter(is_borrowed=True).exists())
+
+	def test_compare_flags_slowdowns_and_extra_queries(self):
+		base = {'list': {'p50_ms': 10.0, 'p95_ms': 20.0, 'queries_max': 3}}
+		same = {'list': {'p50_ms': 11.0, 'p95_ms': 20.5, 'queries_max': 3}}
+		self.assertEqual(bench.compare(same, base), [])
+		slower = {'list': {'p50_ms': 10.0, 'p95_ms': 30.0, 'queries_max': 4}}
+		self.assertEqual(len(bench.compare(slower, base)), 2)
+
+
+def ratings_per_movie(request):
+	# Намеренный N+1: по запросу на каждый фильм
+	counts = [movie.ratings.count() for movie in Movie.objects.all()]
+	return HttpResponse(str(sum(counts)))
+
+
+class InstrumentedUrls:
+	urlpatterns = [
+		path('', include('media.urls')),
+		path('n-plus-one/', ratings_per_movie),
+	]
+
+
+@override_settings(MEDIA_INSTRUMENTATION=True, MEDIA_SLOW_REQUEST_MS=10_000, MEDIA_DUPLICATE_QUERY_THRESHOLD=3,
+				   ROOT_URLCONF=InstrumentedUrls)
+class InstrumentationMiddlewareTests(TestCase):
+	def setUp(self):
+		for i in range(4):
+			Movie.objects.create(title=f'M{i}', creator='C', publication_date='2020-01-01', duration=90, format='mp4')
+
+	def test_server_timing_and_stats(self):
+		resp = self.client.get(reverse('media_library:media_list'))
+		self.assertRegex(resp['Server-Timing'], r'^sql;dur=[\d.]+;desc="3 queries", total;dur=[\d.]+$')
+		self.assertEqual(resp.wsgi_request.query_stats.count, 3)
+
+	def test_duplicate_queries_logged(self):
+		with self.assertLogs('media.requests', 'WARNING') as logs:
+			self.client.get('/n-plus-one/')
+		record = json.loads(logs.records[0].getMessage())
+		self.assertEqual(record['event'], 'duplicate_queries')
+		self.assertEqual(record['duplicates'][0]['count'], 4)
+		self.assertEqual(record['queries'], 5)
+
+	@override_settings(MEDIA_SLOW_REQUEST_MS=0)
+	def test_slow_request_logged_with_view_name(self):
+		with self.assertLogs('media.requests', 'WARNING') as logs:
+			self.client.get(reverse('media_library:media_list'))
+		record = json.loads(logs.records[0].getMessage())
+		self.assertEqual((record['event'], record['view'], record['status']), ('slow_request', 'media_library:media_list', 200))
+		self.assertEqual(len(record['slowest']), 3)
+
+	@override_settings(MEDIA_INSTRUMENTATION=False)
+	def test_disabled_by_default(self):
+		self.assertNotIn('Server-Timing', self.client.get(reverse('media_library:media_list')))
+
+
+class AsyncUrls:
+	urlpatterns = [path('', include('media.async_urls'))]
+
+
+@override_settings(ROOT_URLCONF=AsyncUrls)
+class AsyncViewsTests(TransactionTestCase):
+	def setUp(self):
+		# Потоки пула держат соединения (CONN_MAX_AGE) до конца процесса, и файл -wal
+		# тестовой БД переживает ее удаление; в тестах закрываем их после каждого вызова
+		settings_patch = patch.dict(connections.settings['default'], {'CONN_MAX_AGE': 0})
+		settings_patch.start()
+		self.addCleanup(settings_patch.stop)
+		self.book = Book.objects.create(title='Async book', creator='A', publication_date='2000-01-01', isbn='1', page_count=10)
+		self.movie = Movie.objects.create(title='Async movie', creator='C', publication_date='2000-01-01', duration=90, format='mp4', director='D', genre='drama')
+		AudioBook.objects.create(title='Async audio', creator='A', publication_date='2000-01-01', duration=60, narrator='N')
+
+	async def test_list_fetches_all_types(self):
+		resp = await self.async_client.get(reverse('media_library:media_list'), {'genre': 'drama'})
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual([m.title for m in resp.context['movies']], ['Async movie'])
+		self.assertEqual(len(resp.context['media_items']), 3)
+		data = (await self.async_client.get(reverse('media_library:media_list_json'))).json()
+		self.assertEqual(data['audiobook']['results'][0]['title'], 'Async audio')
+		etag = resp['ETag']
+		resp = await self.async_client.get(reverse('media_library:media_list'), {'genre': 'drama'}, headers={'If-None-Match': etag})
+		self.assertEqual(resp.status_code, 304)
+
+	@override_settings(MEDIA_INSTRUMENTATION=True)
+	async def test_instrumentation_counts_queries_from_worker_threads(self):
+		resp = await AsyncClient().get(reverse('media_library:media_list'))
+		self.assertIn('desc="3 queries"', resp['Server-Timing'])
+
+	async def test_detail_action_and_review(self):
+		detail_url = reverse('media_library:media_detail', kwargs={'media_type': 'movie', 'pk': self.movie.pk})
+		self.assertEqual((await self.async_client.get(detail_url)).context['media_item'].title, 'Async movie')
+
+		action_url = reverse('media_library:media_action', kwargs={'media_type': 'book', 'item_id': self.book.pk})
+		resp = await self.async_client.post(action_url, {'action': 'borrow'}, headers={'X-Requested-With': 'XMLHttpRequest'})
+		self.assertIn('Гость', resp.json()['result'])
+		resp = await self.async_client.post(action_url, {'action': 'borrow'}, headers={'X-Requested-With': 'XMLHttpRequest'})
+		self.assertEqual(resp.status_code, 409)
+
+		review_url = reverse('media_library:media_add_review', kwargs={'media_type': 'movie', 'pk': self.movie.pk})
+		resp = await self.async_client.post(review_url, {'rating': 4, 'comment': 'ok'})
+		self.assertEqual(resp.status_code, 302)
+		movie = await Movie.objects.aget(pk=self.movie.pk)
+		self.assertEqual(movie.rating_count, 1)
@@ -1,14 +1,40 @@
-from django.urls import path
-from . import views
+from django.urls import path, register_converter
+from . import converters, views
+
+register_converter(converters.GlobalIdConverter, 'gid')
 
 app_name = 'media_library'
 
-urlpatterns = [
-    path('', views.MediaListView.as_view(), name='media_list'),
-    path('media/<str:media_type>/<int:pk>/', views.MediaDetailView.as_view(), name='media_detail'),
-    path('media/<str:media_type>/<int:pk>/review/', views.add_review, name='media_add_review'),
-    path('media/<str:media_type>/<int:item_id>/action/', views.media_action, name='media_action'),
-    path('media/create/', views.MediaCreateView.as_view(), name='media_create'),
-    path('media/<int:pk>/borrow/', views.borrow_media, name='borrow_media'),
-    path('media/<int:pk>/download/', views.download_media, name='download_media'),
-]
\ No newline at end of file
+
+def build_urlpatterns(pages):
+    # pages — модуль с реализациями списка, деталей, действий и отзывов:
+    # views (WSGI) или async_views (ASGI, см. media/async_urls.py)
+    return [
+        path('', pages.MediaListView.as_view(), name='media_list'),
+        path('api/media/', pages.MediaListJsonView.as_view(), name='media_list_json'),
+        path('api/media/<str:media_type>/<int:pk>/', views.media_detail_json, name='media_detail_json'),
+        path('api/actions/batch/', views.media_action_batch, name='media_action_batch'),
+        path('api/facets/', views.media_facets, name='media_facets'),
+        path('api/autocomplete/', views.media_autocomplete, name='media_autocomplete'),
+        path('api/search/', views.media_search, name='media_search'),
+        path('api/export/', views.export_media, name='media_export'),
+        path('api/leaderboard/', views.top_rated, name='leaderboard'),
+        path('api/leaderboard/trending/', views.trending, name='leaderboard_trending'),
+        path('media/item/<gid:ref>/', pages.MediaDetailView.as_view(), name='media_detail_global'),
+        path('media/<str:media_type>/<int:pk>/', pages.MediaDetailView.as_view(), name='media_detail'),
+        path('media/<str:media_type>/<int:pk>/review/', pages.add_review, name='media_add_review'),
+        path('media/<str:media_type>/<int:pk>/reviews/', views.media_reviews, name='media_reviews'),
+        path('media/<str:media_type>/<int:item_id>/action/', pages.media_action, name='media_action'),
+        path('media/<str:media_type>/<int:pk>/download/', views.media_file, {'action': 'download'},
+             name='media_file_download'),
+        path('media/<str:media_type>/<int:pk>/stream/', views.media_file, {'action': 'stream'}, name='media_file_stream'),
+        path('media/create/', views.MediaCreateView.as_view(), name='media_create'),
+        path('media/item/<gid:ref>/borrow/', views.borrow_media, name='borrow_media'),
+        path('media/item/<gid:ref>/download/', views.download_media, name='download_media'),
+        # Старые ссылки: число — первичный ключ в таблице типа
+        path('media/<int:pk>/borrow/', views.borrow_media, name='borrow_media_by_pk'),
+        path('media/<int:pk>/download/', views.download_media, name='download_media_by_pk'),
+    ]
+
+
+urlpatterns = build_urlpatterns(views)
@@ -1,62 +1,317 @@
 # views.py
-from django.http import JsonResponse
-from django.shortcuts import render, redirect
+import hashlib
+import json
+import logging
+import os
+from functools import partial
+
+from django.conf import settings
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render, redirect
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
 from django.views.generic import ListView, DetailView, TemplateView
 
+from . import cache as media_cache
+from . import api, autocomplete, export, files, leaderboard, search
+from .actions import registry, request_username
+from .catalog import CatalogQuery
 from .forms import MediaForm
+from .mixins import BorrowError
 from .models import Book, AudioBook, Movie
-from .services import MediaFactory
-from django.views.decorators.http import require_POST
+from .services import BatchActionService, MediaFactory
+from django.views.decorators.http import require_POST, require_safe
 from django.contrib import messages
 
+logger = logging.getLogger(__name__)
 
-class MediaListView(ListView):
+
+class ConditionalGetMixin:
+    """Условный GET: ETag из версий в кэше и Last-Modified.
+
+    Проверка If-None-Match не обращается к БД: 304 отдается до выборки
+    данных и рендеринга шаблона. Версии увеличиваются при любом изменении
+    объектов (см. media/cache.py).
+    """
+
+    def get_etag(self):
+        return None
+
+    def get_last_modified(self):
+        return None
+
+    def make_etag(self, *parts):
+        # В ETag входит и пользователь: страница зависит от того, кто вошел
+        user = getattr(self.request, 'user', None)
+        digest = hashlib.md5(repr((*parts, getattr(user, 'pk', None))).encode()).hexdigest()
+        return quote_etag(digest)
+
+    def not_modified_response(self):
+        self.etag = self.get_etag()
+        # Last-Modified (может требовать запроса) нужен, только если клиент не прислал ETag
+        last_modified = None
+        if 'HTTP_IF_NONE_MATCH' not in self.request.META and 'HTTP_IF_MODIFIED_SINCE' in self.request.META:
+            last_modified = self.get_last_modified()
+        response = get_conditional_response(self.request, etag=self.etag, last_modified=last_modified)
+        if response is not None and self.etag:
+            response['ETag'] = self.etag
+        return response
+
+    def add_validators(self, response):
+        if self.etag and response.status_code == 200:
+            response['ETag'] = self.etag
+            last_modified = self.get_last_modified()
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            # Браузер хранит страницу, но перед показом всегда перепроверяет ее
+            patch_cache_control(response, no_cache=True)
+        return response
+
+
+class MediaListView(ConditionalGetMixin, ListView):
     template_name = 'media_library/media_list.html'
     context_object_name = 'media_items'
+    paginate_by = 12
 
     def get_queryset(self):
-        books = list(Book.objects.all())
-        audiobooks = list(AudioBook.objects.all())
-        movies_qs = Movie.objects.all()
+        # Параметры разбираются один раз; каждая секция пагинируется отдельно,
+        # в object_list — только текущие страницы
+        self.catalog = CatalogQuery.from_request(self.request)
+        self.pages = self.catalog.get_pages(self.paginate_by, self.get_projection())
+        return [item for page in self.pages.values() for item in page]
+
+    def get_projection(self):
+        # Функция (тип, queryset, столбец сортировки) -> queryset; None — полные модели
+        return None
 
-        # Фильтрация по параметрам запроса (по названию, жанру, режиссеру)
-        q = self.request.GET.get('q')
-        genre = self.request.GET.get('genre')
-        director = self.request.GET.get('director')
+    def paginate_queryset(self, queryset, page_size):
+        # Пагинацию уже выполнил CatalogQuery.get_pages
+        return None, None, queryset, False
 
-        if q:
-            movies_qs = movies_qs.filter(title__icontains=q)
-        if genre:
-            movies_qs = movies_qs.filter(genre=genre)
-        if director:
-            movies_qs = movies_qs.filter(director__icontains=director)
+    def get(self, request, *args, **kwargs):
+        return self.not_modified_response() or self.add_validators(super().get(request, *args, **kwargs))
+
+    def get_etag(self):
+        versions = media_cache.get_type_versions(MediaFactory.get_all_media_types())
+        params = sorted((key, self.request.GET.getlist(key)) for key in self.request.GET)
+        return self.make_etag(type(self).__name__, media_cache.get_generation(), sorted(versions.items()), params)
 
-        movies = list(movies_qs)
-        return books + movies + audiobooks
+    def get_last_modified(self):
+        return max(media_cache.get_type_modified(media_type) for media_type in MediaFactory.get_all_media_types())
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Группируем по типам для отображения
-        context['books'] = Book.objects.all()
-        # Применим ту же фильтрацию, что и в get_queryset для показа фильтрованных фильмов
-        movies_qs = Movie.objects.all()
-        q = self.request.GET.get('q')
-        genre = self.request.GET.get('genre')
-        director = self.request.GET.get('director')
-        if q:
-            movies_qs = movies_qs.filter(title__icontains=q)
-        if genre:
-            movies_qs = movies_qs.filter(genre=genre)
-        if director:
-            movies_qs = movies_qs.filter(director__icontains=director)
-
-        context['movies'] = movies_qs
-        context['audiobooks'] = AudioBook.objects.all()
+        context['books'] = self.pages['book'].object_list
+        context['movies'] = self.pages['movie'].object_list
+        context['audiobooks'] = self.pages['audiobook'].object_list
+        context['pages'] = self.pages
         context['genres'] = Movie.GENRE_CHOICES
+        context['sort_choices'] = CatalogQuery.SORT_CHOICES
+        context['capabilities'] = registry.capabilities_by_type()
+        context['cards'] = {
+            media_type: media_cache.get_cards(
+                media_type, page.object_list,
+                partial(self.render_card, media_type, context['capabilities']),
+                settings.MEDIA_CARD_CACHE_TIMEOUT,
+            )
+            for media_type, page in self.pages.items()
+        }
         return context
 
+    @staticmethod
+    def render_card(media_type, capabilities, media_item):
+        # Карточка не зависит от пользователя и запроса — рендерим без RequestContext
+        return render_to_string(f'media_library/_card_{media_type}.html',
+                                {media_type: media_item, 'capabilities': capabilities})
+
+
+class MediaListJsonView(MediaListView):
+    """Каталог в JSON с теми же фильтрами, что и главная страница.
+
+    ?fields=title,creator — только нужные поля; строки выбираются проекцией
+    .values(), без создания моделей.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return self.parse_fields() or super().get(request, *args, **kwargs)
+
+    def parse_fields(self):
+        try:
+            self.fields = api.parse_fields(self.request.GET.get('fields'), MediaFactory.get_all_media_types())
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return None
+
+    def get_projection(self):
+        return lambda media_type, queryset, *extra: api.project(queryset, self.fields[media_type], *extra)
+
+    def get_context_data(self, **kwargs):
+        # Ответу нужны только self.pages — карточки не рендерим
+        return {}
+
+    def render_to_response(self, context, **response_kwargs):
+        data = {
+            media_type: {
+                'results': [api.to_record(row, media_type, self.fields[media_type]) for row in page],
+                'next': page.next_cursor,
+                'previous': page.previous_cursor,
+            }
+            for media_type, page in self.pages.items()
+        }
+        return api.json_response(data)
+
+
+def serialize_media_item(item):
+    data = {
+        'id': item.pk,
+        'media_type': item.get_media_type(),
+        'title': item.title,
+        'creator': item.creator,
+        'publication_date': item.publication_date,
+    }
+    if isinstance(item, Book):
+        data.update(isbn=item.isbn, page_count=item.page_count, is_borrowed=item.is_borrowed)
+    elif isinstance(item, Movie):
+        data.update(duration=item.duration, format=item.format, director=item.director,
+                    genre=item.genre, rating=item.get_average_rating(), rating_count=item.rating_count)
+    elif isinstance(item, AudioBook):
+        data.update(duration=item.duration, narrator=item.narrator, is_borrowed=item.is_borrowed)
+    return data
+
+
+def _get_limit(request, default, maximum):
+    # limit из запроса в пределах 1..maximum; отрицательный LIMIT SQLite считает «без ограничения»
+    return min(max(int(request.GET.get('limit', default)), 1), maximum)
+
+
+@require_safe
+def media_facets(request):
+    # Счетчики для фильтров списка с теми же параметрами q, genre, director
+    return api.json_response(CatalogQuery.from_request(request).get_facets())
+
+
+@require_safe
+def media_autocomplete(request):
+    # Подсказки для поля поиска: из индекса в памяти, без запросов к БД
+    try:
+        limit = _get_limit(request, 10, 20)
+    except ValueError:
+        return JsonResponse({'error': 'Некорректный limit'}, status=400)
+    suggestions = autocomplete.index.suggest(request.GET.get('q', ''), limit)
+    return api.json_response({'suggestions': [
+        {'text': text, 'field': field, **({'media_type': media_type, 'id': pk} if media_type else {})}
+        for field, text, media_type, pk in suggestions
+    ]})
+
+
+def media_search(request):
+    # Ранжированный (bm25) поиск по всем типам; объекты догружаются одним запросом на тип
+    query = request.GET.get('q', '')
+    media_type = request.GET.get('type')
+    if media_type and not MediaFactory.get_media_class(media_type):
+        return JsonResponse({'error': 'Неизвестный тип медиа'}, status=400)
+    try:
+        limit = _get_limit(request, 20, 100)
+    except ValueError:
+        return JsonResponse({'error': 'Некорректный limit'}, status=400)
+
+    media_types = [media_type] if media_type else MediaFactory.get_all_media_types()
+    try:
+        fields = api.parse_fields(request.GET.get('fields'), media_types)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    hits = search.search_media(query, [media_type] if media_type else None, limit)
+    ids_by_type = {}
+    for hit_type, item_id, _ in hits:
+        ids_by_type.setdefault(hit_type, []).append(item_id)
+    rows = {
+        hit_type: {row['id']: row for row in api.project(
+            MediaFactory.get_media_class(hit_type).objects.filter(pk__in=ids), fields[hit_type])}
+        for hit_type, ids in ids_by_type.items()
+    }
+
+    results = []
+    for hit_type, item_id, rank in hits:
+        row = rows[hit_type].get(item_id)
+        if row is not None:
+            results.append({**api.to_record(row, hit_type, fields[hit_type]), 'rank': rank})
+    return api.json_response({'query': query, 'results': results})
+
+
+@require_safe
+def media_detail_json(request, media_type, pk):
+    # Один объект в JSON; ?fields= — как у списка
+    media_class = MediaFactory.get_media_class(media_type)
+    if not media_class:
+        return JsonResponse({'error': 'Неизвестный тип медиа'}, status=404)
+    try:
+        fields = api.parse_fields(request.GET.get('fields'), [media_type])[media_type]
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    row = api.project(media_class.objects.filter(pk=pk), fields).first()
+    if row is None:
+        return JsonResponse({'error': 'Объект не найден'}, status=404)
+    return api.json_response(api.to_record(row, media_type, fields))
+
+
+def export_media(request):
+    # Потоковая выгрузка всего каталога: память не зависит от размера каталога
+    file_format = request.GET.get('format', 'ndjson')
+    if file_format not in export.FORMATS:
+        return JsonResponse({'error': 'Неизвестный формат'}, status=400)
+    media_types = request.GET.getlist('type') or None
+    if media_types and not all(MediaFactory.get_media_class(t) for t in media_types):
+        return JsonResponse({'error': 'Неизвестный тип медиа'}, status=400)
+
+    chunks = export.iter_export(file_format, media_types)
+    filename = f'media.{file_format}'
+    content_type = export.FORMATS[file_format]
+    if request.GET.get('compress') == 'gzip':
+        chunks = export.gzip_stream(chunks)
+        filename += '.gz'
+        content_type = 'application/gzip'
+
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _leaderboard_response(request, fetch, **extra):
+    genre = request.GET.get('genre') or None
+    if genre and genre not in dict(Movie.GENRE_CHOICES):
+        return JsonResponse({'error': 'Неизвестный жанр'}, status=400)
+    try:
+        limit = _get_limit(request, 10, 100)
+        min_votes = max(int(request.GET.get('min_votes', 1)), 1)
+    except ValueError:
+        return JsonResponse({'error': 'Некорректный limit или min_votes'}, status=400)
+
+    entries = fetch(genre=genre, limit=limit, min_votes=min_votes, **extra)
+    results = [
+        {**serialize_media_item(movie), 'score': round(score, 4), 'votes': votes}
+        for movie, score, votes in entries
+    ]
+    return JsonResponse({'genre': genre, **extra, 'results': results})
+
 
-class MediaDetailView(DetailView):
+def top_rated(request):
+    # Лидерборд за все время; ?genre= — внутри жанра
+    return _leaderboard_response(request, leaderboard.top_movies)
+
+
+def trending(request):
+    # Лидерборд по оценкам за последние ?days= дней
+    try:
+        days = min(max(int(request.GET.get('days', 7)), 1), 365)
+    except ValueError:
+        return JsonResponse({'error': 'Некорректный days'}, status=400)
+    return _leaderboard_response(request, leaderboard.trending_movies, days=days)
+
+
+class MediaDetailView(ConditionalGetMixin, DetailView):
     template_name = 'media_library/media_detail.html'
     context_object_name = 'media_item'
 
@@ -67,79 +322,106 @@ class MediaDetailView(DetailView):
         if media_type:
             media_class = MediaFactory.get_media_class(media_type)
             if not media_class:
-                raise Book.DoesNotExist("Media item not found")
-            try:
-                return media_class.objects.get(pk=pk)
-            except media_class.DoesNotExist:
-                raise media_class.DoesNotExist("Media item not found")
-
-        # Фоллбек: пробуем найти по всем типам (устаревший путь)
-        for media_type in MediaFactory.get_all_media_types():
-            media_class = MediaFactory.get_media_class(media_type)
-            try:
-                return media_class.objects.get(pk=pk)
-            except media_class.DoesNotExist:
-                continue
-        raise Book.DoesNotExist("Media item not found")
+                raise Http404("Media item not found")
+            return get_object_or_404(media_class, pk=pk)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        media_item = self.object
+        # Без типа в URL — ищем по глобальному id через MediaIndex
+        media_item = MediaFactory.resolve(self.kwargs.get('ref'))
+        if media_item is None:
+            raise Http404("Media item not found")
+        return media_item
 
-        # Определяем доступные действия на основе типа объекта и миксинов
-        context['available_actions'] = self.get_available_actions(media_item)
-        context['media_type'] = self.get_media_type(media_item)
+    def get(self, request, *args, **kwargs):
+        not_modified = self.not_modified_response()
+        if not_modified:
+            return not_modified
+        self.load_detail_data()
+        context = self.get_context_data(object=self.object)
+        return self.add_validators(self.render_to_response(context))
+
+    def get_etag(self):
+        # Для глобального id тип известен только после запроса к MediaIndex — без ETag
+        media_type, pk = self.kwargs.get('media_type'), self.kwargs.get('pk')
+        if not media_type or not MediaFactory.get_media_class(media_type):
+            return None
+        return self.make_etag('detail', media_type, pk, media_cache.get_generation(),
+                              media_cache.get_item_version(media_type, pk))
+
+    def get_last_modified(self):
+        media_item = getattr(self, 'object', None)
+        if media_item is not None:
+            return int(media_item.updated_at.timestamp())
+        media_class = MediaFactory.get_media_class(self.kwargs['media_type'])
+        updated_at = media_class.objects.filter(pk=self.kwargs['pk']).values_list('updated_at', flat=True).first()
+        return int(updated_at.timestamp()) if updated_at else None
+
+    def load_detail_data(self):
+        media_type, pk = self.kwargs.get('media_type'), self.kwargs.get('pk')
+        if not media_type:
+            # Глобальный id: тип и pk известны только после поиска в MediaIndex
+            self.object = self.get_object()
+            media_type, pk = self.object.get_media_type(), self.object.pk
+
+        # Данные страницы (объект, действия, рейтинг, отзывы) берутся из кэша
+        # по ключу (тип, pk, версия); версия меняется при любом изменении объекта
+        self.detail_data = media_cache.get_detail_context(media_type, pk, self.build_detail_data)
+        self.object = self.detail_data['media_item']
+
+    def build_detail_data(self):
+        media_item = getattr(self, 'object', None) or self.get_object()
+        data = {'media_item': media_item}
+
+        # Доступные действия и возможности типа — из реестра, заполненного при загрузке моделей
+        data['available_actions'] = self.get_available_actions(media_item)
+        data['media_type'] = media_item.get_media_type()
+        capabilities = registry.get_capabilities(data['media_type'])
 
         # Рейтинги и отзывы — подготовим в контексте, т.к. шаблон не вызывает методы
         if hasattr(media_item, 'get_average_rating') and callable(getattr(media_item, 'get_average_rating')):
-            context['avg_rating'] = media_item.get_average_rating()
+            data['avg_rating'] = media_item.get_average_rating()
         else:
-            context['avg_rating'] = None
+            data['avg_rating'] = None
 
-        if hasattr(media_item, 'get_reviews') and callable(getattr(media_item, 'get_reviews')):
-            try:
-                context['reviews'] = list(media_item.get_reviews())
-            except Exception:
-                context['reviews'] = []
-        else:
-            context['reviews'] = []
+        # Только первая (самая новая) страница отзывов; остальные подгружаются через media_reviews
+        data['reviews'] = []
+        data['reviews_next_cursor'] = None
+        if hasattr(media_item, 'get_reviews_page') and callable(getattr(media_item, 'get_reviews_page')):
+            page = media_item.get_reviews_page()
+            data['reviews'] = page.object_list
+            data['reviews_next_cursor'] = page.next_cursor
+
+        data['can_add_review'] = 'review' in capabilities
 
-        context['can_add_review'] = hasattr(media_item, 'add_review') and callable(getattr(media_item, 'add_review', None))
+        return data
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(self.detail_data)
         return context
 
     def get_available_actions(self, media_item):
-        actions = []
-
-        # Базовые действия
-        actions.append(('describe', 'Описание', 'btn-primary'))
-
-        # Действия в зависимости от типа и миксинов
-        if hasattr(media_item, 'read_sample'):
-            actions.append(('read', 'Читать отрывок', 'btn-info'))
+        return registry.get_available_actions(media_item)
 
-        if hasattr(media_item, 'play_trailer'):
-            actions.append(('play_trailer', 'Смотреть трейлер', 'btn-warning'))
-
-        if hasattr(media_item, 'stream'):
-            actions.append(('stream', 'Смотреть онлайн', 'btn-dark'))
-
-        if hasattr(media_item, 'borrow') and not media_item.is_borrowed:
-            actions.append(('borrow', 'Взять в аренду', 'btn-success'))
+    def get_media_type(self, media_item):
+        return media_item.get_media_type()
 
-        if hasattr(media_item, 'download'):
-            actions.append(('download', 'Скачать', 'btn-secondary'))
 
-        return actions
+def media_reviews(request, media_type, pk):
+    # Подгрузка следующей страницы отзывов ("Показать еще") по курсору
+    media_class = MediaFactory.get_media_class(media_type)
+    if not media_class or not hasattr(media_class, 'get_reviews_page'):
+        return JsonResponse({'error': 'Тип медиа не поддерживает отзывы'}, status=400)
+    try:
+        media_item = media_class.objects.only('pk').get(pk=pk)
+    except media_class.DoesNotExist:
+        return JsonResponse({'error': 'Объект не найден'}, status=404)
 
-    def get_media_type(self, media_item):
-        if isinstance(media_item, Book):
-            return 'book'
-        elif isinstance(media_item, Movie):
-            return 'movie'
-        elif isinstance(media_item, AudioBook):
-            return 'audiobook'
-        return 'unknown'
+    page = media_item.get_reviews_page(request.GET.get('cursor'))
+    results = [
+        {'id': review.pk, 'rating': review.rating, 'comment': review.comment, 'created_at': review.created_at}
+        for review in page
+    ]
+    return JsonResponse({'results': results, 'next_cursor': page.next_cursor})
 
 
 class MediaCreateView(TemplateView):
@@ -150,14 +432,13 @@ class MediaCreateView(TemplateView):
         return render(request, self.template_name, {'form': form})
 
     def post(self, request, *args, **kwargs):
-        form = MediaForm(request.POST)
+        form = MediaForm(request.POST, request.FILES)
         if form.is_valid():
             # Используем фабрику через форму
             form.save()
             return redirect('media_library:media_list')
-        # Debug: log form errors to console to help diagnose why save didn't occur
-        if form.errors:
-            print('MediaForm errors:', form.errors.as_json())
+        logger.info('Форма медиа не прошла проверку: %s',
+                    json.dumps(form.errors.get_json_data(), ensure_ascii=False))
         return render(request, self.template_name, {'form': form})
 
 
@@ -167,41 +448,15 @@ def media_action(request, media_type, item_id):
     if not media_class:
         return JsonResponse({'error': 'Неизвестный тип медиа'}, status=400)
 
-    # Диспетчеризация через словарь
-    action_handlers = {
-        'book': {
-            'describe': lambda obj: obj.get_description(),
-            'read': lambda obj: obj.read_sample(),
-            'borrow': lambda obj: obj.borrow(request.user.username if request.user.is_authenticated else 'Гость'),
-            'download': lambda obj: "Книги недоступны для скачивания",
-        },
-        'audiobook': {
-            'describe': lambda obj: obj.get_description(),
-            'download': lambda obj: obj.download(),
-            'borrow': lambda obj: obj.borrow(request.user.username if request.user.is_authenticated else 'Гость'),
-            'play_trailer': lambda obj: "Аудиокниги не имеют трейлеров",
-        }
-        ,
-        'movie': {
-            'describe': lambda obj: obj.get_description(),
-            'play_trailer': lambda obj: obj.play_trailer(),
-            'stream': lambda obj: obj.stream(),
-            'download': lambda obj: obj.download(),
-        }
-    }
-
-    action = request.POST.get('action', 'describe')
-
-    # Получаем обработчик действия
-    handler_dict = action_handlers.get(media_type, {})
-    handler = handler_dict.get(action)
-    if not handler:
+    # Диспетчеризация через реестр действий: O(1) поиск, без построения словаря на запрос
+    action = registry.get_action(media_type, request.POST.get('action', 'describe'))
+    if not action:
         return JsonResponse({'error': 'Неизвестное действие'}, status=400)
 
     # Получаем объект и выполняем действие
     try:
         item = media_class.objects.get(id=item_id)
-        result = handler(item)
+        result = action.run(item, request)
 
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({'result': result})
@@ -210,38 +465,80 @@ def media_action(request, media_type, item_id):
 
     except media_class.DoesNotExist:
         return JsonResponse({'error': 'Объект не найден'}, status=404)
+    except BorrowError as e:
+        return JsonResponse({'error': str(e)}, status=409)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
 
 
-def borrow_media(request, pk):
-    # Используем фабрику для поиска объекта
-    for media_type in MediaFactory.get_all_media_types():
-        media_class = MediaFactory.get_media_class(media_type)
-        try:
-            item = media_class.objects.get(pk=pk)
-            if hasattr(item, 'borrow'):
-                result = item.borrow(request.user.username if request.user.is_authenticated else 'Гость')
-                return JsonResponse({'result': result})
-        except media_class.DoesNotExist:
-            continue
+@require_POST
+def media_action_batch(request):
+    """Пакет действий над объектами разных типов: {"actions": [{"media_type", "id", "action"}, ...]}.
+
+    Ответ — {"results": [...]} в порядке действий, у каждого свой status;
+    ошибка одного действия не отменяет остальные.
+    """
+    try:
+        operations = json.loads(request.body)['actions']
+        if not isinstance(operations, list):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Ожидается JSON вида {"actions": [...]}'}, status=400)
+    if len(operations) > settings.MEDIA_BATCH_MAX_ACTIONS:
+        return JsonResponse({'error': f'Не больше {settings.MEDIA_BATCH_MAX_ACTIONS} действий за запрос'},
+                            status=400)
+
+    try:
+        results = BatchActionService.run(operations, request)
+    except BorrowError as e:
+        # Параллельный запрос изменил объекты пакета: транзакция откатана целиком
+        return JsonResponse({'error': str(e)}, status=409)
+    return JsonResponse({'results': results})
 
-    return JsonResponse({'error': 'Невозможно взять в аренду'}, status=400)
 
+def _find_item(ref, pk, capability):
+    # ref — глобальный id (/media/item/<ref>/...), pk — первичный ключ из старых ссылок /media/<pk>/...
+    item = MediaFactory.resolve(ref) if ref is not None else MediaFactory.find_by_pk(pk, capability)
+    if item is not None and capability in registry.get_capabilities(item.get_media_type()):
+        return item
+    return None
 
-def download_media(request, pk):
 
-    for media_type in MediaFactory.get_all_media_types():
-        media_class = MediaFactory.get_media_class(media_type)
+def borrow_media(request, ref=None, pk=None):
+    # Один поиск по глобальному индексу вместо перебора всех типов
+    item = _find_item(ref, pk, 'borrow')
+    if item is not None:
         try:
-            item = media_class.objects.get(pk=pk)
-            if hasattr(item, 'download'):
-                result = item.download()
-                return JsonResponse({'result': result})
-        except media_class.DoesNotExist:
-            continue
+            result = item.borrow(request_username(request))
+        except BorrowError as e:
+            return JsonResponse({'error': str(e)}, status=409)
+        return JsonResponse({'result': result})
+
+    return JsonResponse({'error': 'Невозможно взять в аренду'}, status=400)
+
+
+def download_media(request, ref=None, pk=None):
+    item = _find_item(ref, pk, 'download')
+    if item is not None:
+        result = item.download()
+        return JsonResponse({'result': result})
 
     return JsonResponse({'error': 'Невозможно скачать'}, status=400)
 
 
+@require_safe
+def media_file(request, media_type, pk, action):
+    # download — вложение, stream — просмотр в браузере; оба поддерживают Range
+    media_class = MediaFactory.get_media_class(media_type)
+    if not media_class or action not in registry.get_capabilities(media_type) or not hasattr(media_class, 'media_file'):
+        raise Http404('Файл недоступен')
+    item = get_object_or_404(media_class.objects.only('title', 'media_file'), pk=pk)
+    if not item.media_file:
+        raise Http404('Файл не загружен')
+    filename = item.title + os.path.splitext(item.media_file.name)[1]
+    return files.serve_file(request, item.media_file, filename, as_attachment=(action == 'download'))
+
+
 @require_POST
 def add_review(request, media_type, pk):
     media_class = MediaFactory.get_media_class(media_type)
@@ -255,7 +552,7 @@ def add_review(request, media_type, pk):
         messages.error(request, 'Объект не найден')
         return redirect('media_library:media_list')
 
-    if not hasattr(item, 'add_review'):
+    if 'review' not in registry.get_capabilities(media_type):
         messages.error(request, 'Нельзя оставить отзыв для этого типа медиа')
         return redirect('media_library:media_detail', media_type=media_type, pk=pk)
 